@@ -0,0 +1,333 @@
+"""Benchmarks jupyter-forward's tunnel and startup path against a local SSH stand-in.
+
+An in-process paramiko SSH server (see `sshd.py`) plays the remote host and a fake
+``jupyter`` (see ``bin/jupyter``) plays Jupyter Lab, so the whole suite runs on a
+single machine without network access. Results are written as JSON:
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --quick --only throughput,latency --backends engine
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import concurrent.futures
+import contextlib
+import getpass
+import http.client
+import json
+import os
+import pathlib
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+from fabric import Connection
+
+import jupyter_forward
+from jupyter_forward.console import console
+from jupyter_forward.forwarding import ForwardingEngine
+from jupyter_forward.helpers import find_available_port, wait_for_server
+
+from .servers import read_frame, start_http_server, websocket_accept, write_frame
+from .sshd import LocalSSHServer
+
+BIN_DIR = pathlib.Path(__file__).parent / 'bin'
+BENCHMARKS = ('throughput', 'latency', 'concurrency', 'startup')
+BACKENDS = ('engine', 'fabric')
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def summarize(samples):
+    """Returns latency percentiles in milliseconds"""
+    ms = sorted(sample * 1000 for sample in samples)
+    cuts = statistics.quantiles(ms, n=100, method='inclusive')
+    return {
+        'count': len(ms),
+        'mean_ms': statistics.fmean(ms),
+        'min_ms': ms[0],
+        'p50_ms': cuts[49],
+        'p90_ms': cuts[89],
+        'p99_ms': cuts[98],
+        'max_ms': ms[-1],
+    }
+
+
+class Environment:
+    """Temporary HOME, cache directory, SSH key and servers shared by all benchmarks"""
+
+    def __enter__(self):
+        self._stack = contextlib.ExitStack()
+        tmp = pathlib.Path(self._stack.enter_context(tempfile.TemporaryDirectory()))
+        self.home = tmp / 'home'
+        self.home.mkdir()
+        (tmp / 'tmp').mkdir()
+        (self.home / '.bash_profile').write_text(
+            f'export PATH={BIN_DIR}:$PATH\nexport TMPDIR={tmp / "tmp"}\n'
+        )
+        self.keyfile = str(tmp / 'id_rsa')
+        paramiko.RSAKey.generate(2048).write_private_key_file(self.keyfile)
+        # Keep the user's host facts cache untouched and never open a browser
+        os.environ['XDG_CACHE_HOME'] = str(tmp / 'cache')
+        os.environ['BROWSER'] = 'true'
+
+        self.sshd = self._stack.enter_context(LocalSSHServer(env={'HOME': str(self.home)}))
+        self.host = f'{getpass.getuser()}@127.0.0.1:{self.sshd.port}'
+        self.http_server, _ = start_http_server(daemon=True)
+        self._stack.callback(self.http_server.shutdown)
+        self.http_port = self.http_server.server_address[1]
+        self.connection = Connection(self.host, connect_kwargs={'key_filename': [self.keyfile]})
+        self.connection.open()
+        self._stack.callback(self.connection.close)
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+
+    @contextlib.contextmanager
+    def forward(self, backend):
+        """Forwards a free local port to the dummy HTTP server and yields it"""
+        if backend == 'fabric':
+            port = find_available_port(20000)
+            with self.connection.forward_local(
+                port, remote_port=self.http_port, remote_host='127.0.0.1'
+            ):
+                wait_for_server(port, timeout=10)
+                yield port
+            return
+        with ForwardingEngine() as engine:
+            forward = engine.forward(
+                self.connection.client.get_transport(), '127.0.0.1', self.http_port
+            )
+            yield forward.local_port
+
+
+def fetch(port, size, buffer=None):
+    """Downloads `size` bytes through the tunnel and returns the elapsed seconds"""
+    buffer = buffer or bytearray(2**18)
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection('localhost', port, timeout=60)
+    try:
+        connection.request('GET', f'/bytes/{size}')
+        response = connection.getresponse()
+        received = 0
+        while count := response.readinto(buffer):
+            received += count
+    finally:
+        connection.close()
+    if received != size:
+        raise RuntimeError(f'Received {received} of {size} bytes')
+    return time.perf_counter() - start
+
+
+def bench_throughput(env, backend, args):
+    size = args.size
+    with env.forward(backend) as port:
+        fetch(port, 2**20)
+        timings = [fetch(port, size) for _ in range(args.repeat)]
+    rates = [size / elapsed / 1e6 for elapsed in timings]
+    return {
+        'bytes': size,
+        'repeat': args.repeat,
+        'best_mb_per_s': max(rates),
+        'median_mb_per_s': statistics.median(rates),
+    }
+
+
+def _websocket_roundtrips(port, count):
+    sock = socket.create_connection(('localhost', port), timeout=30)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    with sock:
+        key = base64.b64encode(os.urandom(16)).decode()
+        sock.sendall(
+            (
+                f'GET /ws HTTP/1.1\r\nHost: localhost:{port}\r\nUpgrade: websocket\r\n'
+                f'Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n'
+                'Sec-WebSocket-Version: 13\r\n\r\n'
+            ).encode()
+        )
+        response = b''
+        while b'\r\n\r\n' not in response:
+            response += sock.recv(1)
+        if websocket_accept(key).encode() not in response:
+            raise RuntimeError('Websocket handshake failed')
+        samples = []
+        message = os.urandom(32)
+        for _ in range(count):
+            start = time.perf_counter()
+            write_frame(sock, message, mask=True)
+            if read_frame(sock) != message:
+                raise RuntimeError('Websocket echo mismatch')
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_latency(env, backend, args):
+    count = args.requests
+    with env.forward(backend) as port:
+        fresh = []
+        for _ in range(count):
+            start = time.perf_counter()
+            connection = http.client.HTTPConnection('localhost', port, timeout=30)
+            connection.request('GET', '/api')
+            connection.getresponse().read()
+            connection.close()
+            fresh.append(time.perf_counter() - start)
+
+        kept = []
+        connection = http.client.HTTPConnection('localhost', port, timeout=30)
+        for _ in range(count):
+            start = time.perf_counter()
+            connection.request('GET', '/api')
+            connection.getresponse().read()
+            kept.append(time.perf_counter() - start)
+        connection.close()
+
+        websocket = _websocket_roundtrips(port, count)
+    return {
+        'new_connection': summarize(fresh),
+        'keep_alive': summarize(kept),
+        'websocket_echo': summarize(websocket),
+    }
+
+
+def bench_concurrency(env, backend, args):
+    size = args.concurrent_size
+    results = []
+    with env.forward(backend) as port:
+        for clients in args.clients:
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=clients) as pool:
+                timings = list(pool.map(lambda _: fetch(port, size), range(clients)))
+            elapsed = time.perf_counter() - start
+            results.append(
+                {
+                    'clients': clients,
+                    'bytes_per_client': size,
+                    'wall_s': elapsed,
+                    'aggregate_mb_per_s': clients * size / elapsed / 1e6,
+                    'slowest_client_s': max(timings),
+                }
+            )
+    return results
+
+
+def _time_to_ready(env, backend, refresh, timeout=60.0):
+    start = time.perf_counter()
+    runner = jupyter_forward.RemoteRunner(
+        env.host,
+        port=find_available_port(30000),
+        identity=env.keyfile,
+        refresh=refresh,
+        show_progress=False,
+        follow_logs=False,
+        forwarding_backend=backend,
+    )
+    thread = threading.Thread(target=runner.start)
+    thread.start()
+    try:
+        if not runner._ready.wait(timeout):
+            raise RuntimeError(f'Jupyter Lab was not ready within {timeout} seconds')
+        elapsed = time.perf_counter() - start
+    finally:
+        runner.stop()
+        thread.join()
+    return elapsed, runner.metrics.round_trips
+
+
+def bench_startup(env, backend, args):
+    results = {}
+    for name, refresh in (('cold_cache', True), ('warm_cache', False)):
+        samples = []
+        round_trips = []
+        for _ in range(args.startup_repeat):
+            elapsed, count = _time_to_ready(env, backend, refresh)
+            samples.append(elapsed)
+            round_trips.append(count)
+        results[name] = {
+            'repeat': args.startup_repeat,
+            'median_s': statistics.median(samples),
+            'min_s': min(samples),
+            'max_s': max(samples),
+            'round_trips': max(round_trips),
+        }
+    return results
+
+
+def metadata():
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'jupyter_forward': jupyter_forward.__version__,
+        'paramiko': paramiko.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks', description=__doc__.split('\n')[0]
+    )
+    parser.add_argument('--output', '-o', help='Write results to this JSON file (default: stdout)')
+    parser.add_argument(
+        '--only', default=','.join(BENCHMARKS), help='Comma-separated benchmarks to run'
+    )
+    parser.add_argument(
+        '--backends', default=','.join(BACKENDS), help='Comma-separated forwarding backends'
+    )
+    parser.add_argument('--quick', action='store_true', help='Smaller sizes and fewer repeats')
+    parser.add_argument('--verbose', action='store_true', help='Show jupyter-forward output')
+    args = parser.parse_args(argv)
+    args.only = [name for name in args.only.split(',') if name]
+    args.backends = [name for name in args.backends.split(',') if name]
+    for name in args.only:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name!r}, choose from {BENCHMARKS}')
+    for name in args.backends:
+        if name not in BACKENDS:
+            parser.error(f'unknown backend {name!r}, choose from {BACKENDS}')
+    args.size = 16 * 2**20 if args.quick else 256 * 2**20
+    args.repeat = 2 if args.quick else 5
+    args.requests = 50 if args.quick else 500
+    args.clients = [1, 4, 16] if args.quick else [1, 2, 4, 8, 16, 32, 64]
+    args.concurrent_size = 2**20 if args.quick else 8 * 2**20
+    args.startup_repeat = 1 if args.quick else 3
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    console.quiet = not args.verbose
+    functions = {
+        'throughput': bench_throughput,
+        'latency': bench_latency,
+        'concurrency': bench_concurrency,
+        'startup': bench_startup,
+    }
+    report = {'metadata': metadata(), 'results': {}}
+    # Commands echoed by invoke go to stdout, which is reserved for the report
+    with contextlib.redirect_stdout(sys.stderr), Environment() as env:
+        for name in args.only:
+            report['results'][name] = {}
+            for backend in args.backends:
+                log(f'Running {name} benchmark with the {backend} backend')
+                report['results'][name][backend] = functions[name](env, backend, args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(f'{output}\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
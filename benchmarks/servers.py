@@ -0,0 +1,154 @@
+"""Dummy HTTP and websocket endpoints served through the tunnel in the benchmarks.
+
+``GET /api``
+    Small JSON document, like Jupyter Server's version endpoint
+``GET /bytes/<n>``
+    `n` bytes of payload, for bulk transfers
+``GET /ws``
+    Websocket that echoes every message back
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import http.server
+import json
+import os
+import socket
+import struct
+import threading
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_PAYLOAD = os.urandom(2**20)
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def read_frame(sock) -> bytes | None:
+    """Reads one websocket frame and returns its payload, or None for a close frame"""
+    first, second = _recv_exactly(sock, 2)
+    size = second & 0x7F
+    if size == 126:
+        (size,) = struct.unpack('!H', _recv_exactly(sock, 2))
+    elif size == 127:
+        (size,) = struct.unpack('!Q', _recv_exactly(sock, 8))
+    mask = _recv_exactly(sock, 4) if second & 0x80 else None
+    payload = _recv_exactly(sock, size)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    if first & 0x0F == 0x8:
+        return None
+    return payload
+
+
+def write_frame(sock, payload: bytes, mask: bool = False) -> None:
+    """Writes `payload` as a single binary websocket frame"""
+    header = bytearray([0x82])
+    size = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if size < 126:
+        header.append(mask_bit | size)
+    elif size < 2**16:
+        header += bytes([mask_bit | 126]) + struct.pack('!H', size)
+    else:
+        header += bytes([mask_bit | 127]) + struct.pack('!Q', size)
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    sock.sendall(bytes(header) + payload)
+
+
+def websocket_accept(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        if self.connection.family != socket.AF_UNIX:
+            # Like Tornado, which serves Jupyter, do not delay small writes
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        if self.path.startswith('/api'):
+            self._send_body(json.dumps({'version': '2.0.0'}).encode(), 'application/json')
+        elif self.path.startswith('/bytes/'):
+            self._send_bytes(int(self.path.removeprefix('/bytes/')))
+        elif self.path.startswith('/ws'):
+            self._echo_websocket()
+        else:
+            self._send_body(b'<html></html>', 'text/html')
+
+    def _send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_bytes(self, size):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        view = memoryview(_PAYLOAD)
+        while size > 0:
+            chunk = view[: min(size, len(view))]
+            self.wfile.write(chunk)
+            size -= len(chunk)
+
+    def _echo_websocket(self):
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header(
+            'Sec-WebSocket-Accept', websocket_accept(self.headers['Sec-WebSocket-Key'])
+        )
+        self.end_headers()
+        self.wfile.flush()
+        try:
+            while (payload := read_frame(self.connection)) is not None:
+                write_frame(self.connection, payload)
+        except (ConnectionError, OSError):
+            pass
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnixHTTPServer(http.server.ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        self.socket.bind(self.server_address)
+        os.chmod(self.server_address, 0o600)
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, ('localhost', 0)
+
+
+def start_http_server(address=('127.0.0.1', 0), daemon=False):
+    """Starts the dummy server in a thread and returns ``(server, thread)``.
+
+    If `address` is a string, the server listens on a Unix socket at that path.
+    """
+    server_class = _UnixHTTPServer if isinstance(address, str) else http.server.ThreadingHTTPServer
+    server = server_class(address, _Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=daemon)
+    thread.start()
+    return server, thread
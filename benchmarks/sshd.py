@@ -0,0 +1,254 @@
+"""In-process SSH server standing in for a remote host in the benchmarks.
+
+Every authentication attempt succeeds. Exec requests run the command through a shell
+on this machine, ``direct-tcpip`` channels connect to local TCP ports and
+``direct-streamlocal@openssh.com`` channels to local Unix sockets, which is all
+jupyter-forward needs from a remote host.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+import signal
+import socket
+import subprocess
+import threading
+
+import paramiko
+from paramiko.common import MSG_CHANNEL_OPEN, cMSG_CHANNEL_OPEN_SUCCESS
+
+STREAMLOCAL = 'direct-streamlocal@openssh.com'
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self):
+        self.requests: dict[int, tuple[str, object]] = {}
+        self.condition = threading.Condition()
+
+    def _set_request(self, chanid, request):
+        with self.condition:
+            self.requests[chanid] = request
+            self.condition.notify_all()
+
+    def wait_for_request(self, chanid, timeout=5.0):
+        with self.condition:
+            self.condition.wait_for(lambda: chanid in self.requests, timeout)
+            return self.requests.pop(chanid, (None, None))
+
+    def get_allowed_auths(self, username):
+        return 'publickey,password'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self._set_request(chanid, ('tcpip', destination))
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, *args):
+        return True
+
+    def check_channel_env_request(self, channel, name, value):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        self._set_request(channel.get_id(), ('exec', command.decode()))
+        return True
+
+
+class _Transport(paramiko.Transport):
+    """A server transport that also accepts channels to Unix sockets.
+
+    paramiko's server interface has no hook for ``direct-streamlocal@openssh.com``, so
+    those channel opens are answered here and everything else is left to paramiko.
+    """
+
+    def __init__(self, sock):
+        super().__init__(sock)
+        self._handler_table[MSG_CHANNEL_OPEN] = self._parse_streamlocal_open
+
+    def _parse_streamlocal_open(self, m):
+        if m.get_text() != STREAMLOCAL:
+            m.rewind()
+            return self._parse_channel_open(m)
+        chanid = m.get_int()
+        window_size = m.get_int()
+        max_packet_size = m.get_int()
+        path = m.get_text()
+        with self.lock:
+            my_chanid = self._next_channel()
+            channel = paramiko.Channel(my_chanid)
+            self._channels.put(my_chanid, channel)
+            self.channels_seen[my_chanid] = True
+            channel._set_transport(self)
+            channel._set_window(self.default_window_size, self.default_max_packet_size)
+            channel._set_remote_channel(chanid, window_size, max_packet_size)
+        self.server_object._set_request(my_chanid, ('streamlocal', path))
+        reply = paramiko.Message()
+        reply.add_byte(cMSG_CHANNEL_OPEN_SUCCESS)
+        reply.add_int(chanid)
+        reply.add_int(my_chanid)
+        reply.add_int(self.default_window_size)
+        reply.add_int(self.default_max_packet_size)
+        self._send_message(reply)
+        self._queue_incoming_channel(channel)
+
+
+def _copy(recv, send, on_eof):
+    try:
+        while data := recv(65536):
+            send(data)
+    except OSError:
+        pass
+    finally:
+        with contextlib.suppress(OSError):
+            on_eof()
+
+
+def _run_process(channel, command, shell, env):
+    proc = subprocess.Popen(
+        [shell, '-c', command],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+        bufsize=0,
+        start_new_session=True,
+    )
+    threads = [
+        threading.Thread(
+            target=_copy, args=(channel.recv, proc.stdin.write, proc.stdin.close), daemon=True
+        ),
+        threading.Thread(
+            target=_copy, args=(proc.stdout.read, channel.sendall, lambda: None), daemon=True
+        ),
+        threading.Thread(
+            target=_copy,
+            args=(proc.stderr.read, channel.sendall_stderr, lambda: None),
+            daemon=True,
+        ),
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Like sshd, hang up the whole process group when the client closes the channel
+    while proc.poll() is None:
+        if channel.closed:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(proc.pid, signal.SIGHUP)
+            break
+        threading.Event().wait(0.1)
+    proc.wait()
+    threads[1].join()
+    threads[2].join()
+    with contextlib.suppress(Exception):
+        channel.send_exit_status(proc.returncode)
+        channel.close()
+
+
+def _connect_unix(path):
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _connect_tcp(destination):
+    sock = socket.create_connection(destination)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def _splice(channel, connect, destination):
+    try:
+        sock = connect(destination)
+    except OSError:
+        channel.close()
+        return
+    threads = [
+        threading.Thread(
+            target=_copy,
+            args=(channel.recv, sock.sendall, lambda: sock.shutdown(socket.SHUT_WR)),
+            daemon=True,
+        ),
+        threading.Thread(
+            target=_copy, args=(sock.recv, channel.sendall, channel.shutdown_write), daemon=True
+        ),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sock.close()
+    channel.close()
+
+
+class LocalSSHServer:
+    """A minimal SSH server listening on localhost.
+
+    Parameters
+    ----------
+    shell : str, optional
+        Shell used to run exec requests, by default /bin/bash
+    env : dict, optional
+        Variables added to the environment of every command, e.g. a different HOME
+    """
+
+    def __init__(self, shell='/bin/bash', env=None):
+        self.shell = shell
+        self.env = dict(os.environ, SHELL=shell, **(env or {}))
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.commands: list[str] = []
+        self._listener = socket.create_server(('127.0.0.1', 0), backlog=64)
+        self.port = self._listener.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._listener.close()
+
+    def _serve(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(client,), daemon=True).start()
+
+    def _handle(self, client):
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = _Transport(client)
+        transport.add_server_key(self.host_key)
+        server = _Server()
+        transport.start_server(server=server)
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is not None:
+                threading.Thread(target=self._dispatch, args=(server, channel), daemon=True).start()
+
+    def _dispatch(self, server, channel):
+        kind, arg = server.wait_for_request(channel.get_id())
+        if kind == 'exec':
+            self.commands.append(arg)
+            _run_process(channel, arg, self.shell, self.env)
+        elif kind == 'tcpip':
+            _splice(channel, _connect_tcp, arg)
+        elif kind == 'streamlocal':
+            _splice(channel, _connect_unix, arg)
+        else:
+            channel.close()
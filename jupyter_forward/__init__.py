@@ -2,5 +2,20 @@
 # flake8: noqa
 """Top-level module for jupyter_forward ."""
 
-from .core import RemoteRunner
 from ._version import __version__
+
+__all__ = ['AsyncRemoteRunner', 'RemoteRunner', '__version__']
+
+
+def __getattr__(name):
+    # fabric, paramiko and invoke take a while to import, so they are only loaded once a
+    # session is actually created rather than for ``jupyter-forward --version``.
+    if name == 'RemoteRunner':
+        from .core import RemoteRunner
+
+        return RemoteRunner
+    if name == 'AsyncRemoteRunner':
+        from .aio import AsyncRemoteRunner
+
+        return AsyncRemoteRunner
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
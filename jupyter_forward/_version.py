@@ -0,0 +1 @@
+__version__ = '999.post1+g52cffa274'
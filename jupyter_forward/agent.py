@@ -0,0 +1,194 @@
+"""Client of the helper agent that runs on the remote host for the length of a session"""
+
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import functools
+import hashlib
+import itertools
+import json
+import pathlib
+import threading
+import typing
+
+# Agents are cached next to the logs of earlier sessions, one file per version
+AGENT_DIRECTORY = '~/.jupyter_forward'
+
+
+class AgentError(Exception):
+    """The agent could not be started, failed a request or stopped responding
+
+    Parameters
+    ----------
+    message : str
+        Description of the failure
+    sent : bool, optional
+        Whether the request reached the agent, which may have carried it out already
+    """
+
+    def __init__(self, message: str = '', sent: bool = False):
+        super().__init__(message)
+        self.sent = sent
+
+
+class AgentNotInstalledError(AgentError):
+    """The agent script has not been uploaded to the remote host yet"""
+
+
+@functools.cache
+def agent_source() -> str:
+    return pathlib.Path(__file__).with_name('remote_agent.py').read_text()
+
+
+def agent_path() -> str:
+    """Returns the remote path of the agent script, which changes with its content"""
+    digest = hashlib.sha256(agent_source().encode()).hexdigest()[:12]
+    return f'{AGENT_DIRECTORY}/agent-{digest}.py'
+
+
+def agent_command() -> str:
+    """Returns the shell command that starts the agent with the remote Python"""
+    path = agent_path()
+    return f'python3 {path} || python {path}'
+
+
+@dataclasses.dataclass
+class AgentReply:
+    """The response to a request, and the traffic it took"""
+
+    values: dict[str, typing.Any]
+    bytes_sent: int
+    bytes_received: int
+
+
+class RemoteAgent:
+    """Sends newline-delimited JSON requests to the agent over a single SSH channel.
+
+    Requests are sent one at a time, so the agent can be shared by several threads.
+    Any failure to talk to the agent closes it, since its replies can no longer be
+    matched with the requests.
+
+    Parameters
+    ----------
+    channel : paramiko.Channel
+        Channel on which the agent runs
+    timeout : float, optional
+        Seconds to wait for a reply on top of the time a request may take, by default 30
+    """
+
+    def __init__(self, channel, timeout: float = 30.0):
+        self.channel = channel
+        self.timeout = timeout
+        self.info: dict[str, typing.Any] = {}
+        self._stdout = channel.makefile('rb')
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, transport, command: str, timeout: float = 30.0) -> RemoteAgent:
+        """Runs `command` on a new channel and waits for the agent to introduce itself
+
+        Raises
+        ------
+        AgentNotInstalledError
+            If the agent script does not exist on the remote host
+        AgentError
+            If the agent could not be started for another reason, e.g. there is no Python
+        """
+        channel = transport.open_session()
+        channel.settimeout(timeout)
+        channel.exec_command(command)
+        agent = cls(channel, timeout=timeout)
+        try:
+            info = agent._greeting()
+        except AgentError:
+            channel.close()
+            raise
+        if info is None:
+            # The command exited, its error tells why
+            try:
+                stderr = channel.makefile_stderr('rb').read().decode(errors='replace').strip()
+            except OSError:
+                stderr = ''
+            channel.close()
+            if 'No such file' in stderr:
+                raise AgentNotInstalledError(stderr)
+            raise AgentError(stderr.splitlines()[-1] if stderr else 'The agent exited')
+        agent.info = info
+        return agent
+
+    @property
+    def alive(self) -> bool:
+        return not self.channel.closed
+
+    def _readline(self) -> bytes:
+        try:
+            return self._stdout.readline()
+        except (OSError, EOFError) as exc:
+            raise AgentError(f'No reply from the agent: {exc}') from exc
+
+    def _greeting(self) -> dict[str, typing.Any] | None:
+        """Returns the first message of the agent, None if the command exited without one"""
+        # Login scripts may print a banner before the agent starts
+        while line := self._readline():
+            with contextlib.suppress(ValueError):
+                info = json.loads(line)
+                if isinstance(info, dict) and 'agent' in info:
+                    return info
+        return None
+
+    def _receive(self) -> tuple[dict[str, typing.Any], int]:
+        """Returns the next reply and its size in bytes"""
+        if not (line := self._readline()):
+            raise AgentError('The agent exited')
+        try:
+            return json.loads(line), len(line)
+        except ValueError as exc:
+            raise AgentError(f'Invalid reply from the agent: {line[:100]!r}') from exc
+
+    def call(self, op: str, *, timeout: float = 0.0, **params) -> AgentReply:
+        """Sends a request and waits for its reply.
+
+        Parameters
+        ----------
+        op : str
+            One of ``run``, ``stat``, ``read``, ``write``, ``which`` and ``env``
+        timeout : float, optional
+            Seconds the request itself may take, e.g. the `wait` of a ``read``
+        **params
+            Arguments of the operation
+
+        Raises
+        ------
+        AgentError
+            If the request failed or the agent did not reply in time. Its `sent`
+            attribute tells whether the request was written to the agent.
+        """
+        with self._lock:
+            request_id = next(self._ids)
+            request = json.dumps({'id': request_id, 'op': op, **params}).encode() + b'\n'
+            sent = False
+            try:
+                self.channel.settimeout(timeout + self.timeout)
+                self.channel.sendall(request)
+                sent = True
+                values, received = self._receive()
+            except (AgentError, OSError) as exc:
+                self.close()
+                raise AgentError(str(exc), sent=sent) from exc
+            if (reply_id := values.pop('id', None)) != request_id:
+                self.close()
+                raise AgentError(f'Reply to request {reply_id} instead of {request_id}', sent=True)
+        if not values.pop('ok', False):
+            raise AgentError(values.get('error', 'Unknown error'), sent=True)
+        return AgentReply(values, bytes_sent=len(request), bytes_received=received)
+
+    def close(self) -> None:
+        """Closes the channel, on which the agent exits once it reads the end of its input"""
+        if not self.channel.closed:
+            try:
+                self.channel.shutdown_write()
+            except (OSError, EOFError):
+                pass
+            self.channel.close()
@@ -0,0 +1,202 @@
+"""An asyncio interface to `RemoteRunner`, for services that drive many sessions"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import threading
+import typing
+
+from .exceptions import JupyterForwardError
+from .helpers import jupyter_url
+
+if typing.TYPE_CHECKING:
+    from .core import RemoteRunner
+    from .forwarding import ForwardingEngine
+
+# Threads shared by all runners for blocking SSH work
+DEFAULT_MAX_WORKERS = 16
+
+_shared_lock = threading.Lock()
+_shared_executor = None
+_shared_engine = None
+
+
+def _default_executor() -> concurrent.futures.Executor:
+    global _shared_executor
+    with _shared_lock:
+        if _shared_executor is None:
+            _shared_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix='jupyter-forward-async'
+            )
+        return _shared_executor
+
+
+def _default_engine() -> ForwardingEngine:
+    global _shared_engine
+    with _shared_lock:
+        if _shared_engine is None:
+            from .forwarding import ForwardingEngine
+
+            _shared_engine = ForwardingEngine()
+        return _shared_engine
+
+
+class AsyncRemoteRunner:
+    """Connects to a host, launches Jupyter Lab and forwards it from asyncio code.
+
+    The blocking work of `RemoteRunner` (authentication, probing, waiting for Jupyter
+    Lab) runs in a bounded thread pool shared by all runners. Forwarded connections of
+    all runners are served by a single shared `ForwardingEngine`, so an idle session
+    does not hold a thread of its own besides the reader thread paramiko runs for every
+    SSH connection.
+
+    Failures raise `JupyterForwardError` subclasses instead of exiting the process.
+    Cancelling `connect`, `launch` or `forward` closes the connection, which stops the
+    work in progress, cancels a submitted batch job and stops a detached Jupyter Lab.
+
+    Parameters
+    ----------
+    host : str
+        Remote host, as accepted by `RemoteRunner`
+    executor : concurrent.futures.Executor, optional
+        Runs the blocking work, by default a pool of `DEFAULT_MAX_WORKERS` threads
+        shared by all runners
+    engine : ForwardingEngine, optional
+        Serves the forwarded ports, by default one engine shared by all runners
+    **kwargs
+        Passed to `RemoteRunner`. Progress spinners and log following are disabled.
+
+    Examples
+    --------
+    >>> async with AsyncRemoteRunner('user@cluster', port='auto') as session:
+    ...     await session.launch()
+    ...     url = await session.forward()
+    """
+
+    def __init__(
+        self,
+        host: str,
+        *,
+        executor: concurrent.futures.Executor | None = None,
+        engine: ForwardingEngine | None = None,
+        **kwargs,
+    ):
+        self.host = host
+        self.executor = executor or _default_executor()
+        self.engine = engine
+        self.kwargs = kwargs
+        self.runner: RemoteRunner | None = None
+        self.url: str | None = None
+        self._stack = contextlib.ExitStack()
+        self._cancelled = threading.Event()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def status(self) -> str:
+        return 'connecting' if self.runner is None else self.runner.status
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, functools.partial(func, *args))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # The worker thread is blocked on the connection until it is closed. The
+            # default executor is used so that a saturated pool cannot delay this.
+            await asyncio.shield(loop.run_in_executor(None, self._abort))
+            raise
+
+    def _abort(self):
+        self._cancelled.set()
+        if self.runner is not None:
+            self.runner._cancel_job()
+            self._close()
+
+    def _require(self, attribute):
+        if self.runner is None:
+            raise JupyterForwardError('Call `connect` first')
+        if attribute and not hasattr(self.runner, attribute):
+            raise JupyterForwardError('Call `launch` first')
+
+    async def connect(self) -> AsyncRemoteRunner:
+        """Authenticates to the host and reserves the local ports"""
+        self.runner = await self._call(self._connect)
+        return self
+
+    def _connect(self):
+        from .core import RemoteRunner
+
+        kwargs = {
+            **self.kwargs,
+            'engine': self.engine or _default_engine(),
+            'raise_errors': True,
+            'show_progress': False,
+            'follow_logs': False,
+        }
+        runner = RemoteRunner(self.host, **kwargs)
+        if self._cancelled.is_set():
+            # Cancelled while authenticating
+            runner.close()
+            raise JupyterForwardError(f'Connecting to {self.host} was cancelled')
+        return runner
+
+    async def launch(self) -> dict[str, typing.Any]:
+        """Starts Jupyter Lab, or reattaches to a running server with `reuse`.
+
+        Returns
+        -------
+        dict
+            The hostname, port (or socket), token and base_url of the server
+        """
+        self._require(None)
+        await self._call(self.runner._prepare_server)
+        return self.runner.parsed_result
+
+    async def forward(self) -> str:
+        """Forwards the local port to Jupyter Lab and returns the URL to open.
+
+        Returns once Jupyter Lab responds through the tunnel or `ready_timeout` passed.
+        Without port forwarding, the URL of the server itself is returned.
+        """
+        self._require('parsed_result')
+        await self._call(self._forward)
+        return self.url
+
+    def _forward(self):
+        runner = self.runner
+        self._stack.enter_context(runner._supervise())
+        if runner.port_forwarding:
+            self._stack.enter_context(runner._port_forwarding())
+            self.url = jupyter_url(
+                runner.port, token=runner.parsed_result['token'], path=runner.notebook
+            )
+        else:
+            self.url = runner.parsed_result['url']
+        runner.status = 'ready'
+        runner._ready.set()
+
+    async def close(self) -> None:
+        """Stops forwarding, stops a detached Jupyter Lab started by this runner and disconnects"""
+        if self.runner is not None:
+            await self._call(self._close)
+
+    def _close(self):
+        runner = self.runner
+        runner._stop.set()
+        try:
+            self._stack.close()
+        finally:
+            if runner._owns_detached_server:
+                runner._stop_server()
+            runner.close()
+            if not runner.status.startswith('failed'):
+                runner.status = 'stopped'
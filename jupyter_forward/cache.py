@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import json
+import os
+import pathlib
+import tempfile
+import time
+import typing
+
+
+def default_cache_dir() -> pathlib.Path:
+    """Returns the directory used for jupyter-forward's local cache files"""
+    base = os.environ.get('XDG_CACHE_HOME') or pathlib.Path.home() / '.cache'
+    return pathlib.Path(base) / 'jupyter-forward'
+
+
+@dataclasses.dataclass
+class HostFactsCache:
+    """Persistent cache of facts discovered about remote hosts.
+
+    Entries are keyed by ``user@host`` and expire after `ttl` seconds.
+
+    Parameters
+    ----------
+    path : pathlib.Path, optional
+        JSON file holding the cache, by default ``~/.cache/jupyter-forward/hosts.json``
+    ttl : float, optional
+        Number of seconds after which an entry is considered stale, by default one day
+    """
+
+    path: pathlib.Path | None = None
+    ttl: float = 24 * 60 * 60
+
+    def __post_init__(self):
+        if self.path is None:
+            self.path = default_cache_dir() / 'hosts.json'
+        self.path = pathlib.Path(self.path)
+
+    def _load(self) -> dict[str, typing.Any]:
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _dump(self, data: dict[str, typing.Any]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see partial JSON
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix='.hosts-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+
+    def get(self, key: str) -> dict[str, typing.Any] | None:
+        """Returns the cached entry for `key`, or None if it is missing or expired"""
+        entry = self._load().get(key)
+        if not isinstance(entry, dict):
+            return None
+        if time.time() - entry.get('timestamp', 0) > self.ttl:
+            return None
+        return entry
+
+    def set(self, key: str, facts: dict[str, str], activate_cmds: dict[str, str]) -> None:
+        """Stores the facts and per-environment activation commands for `key`"""
+        data = self._load()
+        data[key] = {'timestamp': time.time(), 'facts': facts, 'activate_cmds': activate_cmds}
+        self._dump(data)
+
+    def invalidate(self, key: str) -> None:
+        """Removes the entry for `key` if present"""
+        data = self._load()
+        if data.pop(key, None) is not None:
+            self._dump(data)
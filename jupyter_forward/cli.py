@@ -2,8 +2,6 @@ from pathlib import Path
 
 import typer
 
-from .core import RemoteRunner
-
 app = typer.Typer(help='Jupyter Lab Port Forwarding Utility')
 
 
@@ -17,14 +15,23 @@ def version_callback(value: bool):
 
 @app.command()
 def start(
-    host: str,
-    port: int = typer.Option(
-        8888,
+    host: list[str] = typer.Argument(
+        ...,
+        help='One or more remote hosts. Sessions on multiple hosts are launched concurrently.',
+    ),
+    port: str = typer.Option(
+        '8888',
         help=(
-            """The local port the remote notebook server will be forwarded to. If not specified, defaults to 8888."""
+            """The local port the remote notebook server will be forwarded to. If not specified, defaults to 8888. Use 'auto' for the first available port of --port-range. With multiple hosts, the following available ports are used for the other hosts."""
         ),
         show_default=True,
     ),
+    port_range: str = typer.Option(
+        '8888-8987',
+        '--port-range',
+        show_default=True,
+        help="Range of local ports scanned by '--port auto', as start-end.",
+    ),
     conda_env: str = typer.Option(
         None,
         show_default=True,
@@ -70,6 +77,172 @@ def start(
         show_default=True,
         help='Which remote shell binary to use.',
     ),
+    launch_timeout: float = typer.Option(
+        300.0,
+        '--launch-timeout',
+        show_default=True,
+        help='Maximum number of seconds to wait for Jupyter Lab to report its URL once it is launched, after any batch queue wait.',
+    ),
+    queue_timeout: float = typer.Option(
+        None,
+        '--queue-timeout',
+        show_default=True,
+        help='Maximum number of seconds a batch job submitted with qsub or sbatch may wait in the queue before it is cancelled. Waits forever by default.',
+    ),
+    probe: bool = typer.Option(
+        True,
+        show_default=True,
+        help='Whether to gather remote host information in a single round trip before launching.',
+    ),
+    cache: bool = typer.Option(
+        True,
+        show_default=True,
+        help='Whether to reuse information about the remote host cached by previous launches.',
+    ),
+    refresh: bool = typer.Option(
+        False,
+        '--refresh',
+        show_default=True,
+        help='Ignore cached information about the remote host and probe it again.',
+    ),
+    capture_env: bool = typer.Option(
+        False,
+        show_default=True,
+        help=(
+            'Run the remote login shell once and reuse its environment for subsequent commands instead of starting a login shell for each one.'
+        ),
+    ),
+    agent: bool = typer.Option(
+        False,
+        show_default=True,
+        help=(
+            'Run a small Python helper on the remote host for the whole session and send remote commands, file uploads and log reads through it instead of opening a new channel and shell for each one. The helper is cached in ~/.jupyter_forward.'
+        ),
+    ),
+    log_level: str = typer.Option(
+        None,
+        '--log-level',
+        show_default=True,
+        help='Only show Jupyter Lab log messages at or above this level (DEBUG, INFO, WARNING, ERROR, CRITICAL).',
+    ),
+    reuse: bool = typer.Option(
+        False,
+        '--reuse',
+        show_default=True,
+        help=(
+            'Reattach to a Jupyter Lab server previously launched with --reuse if it is still running. Otherwise launch one that keeps running after you disconnect.'
+        ),
+    ),
+    forwarding_backend: str = typer.Option(
+        'engine',
+        '--forwarding-backend',
+        show_default=True,
+        help=(
+            "How to forward the local port: 'engine' multiplexes all connections in one event loop, 'fabric' uses a thread per connection."
+        ),
+    ),
+    unix_socket: bool = typer.Option(
+        False,
+        '--unix-socket',
+        show_default=True,
+        help=(
+            'Launch Jupyter Lab on a private Unix socket in the remote log directory instead of a TCP port that every user of the remote host can connect to. Not supported with --launch-command.'
+        ),
+    ),
+    transports: int = typer.Option(
+        1,
+        '--transports',
+        show_default=True,
+        help=(
+            'Number of SSH connections to spread forwarded connections over. A single connection encrypts on one CPU core, so several speed up large parallel downloads on fast links. Requires key or agent authentication.'
+        ),
+    ),
+    stripe_policy: str = typer.Option(
+        'least-loaded',
+        '--stripe-policy',
+        show_default=True,
+        help="How --transports spreads connections: 'least-loaded' or 'round-robin'.",
+    ),
+    forward: list[str] = typer.Option(
+        None,
+        '--forward',
+        help=(
+            'Also forward a remote service, e.g. a Dask dashboard, as remote_port[:local_port]. Services run on the same host as Jupyter Lab. Can be repeated.'
+        ),
+    ),
+    detect_ports: bool = typer.Option(
+        False,
+        '--detect-ports',
+        show_default=True,
+        help=(
+            'Forward the web services (e.g. Dask dashboards, TensorBoard) that notebook kernels start listening on. Not supported with --launch-command.'
+        ),
+    ),
+    socks_port: int = typer.Option(
+        None,
+        '--socks-port',
+        help=(
+            'Run a SOCKS5 proxy on this local port that reaches any host the remote host can reach, e.g. the Dask dashboards of worker nodes. Point the SOCKS proxy setting of your browser at it.'
+        ),
+    ),
+    socks_allow: list[str] = typer.Option(
+        None,
+        '--socks-allow',
+        help=(
+            "Only let the SOCKS5 proxy connect to hosts matching this pattern, e.g. 'node*.cluster'. Can be repeated."
+        ),
+    ),
+    cache_assets: bool = typer.Option(
+        False,
+        '--cache-assets',
+        show_default=True,
+        help=(
+            'Serve the local port through a proxy that caches Jupyter Lab static assets on local disk, so that new browser tabs load them without going through the tunnel.'
+        ),
+    ),
+    asset_cache_size: int = typer.Option(
+        256,
+        '--asset-cache-size',
+        show_default=True,
+        help='Size limit of the --cache-assets cache in MiB. The least recently used assets are evicted first.',
+    ),
+    profile: bool = typer.Option(
+        False,
+        '--profile',
+        show_default=True,
+        help='Print how long each phase of the launch took and how much remote work it did.',
+    ),
+    profile_output: str = typer.Option(
+        None,
+        '--profile-output',
+        help='Write the launch profile to this file.',
+    ),
+    profile_format: str = typer.Option(
+        'json',
+        '--profile-format',
+        show_default=True,
+        help="Format of --profile-output: 'json', or 'chrome' for chrome://tracing and Perfetto.",
+    ),
+    verbose: bool = typer.Option(
+        False,
+        '--verbose',
+        show_default=True,
+        help='Print every remote command with its duration, exit status and output size, and a summary at the end.',
+    ),
+    reconnect: bool = typer.Option(
+        False,
+        '--reconnect',
+        show_default=True,
+        help=(
+            'Keep the tunnel alive and reconnect to the remote host if the connection drops, without relaunching Jupyter Lab. The local port stays bound while reconnecting.'
+        ),
+    ),
+    keepalive_interval: float = typer.Option(
+        5.0,
+        '--keepalive-interval',
+        show_default=True,
+        help='Seconds between keepalive requests used to detect a dead connection with --reconnect.',
+    ),
     version: bool = typer.Option(
         None,
         '--version',
@@ -83,9 +256,14 @@ def start(
     local machine.
     """
 
-    runner = RemoteRunner(
-        host,
-        port=port,
+    try:
+        start_port, end_port = (int(part) for part in port_range.split('-'))
+    except ValueError:
+        raise typer.BadParameter('--port-range must look like 8888-8987') from None
+    if port != 'auto' and not port.isdigit():
+        raise typer.BadParameter("--port must be a port number or 'auto'")
+    kwargs = dict(
+        port_range=(start_port, end_port),
         conda_env=conda_env,
         notebook_dir=notebook_dir,
         notebook=notebook,
@@ -93,8 +271,42 @@ def start(
         launch_command=launch_command,
         identity=identity,
         shell=shell,
+        launch_timeout=launch_timeout,
+        queue_timeout=queue_timeout,
+        probe=probe,
+        cache=cache,
+        refresh=refresh,
+        capture_env=capture_env,
+        agent=agent,
+        log_level=log_level,
+        reuse=reuse,
+        forwarding_backend=forwarding_backend,
+        unix_socket=unix_socket,
+        transports=transports,
+        stripe_policy=stripe_policy,
+        forwards=tuple(forward or ()),
+        detect_ports=detect_ports,
+        socks_port=socks_port,
+        socks_allow=tuple(socks_allow or ()),
+        cache_assets=cache_assets,
+        asset_cache_size=asset_cache_size * 2**20,
+        profile=profile,
+        profile_output=profile_output,
+        profile_format=profile_format,
+        verbose=verbose,
+        reconnect=reconnect,
+        keepalive_interval=keepalive_interval,
     )
-    runner.start()
+    if len(host) > 1:
+        if profile_output:
+            raise typer.BadParameter('--profile-output only supports a single host')
+        from .multi import MultiRunner
+
+        MultiRunner(host, port=port, runner_kwargs=kwargs).start()
+    else:
+        from .core import RemoteRunner
+
+        RemoteRunner(host[0], port=port, **kwargs).start()
 
 
 def main():
@@ -1,24 +1,138 @@
 from __future__ import annotations
 
+import base64
 import contextlib
 import dataclasses
 import datetime
+import fnmatch
 import getpass
+import json
+import os
 import pathlib
+import secrets
+import shlex
 import socket
 import sys
 import textwrap
+import threading
 import time
 from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 
-import invoke
 import paramiko
 from fabric import Config, Connection
+from invoke.exceptions import UnexpectedExit
+from invoke.runners import Result, normalize_hide
 
+from .agent import (
+    AGENT_DIRECTORY,
+    AgentError,
+    AgentNotInstalledError,
+    RemoteAgent,
+    agent_command,
+    agent_path,
+    agent_source,
+)
+from .cache import HostFactsCache
 from .console import console
-from .helpers import _authentication_handler, is_port_available, open_browser, parse_stdout
+from .exceptions import (
+    AuthenticationError,
+    LaunchError,
+    LaunchTimeoutError,
+    PortUnavailableError,
+    ReauthenticationRequiredError,
+    RemoteCommandError,
+)
+from .forwarding import STRIPE_POLICIES, ForwardingEngine, open_streamlocal_channel
+from .helpers import (
+    DEFAULT_PORT_RANGE,
+    EXIT_MARKER,
+    PROBE_PREFIX,
+    JupyterLogParser,
+    LogFollower,
+    _authentication_handler,
+    bind_port,
+    open_browser,
+    parse_env_output,
+    parse_probe_output,
+    parse_runtime_file,
+    parse_session_registry,
+    reserve_port,
+    stream_channel,
+    wait_for_server,
+)
+from .metrics import CommandMetrics, CommandRecord, categorize
+from .profiling import PROFILE_FORMATS, Profiler, phase
+from .proxy import AssetCache, CachingProxy
+from .scheduler import JobWatcher, detect_scheduler, parse_job_id
+from .services import (
+    Service,
+    is_http_service,
+    parse_forward_spec,
+    parse_port_scan,
+    port_scan_script,
+    render_services,
+)
+from .socks import Socks5Handshake
+from .supervisor import TunnelSupervisor
 
-timestamp = datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
+
+def new_session_id() -> str:
+    """Returns a collision-free identifier for a jupyter-forward session.
+
+    The identifier starts with a timestamp so that remote artifacts sort by creation
+    time, followed by the local process ID and a random suffix so that sessions
+    started in the same second (in one or several processes) never clash.
+    """
+    now = datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
+    return f'{now}-{os.getpid()}-{secrets.token_hex(6)}'
+
+
+# Variables kept from the login environment when `capture_env` is enabled. They end up on
+# the command line of remote processes, so only search paths and environment/module
+# bookkeeping is kept, never arbitrary (possibly secret) variables.
+CAPTURED_ENV_VARS = (
+    'PATH',
+    'LD_LIBRARY_PATH',
+    'MANPATH',
+    'PYTHONPATH',
+    'CONDA_*',
+    'MAMBA_*',
+    '_CE_*',
+    'JUPYTER_*',
+    'MODULE*',
+    'LOADEDMODULES',
+    '_LMFILES_',
+    'LMOD*',
+    '_LMOD*',
+    '__LMOD*',
+    'TMPDIR',
+    'LANG',
+    'LC_*',
+)
+
+# `engine` multiplexes all forwarded connections in one event loop (see `ForwardingEngine`),
+# `fabric` uses `Connection.forward_local`, which runs a thread per connection.
+FORWARDING_BACKENDS = ('engine', 'fabric')
+
+# Options that only the `engine` forwarding backend supports: the option, whether it is in
+# use, and whether it also needs port forwarding (see `RemoteRunner._validate_backend_options`)
+ENGINE_OPTIONS = (
+    ('reconnect', lambda runner: runner.reconnect, False),
+    ('unix_socket', lambda runner: runner.unix_socket, True),
+    ('cache_assets', lambda runner: runner.cache_assets, True),
+    ('transports', lambda runner: runner.transports > 1, True),
+    ('forwards', lambda runner: bool(runner.forwards), True),
+    ('detect_ports', lambda runner: runner.detect_ports, True),
+    ('socks_port', lambda runner: runner.socks_port is not None, True),
+)
+
+# Facts that may differ between logins to the same host, which are never cached
+SESSION_FACTS = ('hostname', 'log_dir', 'log_file')
+
+# Longest Unix socket path that fits in `sun_path` on both Linux (108 bytes) and macOS (104
+# bytes), leaving room for the terminating NUL
+MAX_SOCKET_PATH_LENGTH = 103
 
 
 @dataclasses.dataclass
@@ -34,11 +148,25 @@ class RemoteRunner:
     Raises
     ------
     SystemExit
-        When the specified local port is not available.
+        When the specified local port is not available, authentication fails or a
+        required remote command fails. With `raise_errors`, a `JupyterForwardError`
+        is raised instead.
+
+    Notes
+    -----
+    The local ports are bound when the runner is created and the listening sockets are
+    handed to the forwarding engine, so no other process can take them while Jupyter
+    Lab starts. `port` may be 'auto' to use the first free port of `port_range`, and
+    `listener` an already bound socket, e.g. from `helpers.reserve_port`.
+
+    With `agent`, a small Python helper (see `remote_agent.py`) runs on the remote host
+    for the whole session and most remote commands, file uploads and log reads go
+    through it on a single channel. Without a usable Python on the remote host, the
+    runner falls back to a new channel and shell per command.
     """
 
     host: str
-    port: int = 8888
+    port: int | str = 8888
     conda_env: str | None = None
     notebook_dir: str | None = None
     notebook: str | None = None
@@ -48,23 +176,182 @@ class RemoteRunner:
     shell: str | None = None
     auth_handler: Callable = _authentication_handler
     fallback_auth_handler: Callable = getpass.getpass
+    launch_timeout: float | None = 300.0
+    queue_timeout: float | None = None
+    probe: bool = True
+    cache: bool = True
+    cache_ttl: float = 24 * 60 * 60
+    refresh: bool = False
+    capture_env: bool = False
+    agent: bool = False
+    ready_timeout: float = 30.0
+    log_level: str | None = None
+    log_buffer_lines: int = 100
+    show_progress: bool = True
+    follow_logs: bool = True
+    session_id: str | None = None
+    reuse: bool = False
+    forwarding_backend: str = 'engine'
+    unix_socket: bool = False
+    cache_assets: bool = False
+    asset_cache_size: int = 256 * 2**20
+    transports: int = 1
+    stripe_policy: str = 'least-loaded'
+    forwards: tuple[str, ...] = ()
+    detect_ports: bool = False
+    detect_interval: float = 5.0
+    socks_port: int | None = None
+    socks_allow: tuple[str, ...] = ()
+    port_range: tuple[int, int] = DEFAULT_PORT_RANGE
+    listener: socket.socket | None = dataclasses.field(default=None, repr=False)
+    engine: ForwardingEngine | None = dataclasses.field(default=None, repr=False)
+    raise_errors: bool = False
+    profile: bool = False
+    profile_output: str | None = None
+    profile_format: str = 'json'
+    verbose: bool = False
+    reconnect: bool = False
+    keepalive_interval: float = 5.0
+    reconnect_timeout: float = 300.0
 
     def __post_init__(self):
+        self.profiler = Profiler(name=self.host)
+        self.metrics = CommandMetrics()
+        if self.session_id is None:
+            self.session_id = new_session_id()
+        self.status = 'connecting'
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self.job = None
+        self._job_lock = threading.Lock()
+        self.supervisor = None
+        self.proxy = None
+        self.forward = None
+        self._stripe_sessions = []
+        self.services = []
+        self._log_offset = None
+        self._owns_detached_server = False
+        self._socks_listener = None
+        self._agent = None
+        if self.port != 'auto':
+            try:
+                self.port = int(self.port)
+            except ValueError:
+                raise ValueError(
+                    f"`port` must be a port number or 'auto', got {self.port!r}"
+                ) from None
+        if self.port_range[0] > self.port_range[1]:
+            raise ValueError(f'`port_range` must be (start, end), got {self.port_range}')
         if self.notebook_dir is not None and self.notebook is not None:
             raise ValueError('`notebook_dir` and `notebook` are mutually exclusive')
+        if self.forwarding_backend not in FORWARDING_BACKENDS:
+            raise ValueError(
+                f'`forwarding_backend` must be one of {FORWARDING_BACKENDS}, got {self.forwarding_backend!r}'
+            )
+        self._validate_backend_options()
+        if self.unix_socket and self.launch_command:
+            # The socket would live on the compute node, out of reach of the SSH server
+            raise ValueError('`unix_socket` and `launch_command` are mutually exclusive')
+        if self.transports < 1:
+            raise ValueError(f'`transports` must be at least 1, got {self.transports}')
+        if self.stripe_policy not in STRIPE_POLICIES:
+            raise ValueError(
+                f'`stripe_policy` must be one of {STRIPE_POLICIES}, got {self.stripe_policy!r}'
+            )
+        self._service_specs = [parse_forward_spec(spec) for spec in self.forwards]
+        if self.socks_allow and self.socks_port is None:
+            raise ValueError('`socks_allow` requires `socks_port`')
+        if self.detect_ports and self.launch_command:
+            # The kernels run on the compute node, whose processes cannot be listed
+            raise ValueError('`detect_ports` and `launch_command` are mutually exclusive')
+        if self.profile_format not in PROFILE_FORMATS:
+            raise ValueError(
+                f'`profile_format` must be one of {PROFILE_FORMATS}, got {self.profile_format!r}'
+            )
         if self.notebook:
             self.notebook = pathlib.Path(self.notebook)
             self.notebook_dir = str(self.notebook.parent)
             self.notebook = self.notebook.name
+        self.log_follower = LogFollower(max_lines=self.log_buffer_lines, level=self.log_level)
 
-        if self.port_forwarding and not is_port_available(self.port):
+        if self.port_forwarding:
+            self._reserve_ports()
+        self._facts = {}
+        self._probed = False
+        self._facts_from_cache = False
+        self._requested_shell = self.shell
+        self._cache = HostFactsCache(ttl=self.cache_ttl) if self.cache else None
+        self._cached = None
+        self._environment = None
+        try:
+            self._authenticate()
+            if self._cache is not None and not self.refresh:
+                self._cached = self._cache.get(self._cache_key())
+            self._check_shell()
+            if self.capture_env:
+                self._capture_environment()
+            if self.agent:
+                self._start_agent()
+        except BaseException:
+            self._release_ports()
+            raise
+        self.status = 'connected'
+
+    def _reserve_ports(self):
+        """Binds the local ports, which are held until they are forwarded"""
+        if self.listener is not None:
+            self.port = self.listener.getsockname()[1]
+        elif self.port == 'auto':
+            self.listener = reserve_port(*self.port_range)
+            self.port = self.listener.getsockname()[1]
+            console.print(f'[bold cyan]:white_check_mark: Using local port {self.port}')
+        elif (listener := bind_port(self.port)) is not None:
+            self.listener = listener
+        else:
             console.print(
-                f"""[bold red]:x: Specified port={self.port} is already in use on your local machine. Try a different port"""
+                f"""[bold red]:x: Specified port={self.port} is already in use on your local machine. Try a different port or --port auto"""
             )
-            sys.exit(1)
-        self._authenticate()
-        self._check_shell()
+            self._exit(PortUnavailableError(f'Local port {self.port} is already in use'))
+        if self.socks_port is not None:
+            self._socks_listener = bind_port(self.socks_port)
+            if self._socks_listener is None:
+                self._release_ports()
+                console.print(
+                    f'[bold red]:x: Specified SOCKS port={self.socks_port} is already in use on your local machine. Try a different port'
+                )
+                self._exit(PortUnavailableError(f'Local port {self.socks_port} is already in use'))
+
+    def _exit(self, error):
+        """Exits the process, or raises `error` if `raise_errors` is set.
+
+        The reason has already been printed.
+        """
+        if self.raise_errors:
+            raise error
+        sys.exit(1)
+
+    def _validate_backend_options(self):
+        """Rejects options that the chosen forwarding backend or mode cannot serve"""
+        for option, in_use, needs_port_forwarding in ENGINE_OPTIONS:
+            if not in_use(self):
+                continue
+            if needs_port_forwarding and (
+                self.forwarding_backend != 'engine' or not self.port_forwarding
+            ):
+                raise ValueError(
+                    f'`{option}` requires port forwarding with the `engine` forwarding backend'
+                )
+            if self.forwarding_backend != 'engine':
+                raise ValueError(f'`{option}` requires the `engine` forwarding backend')
+
+    def _release_ports(self):
+        """Closes the reserved local ports that were not handed to the forwarding layer"""
+        for listener in (self.listener, self._socks_listener):
+            if listener is not None:
+                listener.close()
+        self.listener = self._socks_listener = None
 
+    @phase('authenticate')
     def _authenticate(self):
         console.rule('[bold green]Authenticating', characters='*')
 
@@ -79,6 +366,12 @@ class RemoteRunner:
         console.print(
             f'[bold cyan]Authenticating user ({self.session.user}) from client ({socket.gethostname()}) to remote host ({self.session.host})'
         )
+        if not self._open_session():
+            self._exit(AuthenticationError(f'Could not authenticate to {self.session.host}'))
+        console.print('[bold cyan]:white_check_mark: The client is authenticated successfully')
+
+    def _open_session(self):
+        """Connects `session`, prompting for a password and token if keys are not accepted"""
         # Try passwordless authentication
         with contextlib.suppress(
             paramiko.ssh_exception.BadAuthenticationType,
@@ -101,27 +394,345 @@ class RemoteRunner:
                     break
                 except Exception:
                     console.log('[bold red]:x: Failed to Authenticate your connection')
-        if not self.session.is_connected:
-            sys.exit(1)
-        console.print('[bold cyan]:white_check_mark: The client is authenticated successfully')
+        return self.session.is_connected
 
+    @phase('check shell')
     def _check_shell(self):
         console.rule('[bold green]Verifying shell location', characters='*')
-        if self.shell is None:
-            if shell := self.session.run('echo $SHELL || echo $0', hide='out').stdout.strip():
+        if self.shell is None and self._cached and self._cached['facts'].get('shell'):
+            self.shell = self._cached['facts']['shell']
+        elif self.shell is None:
+            if shell := self._session_run(
+                'echo $SHELL || echo $0', category='shell', hide='out'
+            ).stdout.strip():
                 self.shell = shell
             else:
                 raise ValueError('Could not determine shell. Please specify one using --shell.')
         else:
             # Get the full path to the shell in case the user specified a shell name
             self.shell = self.run_command(f'which {self.shell}').stdout.strip()
+        self._facts['shell'] = self.shell
         console.print(f'[bold cyan]:white_check_mark: Using shell: {self.shell}')
 
+    def _cache_key(self):
+        key = f'{self.session.user}@{self.session.host}'
+        if self.session.port != 22:
+            key = f'{key}:{self.session.port}'
+        # Facts found with `--shell` are kept apart so that they never override $SHELL
+        return key if self._requested_shell is None else f'{key} {self._requested_shell}'
+
+    @phase('validate cached facts')
+    def _use_cached_facts(self):
+        """Validates cached facts about the remote host with a single remote script.
+
+        The same script looks up the hostname and the log directory of this session.
+        Stale entries are invalidated so that the host is probed again.
+        """
+        if not self._cached or not self._supports_probe():
+            return False
+        facts = {
+            name: value
+            for name, value in self._cached['facts'].items()
+            if name not in SESSION_FACTS
+        }
+        activate_cmd = self._cached.get('activate_cmds', {}).get(self.conda_env)
+        if (
+            facts.get('shell') != self.shell
+            or (self.conda_env and not activate_cmd)
+            or (not self.conda_env and not facts.get('jupyter'))
+        ):
+            return False
+
+        key = self._cache_key()
+        console.rule(f'[bold green]Validating cached information about {key}', characters='*')
+        try:
+            stdout, status = self._run_script(
+                self._validation_script(activate_cmd), category='cache validation'
+            )
+        except Exception as exc:
+            console.print(f'[bold yellow]:warning: Could not validate cached information ({exc})')
+            return False
+        session_facts = parse_probe_output(stdout)
+        if status != 0 or not session_facts.get('hostname') or 'log_dir' not in session_facts:
+            console.print(f'[bold yellow]:warning: Cached information about {key} is stale')
+            self._cache.invalidate(key)
+            self._cached = None
+            if self._requested_shell is None:
+                self.shell = None
+                self._check_shell()
+            return False
+
+        self._facts.update(facts, **session_facts)
+        if activate_cmd:
+            self._facts['activate_cmd'] = activate_cmd
+        self._probed = True
+        self._facts_from_cache = True
+        console.print(f'[bold cyan]:white_check_mark: Using cached information about {key}')
+        return True
+
+    def _store_facts(self):
+        if self._cache is None or self._facts_from_cache:
+            return
+        facts = {
+            key: self._facts[key]
+            for key in ('shell', 'jupyter', 'micromamba', 'mamba')
+            if self._facts.get(key)
+        }
+        activate_cmds = dict(self._cached.get('activate_cmds', {})) if self._cached else {}
+        if self.conda_env and self._facts.get('activate_cmd'):
+            activate_cmds[self.conda_env] = self._facts['activate_cmd']
+        try:
+            self._cache.set(self._cache_key(), facts, activate_cmds)
+        except OSError as exc:
+            console.print(f'[bold yellow]:warning: Could not update the host cache: {exc}')
+
     def put_file(self, remote_path, content):
+        data = base64.b64encode(content.encode()).decode()
+        if self._agent_call('write', 'upload', path=remote_path, data=data) is not None:
+            return
+        started = time.perf_counter()
         client = self.session.client
         with client.get_transport().open_channel(kind='session') as channel:
             channel.exec_command(f'cat > {remote_path}')
             channel.sendall(content.encode())
+        self._record('upload', 'put', started, bytes_sent=len(content))
+
+    @phase('capture login environment')
+    def _capture_environment(self):
+        """Runs the login shell once and snapshots the environment it sets up.
+
+        Subsequent commands run in a non-login shell with this environment applied,
+        which avoids sourcing the user's login profile for every command.
+        """
+        console.rule('[bold green]Capturing login environment', characters='*')
+        result = self.run_command(
+            'env',
+            exit=False,
+            echo=False,
+            hide=True,
+            pty=False,
+            login=True,
+            category='environment',
+        )
+        if result.failed:
+            console.print(
+                '[bold yellow]:warning: Could not capture the login environment. Using login shells instead.'
+            )
+            return self
+        self._environment = {
+            name: value
+            for name, value in parse_env_output(result.stdout).items()
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in CAPTURED_ENV_VARS)
+        }
+        console.print(
+            f'[bold cyan]:white_check_mark: Captured {len(self._environment)} environment variables'
+        )
+        return self
+
+    @phase('start agent')
+    def _start_agent(self):
+        """Starts the remote helper agent, uploading it first if this version is not cached"""
+        console.rule('[bold green]Starting the remote helper agent', characters='*')
+        self._agent = None
+        transport = self.session.client.get_transport()
+        # The agent inherits the environment other commands run with, e.g. the PATH to conda
+        command = self._wrap_command(agent_command())
+        started = time.perf_counter()
+        try:
+            try:
+                self._agent = RemoteAgent.start(transport, command)
+            except AgentNotInstalledError:
+                self._install_agent()
+                self._agent = RemoteAgent.start(transport, command)
+        except (AgentError, paramiko.ssh_exception.SSHException, OSError) as exc:
+            console.print(
+                f'[bold yellow]:warning: Could not start the remote helper agent ({exc}). Running remote commands in separate shells instead.'
+            )
+            return self
+        finally:
+            self._record('agent', 'channel', started, bytes_sent=len(command))
+        console.print(
+            f'[bold cyan]:white_check_mark: Remote helper agent is running with Python {self._agent.info.get("python")}'
+        )
+        return self
+
+    def _install_agent(self):
+        """Uploads the agent script to the remote host, where later sessions find it"""
+        path = agent_path()
+        temporary = f'{path}.{self.session_id}'
+        # Renamed once complete, so that concurrent sessions never run a partial script
+        command = f'mkdir -p {AGENT_DIRECTORY} && cat > {temporary} && mv -f {temporary} {path}'
+        output, status = self._run_script(agent_source(), category='agent upload', command=command)
+        if status != 0:
+            raise AgentError(f'Could not upload {path}: {output.strip()}')
+
+    def _agent_call(self, op, category, *, timeout=0.0, **params):
+        """Sends a request to the remote helper agent and returns its reply.
+
+        Returns None if the agent is not running or the request failed, in which case
+        the caller falls back to running a command. An agent that stopped responding
+        is not used again.
+
+        Raises
+        ------
+        AgentError
+            If a ``run`` request failed after it was sent, since its command may already
+            be running and must not run a second time
+        """
+        agent = self._agent
+        if agent is None:
+            return None
+        started = time.perf_counter()
+        try:
+            reply = agent.call(op, timeout=timeout, **params)
+        except AgentError as exc:
+            if not agent.alive:
+                self._agent = None
+                console.print(
+                    f'[bold yellow]:warning: The remote helper agent stopped ({exc}). Running remote commands in separate shells instead.'
+                )
+            if op == 'run' and exc.sent:
+                raise
+            return None
+        self._record(
+            category,
+            'agent',
+            started,
+            exit_status=reply.values.get('exited', 0),
+            bytes_sent=reply.bytes_sent,
+            stdout_bytes=reply.bytes_received,
+        )
+        return reply.values
+
+    def _agent_run(self, command, category, warn=False, hide=None, pty=False, echo=False):
+        """Runs `command` through the agent and returns the same result as ``session.run``.
+
+        Returns None if the agent is not available.
+
+        Raises
+        ------
+        RemoteCommandError
+            If the command was sent to the agent but its result was lost
+        """
+        try:
+            reply = self._agent_call('run', category, command=command, combine=pty)
+        except AgentError as exc:
+            raise RemoteCommandError(
+                f'`{command}` may have run on {self.session.host}, but its result was lost: {exc}'
+            ) from exc
+        if reply is None:
+            return None
+        hide = normalize_hide(hide)
+        result = Result(
+            stdout=reply['stdout'],
+            stderr=reply['stderr'],
+            command=command,
+            exited=reply['exited'],
+            pty=pty,
+            hide=hide,
+        )
+        if echo:
+            console.print(f'[bold]{command}', highlight=False)
+        for stream in ('stdout', 'stderr'):
+            if stream not in hide and getattr(result, stream):
+                console.out(getattr(result, stream), end='', highlight=False)
+        if not warn and result.failed:
+            raise UnexpectedExit(result)
+        return result
+
+    def _follow_with_agent(
+        self, path, on_data, *, offset=0, deadline=None, poll_interval=0.1, max_wait=10.0
+    ):
+        """Feeds `path` from `offset` to `on_data` with reads that wait on the remote host for new data.
+
+        Returns True once `on_data` asks to stop, and False if the agent is not available,
+        in which case the caller continues from the offset reached.
+
+        Raises
+        ------
+        TimeoutError
+            If `deadline` (``time.monotonic``) passes first
+        """
+        while True:
+            wait = max_wait
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'No matching output received from {path} in time')
+                wait = min(wait, remaining)
+            reply = self._agent_call(
+                'read',
+                'log',
+                timeout=wait,
+                path=path,
+                offset=offset,
+                wait=wait,
+                interval=poll_interval,
+            )
+            if reply is None:
+                return False
+            data = base64.b64decode(reply['data'])
+            offset += len(data)
+            if data and on_data(data):
+                return True
+
+    def _wrap_command(self, command, login=None):
+        if login is None:
+            login = self._environment is None
+        if not login and self._environment:
+            variables = ' '.join(
+                f'{name}={shlex.quote(value)}' for name, value in self._environment.items()
+            )
+            return f'''env {variables} {self.shell} -c "{command}"'''
+        if 'csh' in self.shell:
+            return f'''{self.shell} -c "{command}"'''
+        return f'''{self.shell} -lc "{command}"'''
+
+    def _record(self, category, kind, started, **kwargs):
+        """Accounts for a remote round trip that started at `started` (``time.perf_counter``)"""
+        record = CommandRecord(
+            category=category, kind=kind, duration=time.perf_counter() - started, **kwargs
+        )
+        self.metrics.add(record)
+        self.profiler.count(
+            bytes_sent=record.bytes_sent,
+            bytes_received=record.stdout_bytes + record.stderr_bytes,
+        )
+        if self.verbose:
+            console.print(f'[dim]:stopwatch: {record.describe()}', highlight=False)
+
+    def _session_run(self, command, category=None, **kwargs):
+        """Runs `command` with ``session.run``, or through the agent, and accounts for it"""
+        category = category or categorize(command)
+        if (
+            self._agent is not None
+            and not kwargs.get('asynchronous')
+            and kwargs.keys() <= {'warn', 'hide', 'pty', 'echo', 'asynchronous'}
+        ):
+            kwargs.pop('asynchronous', None)
+            if (result := self._agent_run(command, category, **kwargs)) is not None:
+                return result
+        started = time.perf_counter()
+        result = None
+        try:
+            result = self.session.run(command, **kwargs)
+            return result
+        except UnexpectedExit as exc:
+            result = exc.result
+            raise
+        finally:
+            if result is None or kwargs.get('asynchronous'):
+                self._record(category, 'run', started, bytes_sent=len(command))
+            else:
+                self._record(
+                    category,
+                    'run',
+                    started,
+                    exit_status=result.exited,
+                    bytes_sent=len(command),
+                    stdout_bytes=len(result.stdout),
+                    stderr_bytes=len(result.stderr),
+                )
 
     def run_command(
         self,
@@ -131,42 +742,452 @@ class RemoteRunner:
         pty=True,
         echo=True,
         asynchronous=False,
+        login=None,
+        category=None,
         **kwargs,
     ):
-        if 'csh' in self.shell:
-            command = f'''{self.shell} -c "{command}"'''
-        else:
-            command = f'''{self.shell} -lc "{command}"'''
-        out = self.session.run(
-            command, warn=warn, pty=pty, echo=echo, asynchronous=asynchronous, **kwargs
+        """Runs a command on the remote host in the user's shell.
+
+        Commands run in a login shell unless the login environment has been captured
+        (see `capture_env`). Pass ``login=True`` for commands that rely on the login
+        profile beyond its environment variables, e.g. shell functions such as
+        ``conda activate``. `category` labels the command in `metrics`, by default its
+        first word.
+        """
+        category = category or categorize(command)
+        wrapped = self._wrap_command(command, login=login)
+        if echo and wrapped.startswith('env '):
+            # Don't flood the console with the captured environment
+            console.print(f'[bold]{self.shell} -c "{command}"', highlight=False)
+            echo = False
+        command = wrapped
+        out = self._session_run(
+            command,
+            category=category,
+            warn=warn,
+            pty=pty,
+            echo=echo,
+            asynchronous=asynchronous,
+            **kwargs,
         )
         if not asynchronous and exit and out.failed:
-            sys.exit(1)
+            self._exit(
+                RemoteCommandError(f'`{command}` exited with status {out.exited}', result=out)
+            )
         return out
 
     def setup_port_forwarding(self):
         """Sets up SSH port forwarding"""
+        with self._port_forwarding():
+            open_browser(port=int(self.port), token=self.parsed_result['token'], path=self.notebook)
+            self._serve()
+
+    @contextlib.contextmanager
+    def _port_forwarding(self):
+        """Forwards the local port (and services) and yields once Jupyter Lab responds"""
         console.rule('[bold green]Setting up port forwarding', characters='*')
+        self.status = 'forwarding'
         local_port = int(self.port)
-        remote_port = int(self.parsed_result['port'])
-        remote_host = self.parsed_result['hostname']
+        if remote_socket := self.parsed_result.get('sock'):
+            # The engine connects to the socket path when no remote port is given
+            remote_host, remote_port = remote_socket, None
+            console.print(f'remote_socket: {remote_socket}, local_port: {local_port}')
+        else:
+            remote_port = int(self.parsed_result['port'])
+            remote_host = self.parsed_result['hostname']
+            console.print(
+                f'remote_host: {remote_host}, remote_port: {remote_port}, local_port: {local_port}'
+            )
+        # The reserved socket now belongs to whichever serves the local port
+        listener, self.listener = self.listener, None
+        with contextlib.ExitStack() as stack:
+            with self.profiler.span('port forwarding'):
+                if self.cache_assets:
+                    # The proxy listens on the local port and relays to a private forward
+                    forwarded_port = stack.enter_context(
+                        self._forward_local(0, remote_host, remote_port)
+                    )
+                    stack.enter_context(
+                        self._caching_proxy(local_port, forwarded_port, listener=listener)
+                    )
+                else:
+                    stack.enter_context(
+                        self._forward_local(local_port, remote_host, remote_port, listener=listener)
+                    )
+                stack.enter_context(self._forward_services())
+                # don't want open_browser to run before the forwarding is actually working
+                with self._progress(
+                    '[bold cyan]Waiting for Jupyter Lab to respond through the tunnel'
+                ):
+                    ready = wait_for_server(
+                        local_port, path=self._api_path(), timeout=self.ready_timeout
+                    )
+            if not ready:
+                console.print(
+                    f'[bold yellow]:warning: Jupyter Lab did not respond on port {local_port} within {self.ready_timeout} seconds'
+                )
+            yield
+
+    @contextlib.contextmanager
+    def _forward_local(self, local_port, remote_host, remote_port, listener=None):
+        """Forwards `local_port` (or `listener`) to the remote address and yields the bound local port"""
+        if self.forwarding_backend == 'fabric':
+            if listener is not None:
+                # Fabric binds the port itself
+                listener.close()
+            with self.session.forward_local(
+                local_port, remote_port=remote_port, remote_host=remote_host
+            ):
+                yield local_port
+            return
+        # A shared engine keeps running for the other runners that use it
+        engine = ForwardingEngine() if self.engine is None else contextlib.nullcontext(self.engine)
+        with engine as self.forwarding_engine:
+            forward = self.forwarding_engine.forward(
+                self.session.client.get_transport(),
+                remote_host,
+                remote_port,
+                local_port=local_port,
+                listener=listener,
+                policy=self.stripe_policy,
+            )
+            self.forward = forward
+            if self.supervisor is not None:
+                self.supervisor.supervise(forward)
+            if self.transports > 1:
+                self._start_striping()
+            try:
+                yield forward.local_port
+            finally:
+                self._close_stripes()
+                forward.close()
+
+    @contextlib.contextmanager
+    def _forward_services(self):
+        """Forwards the requested services, and those started by the kernels with `detect_ports`.
+
+        All services share the transport (and the engine) of the Jupyter Lab forward.
+        """
+        if not (self._service_specs or self.detect_ports or self.socks_port is not None):
+            yield
+            return
+        if self.socks_port is not None:
+            self._start_socks_proxy()
+        # Services started next to Jupyter Lab on a compute node listen on that node
+        host = self.parsed_result['hostname'] if self.launch_command else 'localhost'
+        for remote_port, local_port in self._service_specs:
+            self._add_service(f'port {remote_port}', host, remote_port, local_port)
+        done = threading.Event()
+        if self.detect_ports:
+            threading.Thread(
+                target=self._detect_ports,
+                args=(done,),
+                name='jupyter-forward-detect',
+                daemon=True,
+            ).start()
+        try:
+            yield
+        finally:
+            done.set()
+            for service in self.services:
+                service.forward.close()
+
+    def _add_service(self, name, remote_host, remote_port, local_port, detected=False):
+        listener = bind_port(local_port)
+        if listener is None:
+            console.print(
+                f'[bold yellow]:warning: Port {local_port} is already in use on your local machine. Forwarding {name} to another port'
+            )
+            listener = bind_port(0)
+        forward = self.forwarding_engine.forward(
+            self.session.client.get_transport(), remote_host, remote_port, listener=listener
+        )
+        if self.supervisor is not None:
+            self.supervisor.supervise(forward)
+        service = Service(name, remote_host, remote_port, forward, detected=detected)
+        self.services.append(service)
         console.print(
-            f'remote_host: {remote_host}, remote_port: {remote_port}, local_port: {local_port}'
+            f'[bold cyan]:white_check_mark: Forwarding {name} on {remote_host} to {service.url}'
         )
-        with self.session.forward_local(
-            local_port,
-            remote_port=remote_port,
-            remote_host=remote_host,
-        ):
-            time.sleep(
-                3
-            )  # don't want open_browser to run before the forwarding is actually working
-            open_browser(port=local_port, token=self.parsed_result['token'], path=self.notebook)
-            self.run_command(f'tail -f {self.log_file}')
+        return service
+
+    def _start_socks_proxy(self):
+        """Listens for SOCKS5 connections to any host reachable from the remote host"""
+        forward = self.forwarding_engine.dynamic_forward(
+            self.session.client.get_transport(),
+            Socks5Handshake(allow=tuple(self.socks_allow)),
+            listener=self._socks_listener,
+        )
+        self._socks_listener = None
+        if self.supervisor is not None:
+            self.supervisor.supervise(forward)
+        allowed = ', '.join(self.socks_allow) or 'any host'
+        self.services.append(Service('SOCKS5 proxy', allowed, None, forward))
+        console.print(
+            f'[bold cyan]:white_check_mark: SOCKS5 proxy to {allowed} listening on localhost:{forward.local_port}'
+        )
+
+    def _detect_ports(self, done):
+        """Forwards the HTTP services that the kernels start listening on until `done` is set"""
+        pid = self.parsed_result.get('pid')
+        if pid is None:
+            console.print(
+                '[bold yellow]:warning: The Jupyter Lab process is unknown. Cannot detect the ports its kernels open'
+            )
+            return
+        script = port_scan_script(pid, self._runtime_dir)
+        # Addresses already seen, with their service or None if it does not speak HTTP
+        known = {}
+        while not done.is_set():
+            try:
+                stdout, _ = self._run_script(script, category='port scan', command='sh -s')
+                listening = set(parse_port_scan(stdout))
+                transport = self.session.client.get_transport()
+                requested = {
+                    service.remote_port for service in self.services if not service.detected
+                }
+                for host, port in sorted(listening - known.keys()):
+                    known[host, port] = None
+                    if port in requested or done.is_set():
+                        continue
+                    if is_http_service(transport, host, port):
+                        known[host, port] = self._add_service(
+                            f'kernel port {port}', host, port, port, detected=True
+                        )
+            except (paramiko.SSHException, OSError, EOFError):
+                # The connection dropped, the supervisor may bring it back
+                listening = known.keys()
+            for address in known.keys() - listening:
+                if service := known.pop(address):
+                    service.forward.close()
+                    self.services.remove(service)
+                    console.print(
+                        f'[bold cyan]:white_check_mark: Stopped forwarding {service.name}, which was closed'
+                    )
+            done.wait(self.detect_interval)
+
+    def _render_services(self):
+        jupyter = Service(
+            'Jupyter Lab', self.forward.remote_host, self.forward.remote_port, self.forward
+        )
+        return render_services([jupyter, *self.services])
+
+    def _live_services(self):
+        """Shows the traffic of the forwarded services while Jupyter Lab is served"""
+        if not (self.services or self.detect_ports) or not self.show_progress:
+            return contextlib.nullcontext()
+        from rich.live import Live
+
+        return Live(get_renderable=self._render_services, console=console, refresh_per_second=1)
+
+    def _start_striping(self):
+        """Opens the additional transports in the background and adds them to `forward`.
+
+        The forward starts on the main transport right away, and connections are spread
+        over the others as soon as they are authenticated.
+        """
+        sessions = [
+            # Same settings as `session`, including the SSH config of the host
+            Connection(
+                self.host,
+                connect_kwargs=dict(self.session.connect_kwargs),
+                connect_timeout=self.session.connect_timeout,
+                config=self.session.config,
+            )
+            for _ in range(self.transports - 1)
+        ]
+        self._stripe_sessions = sessions
+        threading.Thread(
+            target=self._open_stripes,
+            args=(self.forward, sessions),
+            name='jupyter-forward-stripes',
+            daemon=True,
+        ).start()
+
+    def _open_stripes(self, forward, sessions):
+        def open_session(session):
+            # Keys and the agent are reused, but users are never prompted again
+            with contextlib.suppress(Exception):
+                session.open()
+            return session.is_connected
+
+        with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+            opened = [
+                session for session, ok in zip(sessions, pool.map(open_session, sessions)) if ok
+            ]
+        if self._stop.is_set() or sessions is not self._stripe_sessions:
+            # The session ended or reconnected in the meantime
+            return
+        for session in opened:
+            forward.add_transport(session.client.get_transport())
+        if len(opened) < len(sessions):
+            console.print(
+                f'[bold yellow]:warning: Opened {len(opened)} of {len(sessions)} additional connections to {self.session.host}. '
+                'Spreading connections over several transports requires key or agent authentication'
+            )
+        else:
+            console.print(
+                f'[bold cyan]:white_check_mark: Spreading connections over {len(opened) + 1} transports ({self.stripe_policy})'
+            )
+
+    def _close_stripes(self):
+        sessions, self._stripe_sessions = self._stripe_sessions, []
+        for session in sessions:
+            with contextlib.suppress(Exception):
+                session.close()
+
+    @contextlib.contextmanager
+    def _caching_proxy(self, local_port, upstream_port, listener=None):
+        """Serves `local_port` through a proxy that caches static assets on local disk"""
+        cache = AssetCache(max_size=self.asset_cache_size)
+        base_url = self.parsed_result.get('base_url') or '/'
+        with CachingProxy(
+            upstream_port, port=local_port, base_url=base_url, cache=cache, listener=listener
+        ) as proxy:
+            self.proxy = proxy
+            console.print(
+                f'[bold cyan]:white_check_mark: Caching Jupyter Lab assets in {cache.directory}'
+            )
+            yield proxy
+
+    def _progress(self, message):
+        if self.show_progress:
+            return console.status(message, spinner='weather')
+        return contextlib.nullcontext()
+
+    def _serve(self):
+        """Keeps the session alive once Jupyter Lab is reachable"""
+        self.status = 'ready'
+        self._ready.set()
+        with self._live_services():
+            if self.follow_logs:
+                self._follow_log_file()
+            else:
+                self._stop.wait()
+
+    def _follow_log_file(self):
+        """Streams the log file to the console until the connection is closed.
+
+        Output is written as it arrives and only the last `log_buffer_lines` lines are
+        kept in memory, regardless of how long the session runs. With `reconnect`,
+        following resumes over the new connection from where it stopped.
+        """
+        console.rule(f'[bold green]Following {self.log_file}', characters='*')
+        follower = self.log_follower
+        if self._log_offset is None:
+            command = f'tail -n 10 -F {self.log_file}'
+        else:
+            follower.replay(10)
+            command = f'tail -c +{self._log_offset + 1} -F {self.log_file}'
+        transport = self.session.client.get_transport()
+        while True:
+            started = time.perf_counter()
+            received = follower.bytes_received
+            try:
+                with transport.open_session() as channel:
+                    channel.exec_command(self._wrap_command(command))
+                    stream_channel(channel, follower.feed)
+            except (paramiko.ssh_exception.SSHException, OSError, EOFError):
+                if self.supervisor is None:
+                    raise
+            finally:
+                self._record(
+                    'log', 'channel', started, stdout_bytes=follower.bytes_received - received
+                )
+            if self._log_offset is not None:
+                self._log_offset += follower.bytes_received - received
+            previous, transport = transport, self._wait_for_transport()
+            if transport is None or transport is previous:
+                return
+            if self._log_offset is None:
+                # Lines written while disconnected are lost if the offset is unknown
+                command = f'tail -n 0 -F {self.log_file}'
+            else:
+                command = f'tail -c +{self._log_offset + 1} -F {self.log_file}'
+
+    def _wait_for_transport(self):
+        """Returns the transport to use after a channel closed, None if the session is over"""
+        if self.supervisor is None or self._stop.is_set():
+            return None
+        transport = self.supervisor.wait_for_transport()
+        return None if self._stop.is_set() else transport
+
+    @contextlib.contextmanager
+    def _supervise(self):
+        """Keeps the connection alive and reconnects it when `reconnect` is enabled"""
+        if not self.reconnect:
+            yield
+            return
+        with TunnelSupervisor(
+            self.session.client.get_transport(),
+            reconnect=self._reconnect_session,
+            keepalive_interval=self.keepalive_interval,
+            reconnect_timeout=self.reconnect_timeout,
+            on_failure=self._reconnect_failed,
+        ) as self.supervisor:
+            try:
+                yield
+            finally:
+                self.supervisor = None
+
+    def _reconnect_session(self):
+        """Opens a new connection with keys or the agent only.
+
+        Prompting for a password or token from the supervisor thread would fight the
+        console output for the terminal, and nobody may be watching it.
+        """
+        with contextlib.suppress(Exception):
+            self.session.close()
+        # Without a timeout, connecting over a network that is still down takes minutes
+        self.session.connect_timeout = self.session.connect_timeout or 10
+        try:
+            self.session.open()
+        except paramiko.ssh_exception.SSHException as exc:
+            transport = self.session.client.get_transport()
+            if transport is None or not transport.is_active() or transport.is_authenticated():
+                # The network is still down, try again later
+                raise
+            raise ReauthenticationRequiredError(
+                f'Re-authentication required: {self.session.host} did not accept your SSH keys '
+                'or agent when reconnecting. Start jupyter-forward again to log in'
+            ) from exc
+        if self.agent:
+            # The agent went down with the connection
+            self._start_agent()
+        if self._stripe_sessions:
+            # The additional transports went down with the connection
+            self._close_stripes()
+            self._start_striping()
+        return self.session.client.get_transport()
+
+    def _reconnect_failed(self, error):
+        self.status = f'failed: {error}'
+        self.stop()
+
+    def _print_recent_log(self, lines):
+        if lines:
+            console.rule('[bold red]Last lines of the Jupyter Lab log', characters='*')
+            for line in lines:
+                console.out(line, highlight=False)
 
     def close(self):
+        self._release_ports()
+        if self._agent is not None:
+            self._agent.close()
+            self._agent = None
+        self._close_stripes()
         self.session.close()
 
+    def stop(self):
+        """Stops a running session from another thread"""
+        self._stop.set()
+        if self.supervisor is not None:
+            self.supervisor.close()
+        self._cancel_job()
+        if self._owns_detached_server:
+            self._stop_server()
+        self.close()
+
     def start(self):
         """Launches Jupyter Lab on remote host,
         sets up ssh tunnel and opens browser on local machine.
@@ -176,44 +1197,460 @@ class RemoteRunner:
         """
         try:
             self._launch_jupyter()
+            if not self.status.startswith('failed'):
+                self.status = 'stopped'
+        except KeyboardInterrupt:
+            self._cancel_job()
+            raise
         except Exception as exc:
+            self.status = f'failed: {exc}'
             console.print(f'[bold red]:x: {exc}')
+            self._print_recent_log(self.log_follower.lines)
+            self._cancel_job()
             self.close()
         finally:
             console.rule(
                 f'[bold red]:x: Terminated the network 📡 connection to {self.session.host}',
                 characters='*',
             )
+            self._report()
+
+    def _report(self):
+        if self.verbose:
+            console.print(self.metrics.render())
+            if self.proxy is not None:
+                console.print(f'Asset cache: {self.proxy.stats.describe()}', highlight=False)
+        if self.forward is not None and self.transports > 1:
+            console.print(self.forward.render())
+        if self.services:
+            console.print(self._render_services())
+        if self.profile:
+            console.print(self.profiler.render())
+        if self.profile_output:
+            self.profiler.export(self.profile_output, format=self.profile_format)
+            console.print(
+                f'[bold cyan]:white_check_mark: Wrote the launch profile to {self.profile_output}'
+            )
 
     def _get_hostname(self):
         if self.launch_command:
             return '$(hostname -f)'
+        elif self._probed and self._facts.get('hostname'):
+            return self._facts['hostname']
         else:
-            return self.session.run('hostname -f').stdout.strip()
+            hostname = self._session_run('hostname -f').stdout.strip()
+            self._facts['hostname'] = hostname
+            return hostname
+
+    def _session_facts_script(self):
+        """Returns the part of the probe that finds the facts that may change with every login.
+
+        Login aliases that round-robin across nodes land on a different node each time,
+        and node-local directories such as $TMPDIR change with it, so the hostname and
+        the log directory are never taken from the cache.
+        """
+        log_file_name = f'log_{self.session_id}.txt'
+        return textwrap.dedent(
+            f"""\
+            emit() {{ printf '{PROBE_PREFIX} %s=%s\\n' "$1" "$2"; }}
+            emit hostname "$(hostname -f 2>/dev/null)"
+            for dir in "$TMPDIR" "$HOME"; do
+                if [ -n "$dir" ] && [ -d "$dir" ] && [ -w "$dir" ]; then
+                    log_dir="$dir/.jupyter_forward"
+                    if mkdir -p "$log_dir" && touch "$log_dir/{log_file_name}"; then
+                        emit log_dir "$log_dir"
+                        emit log_file "$log_dir/{log_file_name}"
+                        break
+                    fi
+                fi
+            done
+            """
+        )
+
+    def _probe_script(self):
+        activate_check = ':'
+        if self.conda_env:
+            activate_check = textwrap.dedent(
+                f"""\
+                for cmd in "$@"; do
+                    if ( $cmd activate {shlex.quote(self.conda_env)} && command -v jupyter ) >/dev/null 2>&1; then
+                        emit activate_cmd "$cmd activate"
+                        break
+                    fi
+                done"""
+            )
+        return self._session_facts_script() + textwrap.dedent(
+            f"""\
+            if command -v micromamba >/dev/null 2>&1; then
+                emit micromamba 1
+                set -- micromamba
+            elif command -v mamba >/dev/null 2>&1; then
+                emit mamba 1
+                set -- mamba
+            else
+                set -- source conda
+            fi
+            jupyter=$(command -v jupyter 2>/dev/null) && emit jupyter "$jupyter"
+            {textwrap.indent(activate_check, ' ' * 12).lstrip()}
+            """
+        )
+
+    def _validation_script(self, activate_cmd):
+        """Returns a script that checks the cached facts and finds the per-session ones"""
+        check = 'command -v jupyter'
+        if self.conda_env:
+            check = f'{activate_cmd} {shlex.quote(self.conda_env)} && {check}'
+        return self._session_facts_script() + textwrap.dedent(
+            f"""\
+            test -x {self.shell} || exit 1
+            ( {check} ) >/dev/null 2>&1 || exit 1
+            """
+        )
+
+    def _supports_probe(self):
+        return not any(name in pathlib.PurePosixPath(self.shell).name for name in ('csh', 'fish'))
+
+    def _run_script(self, script, category='script', command=None):
+        """Runs a script in a single remote login shell and returns its output.
+
+        `command` overrides the shell that reads the script from its standard input.
+        """
+        command = command or f'{self.shell} -l -s'
+        reply = self._agent_call('run', category, command=command, input=script, combine=True)
+        if reply is not None:
+            return reply['stdout'], reply['exited']
+        started = time.perf_counter()
+        transport = self.session.client.get_transport()
+        with transport.open_session() as channel:
+            channel.set_combine_stderr(True)
+            channel.exec_command(command)
+            channel.sendall(script.encode())
+            channel.shutdown_write()
+            stdout = channel.makefile('rb').read().decode(errors='replace')
+            status = channel.recv_exit_status()
+        self._record(
+            category,
+            'channel',
+            started,
+            exit_status=status,
+            bytes_sent=len(script),
+            stdout_bytes=len(stdout),
+        )
+        return stdout, status
+
+    @phase('probe')
+    def _probe(self):
+        """Gathers all pre-launch facts about the remote host in a single round trip.
+
+        Falls back to the step-by-step checks if the remote shell is not supported
+        or the probe fails.
+        """
+        console.rule(f'[bold green]Probing {self.session.host}', characters='*')
+        if not self._supports_probe():
+            console.print(
+                f'[bold yellow]:warning: Probing is not supported for {self.shell}. Running individual checks instead.'
+            )
+            return self
+        try:
+            stdout, status = self._run_script(self._probe_script(), category='probe')
+        except Exception as exc:
+            console.print(
+                f'[bold yellow]:warning: Probe failed ({exc}). Running individual checks instead.'
+            )
+            return self
+        facts = parse_probe_output(stdout)
+        if status != 0 or 'hostname' not in facts:
+            console.print(
+                '[bold yellow]:warning: Probe returned incomplete results. Running individual checks instead.'
+            )
+            return self
+        self._facts.update(facts)
+        self._probed = True
+        console.print(
+            f'[bold cyan]:white_check_mark: Probed {len(facts)} facts about the remote host'
+        )
+        return self
+
+    def _prepare_server(self):
+        """Probes the remote host and starts Jupyter Lab, or reattaches to a running server"""
+        self.status = 'probing'
+        if not self._use_cached_facts() and self.probe:
+            self._probe()
+        self._set_log_directory()
+        if not (self.reuse and self._reattach()):
+            self._start_jupyter()
 
     def _launch_jupyter(self):
+        self._prepare_server()
+        with self._supervise():
+            try:
+                if self.port_forwarding:
+                    self.setup_port_forwarding()
+                else:
+                    open_browser(url=self.parsed_result['url'], path=self.notebook)
+                    self._serve()
+            finally:
+                if self._owns_detached_server:
+                    self._stop_server()
+
+    def _stop_server(self):
+        """Stops the Jupyter Lab server that was detached to survive reconnections"""
+        self._owns_detached_server = False
+        pid = self.parsed_result.get('pid')
+        if pid is None or not self.session.is_connected:
+            console.print(
+                f'[bold yellow]:warning: Jupyter Lab may still be running on {self.session.host}. Its log is in {self.log_file}'
+            )
+            return
+        self._session_run(f'kill {int(pid)}', category='shutdown', hide=True, warn=True, pty=False)
+        console.print(f'[bold cyan]:white_check_mark: Stopped Jupyter Lab (pid {pid})')
+
+    @phase('start Jupyter Lab')
+    def _start_jupyter(self):
         conda_activate_cmd = self._conda_activate_cmd()
-        self._set_log_directory()
         self._set_log_file()
-        command = rf'jupyter lab --no-browser --ip={self._get_hostname()}'
+        # A per-session runtime directory holds exactly one server info file, see `_read_runtime_file`
+        socket_path = self._socket_path()
+        listen = f'--sock={socket_path}' if socket_path else f'--ip={self._get_hostname()}'
+        command = f'env JUPYTER_RUNTIME_DIR={self._runtime_dir} jupyter lab --no-browser {listen}'
         if self.notebook_dir:
             command = f'{command} --notebook-dir={self.notebook_dir}'
+        detach = (self.reuse or self.reconnect) and not self.launch_command
+        # A server detached only to survive reconnections is stopped with the session
+        self._owns_detached_server = detach and not self.reuse
+        if detach:
+            # Keep the server alive when the SSH connection drops so that it can be reused
+            command = f'nohup {command}'
         command = self._generate_redirect_command(command=command, log_file=self.log_file)
         if self.conda_env:
             command = f'{conda_activate_cmd} {self.conda_env} && {command}'
+        # Lets `_parse_log_file` stop waiting as soon as the server (or its activation) fails
+        command = f'({command}; echo {EXIT_MARKER} >> {self.log_file})'
+        if detach:
+            command = f'{command} &'
+        self._store_facts()
 
         if self.launch_command:
             command = f'{self.launch_command} {self._prepare_batch_job_script(command)}'
 
         console.rule('[bold green]Launching Jupyter Lab', characters='*')
-        self.run_command(command, asynchronous=True)
-        self.parsed_result = self._parse_log_file()
+        self.status = 'launching'
+        if scheduler := detect_scheduler(self.launch_command):
+            self._submit_job(command, scheduler)
+        else:
+            self.run_command(
+                command, asynchronous=True, login=bool(self.conda_env), category='launch'
+            )
+        logged_result = self._parse_log_file()
+        self.parsed_result = self._read_runtime_file() or logged_result
+        if self.reuse:
+            self._register_session()
 
-        if self.port_forwarding:
-            self.setup_port_forwarding()
+    def _socket_path(self):
+        """Returns the Unix socket Jupyter Lab listens on, or None to listen on a TCP port.
+
+        Jupyter creates the socket readable by its owner only, so other users of the
+        remote host cannot connect to the server.
+        """
+        if not self.unix_socket:
+            return None
+        path = f'{self.log_dir}/jupyter_{self.session_id}.sock'
+        # Paths containing variables are expanded by the remote shell and cannot be checked
+        if '$' not in path and len(path.encode()) > MAX_SOCKET_PATH_LENGTH:
+            console.print(
+                f'[bold yellow]:warning: {path} is too long for a Unix socket. Listening on a TCP port instead'
+            )
+            return None
+        return path
+
+    def _submit_job(self, command, scheduler):
+        """Submits the batch job and waits for the scheduler to start it"""
+        result = self.run_command(command, login=bool(self.conda_env), category='launch')
+        job_id = parse_job_id(scheduler, result.stdout)
+        if job_id is None:
+            console.print(
+                f'[bold yellow]:warning: Could not find the job ID in the output of `{self.launch_command}`. Waiting for {self.log_file} instead'
+            )
+            return
+        self.job = JobWatcher(
+            scheduler,
+            job_id,
+            run=self._run_scheduler_command,
+            timeout=self.queue_timeout,
+            stop=self._stop,
+        )
+        self._wait_for_job()
+
+    def _run_scheduler_command(self, command):
+        result = self.run_command(command, exit=False, echo=False, hide=True, pty=False)
+        return result.exited, result.stdout + result.stderr
+
+    @phase('batch queue')
+    def _wait_for_job(self):
+        job_id = self.job.job_id
+        console.rule(f'[bold green]Waiting for batch job {job_id} to start', characters='*')
+        self.status = 'queued'
+
+        def on_change(status):
+            self.status = f'job {status.state}'
+            console.print(f'[bold cyan]Batch job {job_id}: {status.describe()}', highlight=False)
+
+        try:
+            with self._progress(f'[bold cyan]Waiting for batch job {job_id} to start'):
+                status = self.job.wait_until_running(on_change=on_change)
+        except TimeoutError as exc:
+            self._cancel_job()
+            raise LaunchTimeoutError(str(exc)) from exc
+        if status.state == 'finished':
+            raise LaunchError(f'Batch job {job_id} ended before Jupyter Lab started')
+        if status.state == 'unknown':
+            console.print(
+                f'[bold yellow]:warning: Could not query the state of batch job {job_id}. Waiting for {self.log_file} instead'
+            )
         else:
-            open_browser(url=self.parsed_result['url'], path=self.notebook)
-            self.run_command(command=f'tail -f {self.log_file}')
+            console.print(f'[bold cyan]:white_check_mark: Batch job {job_id} is running')
+
+    def _cancel_job(self):
+        """Cancels the submitted batch job unless it runs a server kept for reuse or has ended.
+
+        Called on every way out of a session, possibly from several threads at once.
+        """
+        with self._job_lock:
+            job = self.job
+            if (
+                job is None
+                or job.cancelled
+                or job.state == 'finished'
+                or (self.reuse and self._ready.is_set())
+            ):
+                return
+            if not self.session.is_connected:
+                # Running qdel/scancel would open a new connection, which may prompt again
+                console.print(
+                    f'[bold yellow]:warning: Batch job {job.job_id} may still be queued or running on {self.session.host}'
+                )
+                return
+            try:
+                cancelled = job.cancel()
+            except Exception:
+                cancelled = False
+            if cancelled:
+                console.print(f'[bold yellow]:warning: Cancelled batch job {job.job_id}')
+            else:
+                console.print(f'[bold red]:x: Could not cancel batch job {job.job_id}')
+
+    def _register_session(self):
+        """Records the running server in the remote session registry for later reuse"""
+        entry = {
+            'session_id': self.session_id,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'log_file': self.log_file,
+            'conda_env': self.conda_env,
+            'notebook_dir': self.notebook_dir,
+            **self.parsed_result,
+        }
+        self.put_file(f'{self.log_dir}/session_{self.session_id}.json', f'{json.dumps(entry)}\n')
+        console.print(
+            '[bold cyan]:white_check_mark: Jupyter Lab keeps running after you disconnect. '
+            'Stop it from the Jupyter Lab interface (File > Shut Down) when you are done.'
+        )
+
+    def _server_is_alive(self, hostname, port, path='/api', timeout=5.0, sock=None):
+        """Checks over the SSH transport whether a Jupyter server answers at hostname:port,
+        or on the Unix socket `sock` if given"""
+        started = time.perf_counter()
+        transport = self.session.client.get_transport()
+        kind = 'streamlocal' if sock else 'tcpip'
+        host = 'localhost' if sock else f'{hostname}:{port}'
+        request = f'GET {path} HTTP/1.0\r\nHost: {host}\r\n\r\n'.encode()
+        response = b''
+        try:
+            if sock:
+                channel = open_streamlocal_channel(transport, sock, timeout=timeout)
+            else:
+                channel = transport.open_channel(
+                    'direct-tcpip', (hostname, int(port)), ('127.0.0.1', 0), timeout=timeout
+                )
+        except (paramiko.ssh_exception.SSHException, OSError):
+            self._record('liveness check', kind, started)
+            return False
+        with channel:
+            channel.settimeout(timeout)
+            try:
+                channel.sendall(request)
+                while len(response) < 65536 and (chunk := channel.recv(4096)):
+                    response += chunk
+            except OSError:
+                pass
+        self._record(
+            'liveness check',
+            kind,
+            started,
+            bytes_sent=len(request),
+            stdout_bytes=len(response),
+        )
+        return response.startswith(b'HTTP/1.') and b' 200 ' in response and b'version' in response
+
+    @phase('reattach')
+    def _reattach(self):
+        """Reattaches to a live server previously launched on this host with `reuse`.
+
+        Returns True if one was found. Registry entries of servers that no longer
+        answer are removed.
+        """
+        console.rule('[bold green]Looking for a running Jupyter Lab server', characters='*')
+        result = self._session_run(
+            f'cat {self.log_dir}/session_*.json',
+            category='session registry',
+            hide=True,
+            warn=True,
+            pty=False,
+        )
+        stale = []
+        other_transport = 0
+        for entry in parse_session_registry(result.stdout):
+            if (
+                entry.get('conda_env') != self.conda_env
+                or entry.get('notebook_dir') != self.notebook_dir
+            ):
+                continue
+            if bool(entry.get('sock')) != self.unix_socket:
+                # A server on a Unix socket is never swapped for one on a TCP port, or vice versa
+                other_transport += 1
+                continue
+            base_url = entry.get('base_url') or '/'
+            if self._server_is_alive(
+                entry['hostname'],
+                entry['port'],
+                path=f'{base_url.rstrip("/")}/api',
+                sock=entry.get('sock'),
+            ):
+                break
+            stale.append(entry['session_id'])
+        else:
+            entry = None
+        if stale:
+            paths = ' '.join(f'{self.log_dir}/session_{session_id}.json' for session_id in stale)
+            self._session_run(f'rm -f {paths}', category='session registry', hide=True, warn=True)
+        if entry is None:
+            if other_transport:
+                transport = 'a TCP port' if self.unix_socket else 'a Unix socket'
+                console.print(
+                    f'[bold yellow]:warning: Not reusing {other_transport} Jupyter Lab server(s) listening on {transport}'
+                )
+            console.print('[bold cyan]No running Jupyter Lab server found. Launching a new one.')
+            return False
+        self.parsed_result = {
+            key: entry[key]
+            for key in ('hostname', 'port', 'token', 'url', 'base_url', 'sock')
+            if key in entry
+        }
+        self.log_file = entry['log_file']
+        address = entry.get('sock') or f'{entry["hostname"]}:{entry["port"]}'
+        console.print(
+            f'[bold cyan]:white_check_mark: Reattaching to Jupyter Lab started at {entry["created"]} on {address}'
+        )
+        return True
 
     def _generate_redirect_command(self, *, log_file: str, command: str) -> str:
         if 'csh' in self.shell:
@@ -222,6 +1659,8 @@ class RemoteRunner:
             return f'{command} > {log_file} 2>&1'
 
     def _command_exists(self, command: str) -> bool:
+        if (reply := self._agent_call('which', 'which', name=command)) is not None:
+            return reply['path'] is not None
         try:
             result = self.run_command(f'which {command}', warn=False, echo=False, exit=False)
             return not result.failed
@@ -229,11 +1668,14 @@ class RemoteRunner:
             console.print(f'[bold yellow]:warning: `{command.lower()}` check failed: {e}')
             return False
 
+    @phase('conda activation')
     def _conda_activate_cmd(self):
         console.rule(
             '[bold green]Running Jupyter sanity checks',
             characters='*',
         )
+        if self._probed:
+            return self._probed_conda_activate_cmd()
         check_jupyter_status = 'which jupyter'
         activate_cmds = ['source activate', 'conda activate']
 
@@ -250,9 +1692,12 @@ class RemoteRunner:
         if self.conda_env:
             for cmd in activate_cmds:
                 try:
-                    self.run_command(f'{cmd} {self.conda_env} && {check_jupyter_status}')
+                    self.run_command(
+                        f'{cmd} {self.conda_env} && {check_jupyter_status}', login=True
+                    )
+                    self._facts['activate_cmd'] = cmd
                     return cmd  # Return the successfully executed command
-                except SystemExit:
+                except (SystemExit, RemoteCommandError):
                     console.print(f'[bold red]:x: `{cmd}` failed. Trying next...')
         else:
             self.run_command(check_jupyter_status)
@@ -261,30 +1706,151 @@ class RemoteRunner:
         console.print(
             '[bold red]:x: Could not activate environment. Ensure Conda or Mamba is installed.'
         )
-        sys.exit(1)
+        self._exit(LaunchError('Could not find an environment with Jupyter Lab'))
+
+    def _probed_conda_activate_cmd(self):
+        if not (self._facts.get('micromamba') or self._facts.get('mamba')):
+            console.print('[bold yellow]:warning: (micro)mamba not found. Using conda instead.')
+        if self.conda_env:
+            if cmd := self._facts.get('activate_cmd'):
+                console.print(f'[bold cyan]:white_check_mark: `{cmd} {self.conda_env}` succeeded')
+                return cmd
+        elif jupyter := self._facts.get('jupyter'):
+            console.print(f'[bold cyan]:white_check_mark: Using {jupyter}')
+            return None
+        console.print(
+            '[bold red]:x: Could not activate environment. Ensure Conda or Mamba is installed.'
+        )
+        self._exit(LaunchError('Could not find an environment with Jupyter Lab'))
+
+    @phase('wait for Jupyter Lab')
+    def _parse_log_file(self, timeout=None, poll_interval=0.1, max_poll_interval=2.0):
+        """Follows the log file over a single channel until Jupyter reports its URL.
 
-    def _parse_log_file(self):
-        # wait for logfile to contain access info, then write it to screen
-        condition = True
-        stdout = None
-        with console.status(
-            f'[bold cyan]Parsing {self.log_file} log file on {self.session.host} for jupyter information',
-            spinner='weather',
+        With the agent, the file is read through it instead of a new channel. The
+        deadline starts once the server is launched, after any batch queue wait.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Deadline in seconds, by default `launch_timeout`
+        poll_interval : float, optional
+            Initial wake-up interval in seconds while the log is silent, by default 0.1.
+            The agent checks the file for new data at this interval.
+        max_poll_interval : float, optional
+            Upper bound of the wake-up interval in seconds, by default 2.0
+        """
+        timeout = self.launch_timeout if timeout is None else timeout
+        parser = JupyterLogParser()
+        history = self.log_follower
+        offset = 0
+
+        def on_data(data):
+            nonlocal offset
+            offset += len(data)
+            history.feed(data)
+            return parser.feed(data)
+
+        self.status = 'waiting for Jupyter Lab'
+        with self._progress(
+            f'[bold cyan]Parsing {self.log_file} log file on {self.session.host} for jupyter information'
         ):
-            # TODO: Ensure this loop doesn't run forever if the log file is not found or empty
-            while condition:
-                with contextlib.suppress(invoke.exceptions.UnexpectedExit):
-                    result = self.run_command(f'cat {self.log_file}', echo=False, hide='out')
-                    if 'is running at:' in result.stdout.strip():
-                        condition = False
-                        stdout = result.stdout
-        return parse_stdout(stdout)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            try:
+                with history.quiet():
+                    if not self._follow_with_agent(
+                        self.log_file, on_data, deadline=deadline, poll_interval=poll_interval
+                    ):
+                        self._tail_log_file(
+                            on_data,
+                            offset,
+                            deadline=deadline,
+                            poll_interval=poll_interval,
+                            max_poll_interval=max_poll_interval,
+                        )
+            except TimeoutError as exc:
+                raise LaunchTimeoutError(
+                    f'Jupyter Lab did not report its URL in {self.log_file} within {timeout} seconds',
+                    log_tail=self._log_tail(),
+                ) from exc
+        if parser.exited:
+            raise LaunchError(
+                f'Jupyter Lab exited before reporting its URL in {self.log_file}',
+                log_tail=self._log_tail(),
+            )
+        if not parser.ready:
+            raise LaunchError(
+                f'Stopped following {self.log_file} before Jupyter Lab was ready',
+                log_tail=self._log_tail(),
+            )
+        # The log was read from its first byte, so following it can pick up from here
+        self._log_offset = offset
+        return parser.result
 
+    def _log_tail(self, count=20):
+        """Returns the last `count` lines of the log received so far"""
+        lines = [line for line in self.log_follower.lines if line.strip() != EXIT_MARKER]
+        return lines[-count:]
+
+    def _tail_log_file(self, on_data, offset, *, deadline=None, **kwargs):
+        """Streams the log file from `offset` to `on_data` over a single channel"""
+        started = time.perf_counter()
+        received = 0
+
+        def counted(data):
+            nonlocal received
+            received += len(data)
+            return on_data(data)
+
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        transport = self.session.client.get_transport()
+        try:
+            with transport.open_session() as channel:
+                # `tail -F` keeps following the file even if it does not exist yet
+                channel.exec_command(
+                    self._wrap_command(f'tail -c +{offset + 1} -F {self.log_file}')
+                )
+                stream_channel(channel, counted, timeout=timeout, **kwargs)
+        finally:
+            self._record('log', 'channel', started, stdout_bytes=received)
+
+    @property
+    def _runtime_dir(self):
+        return f'{self.log_dir}/runtime_{self.session_id}'
+
+    @phase('read runtime file')
+    def _read_runtime_file(self):
+        """Reads the server info file Jupyter wrote to this session's runtime directory.
+
+        The file holds the exact hostname, port (or socket), token and base_url of the
+        server.
+        Returns None if it cannot be read, in which case the URL parsed from the log
+        is used instead.
+        """
+        result = self._session_run(
+            f'cat {self._runtime_dir}/jpserver-*.json',
+            category='runtime file',
+            hide=True,
+            warn=True,
+            pty=False,
+        )
+        parsed = parse_runtime_file(result.stdout) if result.ok else None
+        if parsed is None:
+            console.print(
+                f'[bold yellow]:warning: Could not read the Jupyter runtime file in {self._runtime_dir}. Using the URL found in {self.log_file}'
+            )
+        return parsed
+
+    def _api_path(self):
+        base_url = self.parsed_result.get('base_url') or '/'
+        return f'{base_url.rstrip("/")}/api'
+
+    @phase('batch job script')
     def _prepare_batch_job_script(self, command):
         from rich.syntax import Syntax
 
         console.rule('[bold green]Preparing Batch Job script', characters='*')
-        script_file = f'{self.log_dir}/batch_job_script_{timestamp}'
+        script_file = f'{self.log_dir}/batch_job_script_{self.session_id}'
         shell = self.shell
         if 'csh' not in shell:
             shell = f'{shell} -l'
@@ -301,20 +1867,37 @@ class RemoteRunner:
         console.print(f'[bold cyan]:white_check_mark: Batch Job script resides in {script_file}')
         return script_file
 
+    @phase('set log file')
     def _set_log_file(self):
-        log_file = f'{self.log_dir}/log_{timestamp}.txt'
+        if self._probed and 'log_file' in self._facts:
+            self.log_file = self._facts['log_file']
+            console.print(f'[bold cyan]:white_check_mark: Log file is set to {self.log_file}')
+            return self
+        log_file = f'{self.log_dir}/log_{self.session_id}.txt'
         self.run_command(command=f'touch {log_file}')
         self.log_file = log_file
         console.print(f'[bold cyan]:white_check_mark: Log file is set to {log_file}')
         return self
 
+    @phase('set log directory')
     def _set_log_directory(self):
         def _check_log_file_dir(directory):
+            if (reply := self._agent_call('stat', 'log directory', path=directory)) is not None:
+                return directory if reply['is_dir'] and reply['writable'] else None
             check_dir_command = f"touch {directory}/foobar && rm -rf {directory}/foobar && echo '{directory} is WRITABLE' || echo '{directory} is NOT WRITABLE'"
             _tmp_dir_status = self.run_command(command=check_dir_command, exit=False)
             return directory if 'is WRITABLE' in _tmp_dir_status.stdout.strip() else None
 
         console.rule(f'[bold green] Creating log file on {self.session.host}', characters='*')
+        if self._probed:
+            if 'log_dir' not in self._facts:
+                console.print(
+                    '[bold red]:x: Can not determine directory for log file: neither $TMPDIR nor $HOME is writable'
+                )
+                self._exit(LaunchError('Neither $TMPDIR nor $HOME is writable'))
+            self.log_dir = self._facts['log_dir']
+            console.print(f'[bold cyan]:white_check_mark: Log directory is set to {self.log_dir}')
+            return self
         # TODO: Allow users to override this via a `--log-dir`
         log_dir = None
         # Try TMPDIR first if defined
@@ -333,9 +1916,10 @@ class RemoteRunner:
                 console.print(
                     f'[bold red]:x: Can not determine directory for log file:\n{home_dir_error_message}\n{tmp_dir_error_message}'
                 )
-                sys.exit(1)
+                self._exit(LaunchError('Neither $TMPDIR nor $HOME is defined'))
         log_dir = f'{log_dir}/.jupyter_forward'
         self.run_command(command=f'mkdir -p {log_dir}')
+        self._facts['log_dir'] = log_dir
         console.print(f'[bold cyan]:white_check_mark: Log directory is set to {log_dir}')
         self.log_dir = log_dir
         return self
@@ -0,0 +1,53 @@
+"""Errors raised instead of exiting when `RemoteRunner.raise_errors` is set"""
+
+
+class JupyterForwardError(Exception):
+    """Base class of all jupyter-forward errors"""
+
+
+class PortUnavailableError(JupyterForwardError):
+    """A local port is already in use"""
+
+
+class AuthenticationError(JupyterForwardError):
+    """The remote host did not accept any of the credentials"""
+
+
+class ReauthenticationRequiredError(AuthenticationError):
+    """Reconnecting needs a password or token, which is never asked for in the background"""
+
+
+class RemoteCommandError(JupyterForwardError):
+    """A remote command exited with a non-zero status
+
+    Parameters
+    ----------
+    message : str
+        Description of the failure
+    result : invoke.runners.Result, optional
+        Result of the command, with its exit status and output
+    """
+
+    def __init__(self, message: str, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+class LaunchError(JupyterForwardError, RuntimeError):
+    """Jupyter Lab could not be started on the remote host
+
+    Parameters
+    ----------
+    message : str
+        Description of the failure
+    log_tail : list of str, optional
+        Last lines of the Jupyter Lab log received before the failure
+    """
+
+    def __init__(self, message: str, log_tail=None):
+        super().__init__(message)
+        self.log_tail = list(log_tail or [])
+
+
+class LaunchTimeoutError(LaunchError, TimeoutError):
+    """Jupyter Lab did not report its URL in time"""
@@ -0,0 +1,795 @@
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import selectors
+import socket
+import threading
+import time
+import typing
+
+import paramiko
+from paramiko.common import cMSG_CHANNEL_OPEN
+
+# paramiko's defaults (2 MiB window, 32 KiB packets) leave a single channel starved on
+# links with a large bandwidth-delay product, e.g. when downloading big notebook outputs.
+DEFAULT_WINDOW_SIZE = 16 * 2**20
+DEFAULT_MAX_PACKET_SIZE = 2**15
+DEFAULT_BUFFER_SIZE = 2**18
+
+# Raised by channel operations once the transport has died underneath them
+_CHANNEL_ERRORS = (OSError, EOFError, paramiko.SSHException)
+
+# How a forward spreads new connections over its transports, see `Forward.pick`
+STRIPE_POLICIES = ('least-loaded', 'round-robin')
+
+
+def tune_transport(transport: paramiko.Transport) -> None:
+    """Disables Nagle's algorithm on the socket of an SSH transport.
+
+    Small writes (HTTP headers, websocket messages) must not wait for the ACK of the
+    previous SSH packet. The transport socket may be a ProxyCommand without options.
+    """
+    with contextlib.suppress(AttributeError, OSError):
+        transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def open_streamlocal_channel(
+    transport: paramiko.Transport,
+    socket_path: str,
+    *,
+    window_size: int | None = None,
+    max_packet_size: int | None = None,
+    timeout: float | None = None,
+) -> paramiko.Channel:
+    """Opens a channel to a Unix domain socket on the SSH server.
+
+    This is the ``direct-streamlocal@openssh.com`` extension of OpenSSH (``ssh -L
+    port:/path/to/socket``), which paramiko can only open through its private API.
+    The waiting mirrors `paramiko.Transport.open_channel`.
+
+    Parameters
+    ----------
+    transport : paramiko.Transport
+        Authenticated transport
+    socket_path : str
+        Absolute path of the socket on the SSH server
+    window_size : int, optional
+        SSH window size of the channel, by default paramiko's
+    max_packet_size : int, optional
+        Maximum SSH packet size of the channel, by default paramiko's
+    timeout : float, optional
+        Seconds to wait for the server to open the channel
+
+    Raises
+    ------
+    paramiko.SSHException
+        If the server rejects the channel, e.g. because nothing listens on the socket
+    """
+    if not transport.active:
+        raise paramiko.SSHException('SSH session not active')
+    timeout = transport.channel_timeout if timeout is None else timeout
+    with transport.lock:
+        window_size = transport._sanitize_window_size(window_size)
+        max_packet_size = transport._sanitize_packet_size(max_packet_size)
+        chanid = transport._next_channel()
+        message = paramiko.Message()
+        message.add_byte(cMSG_CHANNEL_OPEN)
+        message.add_string('direct-streamlocal@openssh.com')
+        message.add_int(chanid)
+        message.add_int(window_size)
+        message.add_int(max_packet_size)
+        message.add_string(socket_path)
+        # Reserved fields, see PROTOCOL in the OpenSSH sources
+        message.add_string('')
+        message.add_int(0)
+        channel = paramiko.Channel(chanid)
+        transport._channels.put(chanid, channel)
+        transport.channel_events[chanid] = event = threading.Event()
+        transport.channels_seen[chanid] = True
+        channel._set_transport(transport)
+        channel._set_window(window_size, max_packet_size)
+    transport._send_user_message(message)
+    deadline = time.monotonic() + timeout
+    while not event.wait(0.1):
+        if not transport.active:
+            break
+        if time.monotonic() > deadline:
+            raise paramiko.SSHException('Timeout opening channel.')
+    channel = transport._channels.get(chanid)
+    if channel is not None and event.is_set():
+        return channel
+    raise transport.get_exception() or paramiko.SSHException('Unable to open channel.')
+
+
+@dataclasses.dataclass
+class TransferStats:
+    """Traffic counters of a forward.
+
+    Parameters
+    ----------
+    connections : int
+        Number of local connections accepted so far
+    active : int
+        Number of connections currently open
+    failed : int
+        Number of connections for which no SSH channel could be opened
+    bytes_sent : int
+        Bytes sent from the local side to the remote service
+    bytes_received : int
+        Bytes received from the remote service
+    """
+
+    connections: int = 0
+    active: int = 0
+    failed: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+
+
+@dataclasses.dataclass(eq=False)
+class Stripe:
+    """One of the transports a forward spreads its connections over.
+
+    Parameters
+    ----------
+    transport : paramiko.Transport
+        Authenticated transport
+    stats : TransferStats
+        Traffic carried by this transport
+    """
+
+    transport: paramiko.Transport = dataclasses.field(repr=False)
+    stats: TransferStats = dataclasses.field(default_factory=TransferStats)
+
+
+@dataclasses.dataclass(eq=False)
+class Forward:
+    """A local listening socket whose connections are forwarded to a remote service.
+
+    Assigning a new `transport` makes all subsequent connections use it, while
+    connections that are already open keep their channel. While the forward is
+    suspended, new connections are accepted but held until it is resumed.
+
+    If set, `on_open_failure` is called with the transport whenever a channel cannot be
+    opened. Returning True holds the connection and retries once the forward is
+    resumed, e.g. after the supervisor replaced a dead transport.
+
+    If `remote_port` is None, `remote_host` is the path of a Unix domain socket on the
+    SSH server.
+
+    Transports added with `add_transport` carry new connections too. Each SSH transport
+    encrypts on a single thread and windows its channels, so spreading connections
+    over several of them raises the throughput of parallel downloads. `policy` is
+    'least-loaded' (fewest open connections) or 'round-robin'.
+
+    Forwards created with `ForwardingEngine.dynamic_forward` have a `handshake`, which
+    reads the destination of every connection from the client, e.g. with SOCKS5.
+    """
+
+    engine: ForwardingEngine = dataclasses.field(repr=False)
+    listener: socket.socket = dataclasses.field(repr=False)
+    remote_host: str
+    remote_port: int | None
+    transport: paramiko.Transport = dataclasses.field(repr=False)
+    stats: TransferStats = dataclasses.field(default_factory=TransferStats)
+    on_open_failure: typing.Callable[[paramiko.Transport], bool] | None = dataclasses.field(
+        default=None, repr=False
+    )
+    policy: str = 'least-loaded'
+    handshake: typing.Any = dataclasses.field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.policy not in STRIPE_POLICIES:
+            raise ValueError(f'`policy` must be one of {STRIPE_POLICIES}, got {self.policy!r}')
+        self._available = threading.Event()
+        self._available.set()
+        # Kept so that the port can still be reported after the listener is closed
+        self._local_port = self.listener.getsockname()[1]
+        # The first stripe always uses `transport`, whichever transport that is
+        self.stripes = [Stripe(self.transport)]
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    @property
+    def suspended(self) -> bool:
+        return not self._available.is_set()
+
+    @property
+    def local_port(self) -> int:
+        return self._local_port
+
+    @property
+    def destination(self) -> tuple[str, int] | str:
+        if self.remote_port is None:
+            return self.remote_host
+        return self.remote_host, int(self.remote_port)
+
+    def suspend(self) -> None:
+        """Holds new connections until `resume` is called, e.g. while reconnecting"""
+        self._available.clear()
+
+    def resume(self, transport: paramiko.Transport | None = None) -> None:
+        """Opens the held and all new connections through `transport`, if given"""
+        if transport is not None:
+            tune_transport(transport)
+            self.transport = transport
+        self._available.set()
+
+    def close(self) -> None:
+        """Stops listening and closes all connections of this forward"""
+        self.engine.remove(self)
+
+    def add_transport(self, transport: paramiko.Transport) -> Stripe:
+        """Spreads new connections over `transport` as well"""
+        tune_transport(transport)
+        stripe = Stripe(transport)
+        with self._lock:
+            self.stripes.append(stripe)
+        return stripe
+
+    def pick(self) -> Stripe:
+        """Returns the stripe to open the next connection on and counts it as active"""
+        with self._lock:
+            self.stripes[0].transport = self.transport
+            # Additional transports that died are dropped. The first one is replaced by
+            # reconnecting instead.
+            self.stripes[1:] = [
+                stripe for stripe in self.stripes[1:] if stripe.transport.is_active()
+            ]
+            if self.policy == 'round-robin':
+                stripe = self.stripes[self._turn % len(self.stripes)]
+                self._turn += 1
+            else:
+                stripe = min(
+                    self.stripes,
+                    key=lambda stripe: (
+                        stripe.stats.active,
+                        stripe.stats.bytes_sent + stripe.stats.bytes_received,
+                    ),
+                )
+            stripe.stats.connections += 1
+            stripe.stats.active += 1
+            return stripe
+
+    def release(self, stripe: Stripe, failed: bool = False) -> None:
+        """Records that a connection picked on `stripe` was closed"""
+        with self._lock:
+            stripe.stats.active -= 1
+            stripe.stats.failed += failed
+
+    def render(self):
+        """Returns a table of the traffic carried by each transport"""
+        from rich.filesize import decimal
+        from rich.table import Table
+
+        table = Table(title=f'Transport load (port {self.local_port}, {self.policy})')
+        table.add_column('Transport', justify='right')
+        table.add_column('Connections', justify='right')
+        table.add_column('Active', justify='right')
+        table.add_column('Failed', justify='right')
+        table.add_column('Sent', justify='right')
+        table.add_column('Received', justify='right')
+        with self._lock:
+            stripes = list(self.stripes)
+        for number, stripe in enumerate(stripes, start=1):
+            table.add_row(
+                str(number),
+                str(stripe.stats.connections),
+                str(stripe.stats.active),
+                str(stripe.stats.failed),
+                decimal(stripe.stats.bytes_sent),
+                decimal(stripe.stats.bytes_received),
+            )
+        return table
+
+
+class _Connection:
+    """A local socket spliced to an SSH channel. Only used from the engine thread."""
+
+    def __init__(self, engine, forward, sock, channel, stripe):
+        self.engine = engine
+        self.forward = forward
+        self.sock = sock
+        self.channel = channel
+        self.stripe = stripe
+        # Data that could not be written yet, in both directions
+        self.upstream = b''
+        self.downstream = b''
+        self.sock_eof = False
+        self.channel_eof = False
+        self.eof_sent = False
+        self.sock_shut = False
+        self.closed = False
+
+    def on_sock(self, events):
+        if events & selectors.EVENT_WRITE:
+            self._write_sock(self.downstream)
+        if events & selectors.EVENT_READ and not self.closed:
+            buffer = self.engine._buffer
+            try:
+                size = self.sock.recv_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                size = None
+            except OSError:
+                return self.close()
+            if size == 0:
+                self.sock_eof = True
+            elif size:
+                self.forward.stats.bytes_sent += size
+                self.stripe.stats.bytes_sent += size
+                self._write_channel(memoryview(buffer)[:size])
+        self.update()
+
+    def on_channel(self, events):
+        if self.closed:
+            return
+        try:
+            data = self.channel.recv(self.engine.buffer_size)
+        except TimeoutError:
+            # The readiness pipe of a paramiko channel may fire before data arrives
+            data = None
+        except _CHANNEL_ERRORS:
+            return self.close()
+        if data == b'':
+            self.channel_eof = True
+        elif data:
+            self.forward.stats.bytes_received += len(data)
+            self.stripe.stats.bytes_received += len(data)
+            self._write_sock(data)
+        self.update()
+
+    def flush(self):
+        self._write_channel(self.upstream)
+        self.update()
+
+    def _write_channel(self, data):
+        sent = 0
+        while sent < len(data):
+            try:
+                size = self.channel.send(data[sent:])
+            except TimeoutError:
+                # The channel window is exhausted. Retry once the server adjusts it.
+                break
+            except _CHANNEL_ERRORS:
+                return self.close()
+            if size == 0:
+                return self.close()
+            sent += size
+        self.upstream = bytes(data[sent:])
+
+    def _write_sock(self, data):
+        try:
+            sent = self.sock.send(data) if data else 0
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            return self.close()
+        self.downstream = bytes(data[sent:])
+
+    def update(self):
+        """Propagates half-closes and registers interest in the next events"""
+        if self.closed:
+            return
+        if self.sock_eof and not self.upstream and not self.eof_sent:
+            self.eof_sent = True
+            if not self.channel.closed:
+                try:
+                    self.channel.shutdown_write()
+                except _CHANNEL_ERRORS:
+                    return self.close()
+        if self.channel_eof and not self.downstream and not self.sock_shut:
+            self.sock_shut = True
+            try:
+                self.sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                return self.close()
+        if self.eof_sent and self.sock_shut:
+            return self.close()
+        if self.upstream and self.channel.closed:
+            return self.close()
+
+        # Stop reading from one side while the other cannot keep up, so that the SSH
+        # window and the kernel socket buffers provide the back-pressure.
+        sock_events = 0
+        if not self.sock_eof and not self.upstream:
+            sock_events |= selectors.EVENT_READ
+        if self.downstream:
+            sock_events |= selectors.EVENT_WRITE
+        channel_events = 0
+        if not self.channel_eof and not self.downstream:
+            channel_events = selectors.EVENT_READ
+        self.engine._watch(self.sock, sock_events, self.on_sock)
+        self.engine._watch(self.channel, channel_events, self.on_channel)
+        if self.upstream:
+            self.engine._stalled.add(self)
+        else:
+            self.engine._stalled.discard(self)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.engine._watch(self.sock, 0)
+        self.engine._watch(self.channel, 0)
+        self.engine._stalled.discard(self)
+        self.engine._connections.discard(self)
+        self.forward.stats.active -= 1
+        self.forward.release(self.stripe)
+        self.sock.close()
+        with contextlib.suppress(*_CHANNEL_ERRORS):
+            self.channel.close()
+
+
+@dataclasses.dataclass
+class ForwardingEngine:
+    """Forwards local TCP connections over SSH channels from a single event loop.
+
+    One thread multiplexes every listening socket, local connection and SSH channel
+    with `selectors`, copying data through a reusable buffer. SSH channels are opened
+    in a small thread pool, so a slow channel open never stalls established
+    connections. Connections to dynamic forwards negotiate their destination in a
+    separate pool, so slow or idle clients cannot hold up the opening of channels.
+
+    Parameters
+    ----------
+    window_size : int, optional
+        SSH window size requested for every channel, by default 16 MiB
+    max_packet_size : int, optional
+        Maximum SSH packet size requested for every channel, by default 32 KiB
+    buffer_size : int, optional
+        Size of the buffer used for every read, by default 256 KiB
+    open_timeout : float, optional
+        Seconds to wait for the server to open a channel, by default 10
+    max_workers : int, optional
+        Number of threads opening channels, by default 8
+    max_handshakes : int, optional
+        Number of threads negotiating with clients of dynamic forwards, by default 8
+    retry_interval : float, optional
+        Seconds between attempts to send on a channel whose window is exhausted
+    hold_timeout : float, optional
+        Seconds a new connection is held while its forward is suspended, by default 60
+    """
+
+    window_size: int = DEFAULT_WINDOW_SIZE
+    max_packet_size: int = DEFAULT_MAX_PACKET_SIZE
+    buffer_size: int = DEFAULT_BUFFER_SIZE
+    open_timeout: float = 10.0
+    max_workers: int = 8
+    max_handshakes: int = 8
+    retry_interval: float = 0.005
+    hold_timeout: float = 60.0
+
+    def __post_init__(self):
+        self.forwards: list[Forward] = []
+        self._buffer = bytearray(self.buffer_size)
+        self._connections: set[_Connection] = set()
+        self._stalled: set[_Connection] = set()
+        self._callbacks: collections.deque[typing.Callable] = collections.deque()
+        self._lock = threading.Lock()
+        self._selector = None
+        self._thread = None
+        self._pool = None
+        self._handshake_pool = None
+        self._closing = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Starts the event loop thread. Called automatically by `forward`."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._selector = selectors.DefaultSelector()
+            self._wakeup_r, self._wakeup_w = socket.socketpair()
+            self._wakeup_r.setblocking(False)
+            self._wakeup_w.setblocking(False)
+            self._selector.register(self._wakeup_r, selectors.EVENT_READ, self._drain_wakeup)
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix='jupyter-forward-open'
+            )
+            self._handshake_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_handshakes, thread_name_prefix='jupyter-forward-handshake'
+            )
+            self._thread = threading.Thread(
+                target=self._run, name='jupyter-forward-engine', daemon=True
+            )
+            self._thread.start()
+
+    def forward(
+        self,
+        transport: paramiko.Transport,
+        remote_host: str,
+        remote_port: int | None,
+        *,
+        local_port: int = 0,
+        bind_address: str = 'localhost',
+        listener: socket.socket | None = None,
+        policy: str = 'least-loaded',
+        handshake: typing.Any = None,
+    ) -> Forward:
+        """Forwards connections to a local port to `remote_host:remote_port`.
+
+        Parameters
+        ----------
+        transport : paramiko.Transport
+            Authenticated transport used to open channels
+        remote_host : str
+            Host to connect to, as seen from the SSH server, or the path of a Unix
+            domain socket on the SSH server if `remote_port` is None
+        remote_port : int or None
+            Port to connect to on `remote_host`
+        local_port : int, optional
+            Local port to listen on, by default any free port
+        bind_address : str, optional
+            Local address to listen on, by default localhost
+        listener : socket.socket, optional
+            Already bound listening socket to use instead of creating one
+        policy : str, optional
+            How connections are spread once transports are added with
+            `Forward.add_transport`, by default 'least-loaded'
+        handshake : optional
+            Negotiates the destination of every connection instead of `remote_host`
+            and `remote_port`, see `dynamic_forward`
+
+        Returns
+        -------
+        Forward
+        """
+        if listener is None:
+            listener = socket.create_server((bind_address, local_port), backlog=128)
+        tune_transport(transport)
+        listener.setblocking(False)
+        forward = Forward(
+            self, listener, remote_host, remote_port, transport, policy=policy, handshake=handshake
+        )
+        self.start()
+        self._call_soon(self._add_forward, forward)
+        return forward
+
+    def dynamic_forward(
+        self,
+        transport: paramiko.Transport,
+        handshake,
+        *,
+        local_port: int = 0,
+        bind_address: str = 'localhost',
+        listener: socket.socket | None = None,
+    ) -> Forward:
+        """Forwards every local connection to the destination it asks for, like ``ssh -D``.
+
+        Parameters
+        ----------
+        transport : paramiko.Transport
+            Authenticated transport used to open channels
+        handshake : object
+            Called from the channel-opening threads. ``handshake.negotiate(sock)`` reads
+            the request of a new connection and returns the ``(host, port)`` to connect
+            to, or None to drop it. ``handshake.reply(sock, opened)`` then tells the
+            client whether the channel could be opened, see `socks.Socks5Handshake`.
+        local_port : int, optional
+            Local port to listen on, by default any free port
+        bind_address : str, optional
+            Local address to listen on, by default localhost
+        listener : socket.socket, optional
+            Already bound listening socket to use instead of creating one
+
+        Returns
+        -------
+        Forward
+        """
+        return self.forward(
+            transport,
+            '*',
+            0,
+            local_port=local_port,
+            bind_address=bind_address,
+            listener=listener,
+            handshake=handshake,
+        )
+
+    def adopt(
+        self,
+        sock: socket.socket,
+        forward: Forward,
+        destination: tuple[str, int] | str | None = None,
+    ) -> None:
+        """Forwards an already accepted local connection through `forward`.
+
+        Parameters
+        ----------
+        sock : socket.socket
+            Connected local socket
+        forward : Forward
+            Forward whose transport and counters are used
+        destination : tuple of (str, int) or str, optional
+            Remote address or socket path to connect to, by default that of `forward`
+        """
+        sock.setblocking(False)
+        with contextlib.suppress(OSError):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        forward.stats.connections += 1
+        forward.stats.active += 1
+        self._pool.submit(self._open_channel, sock, forward, destination or forward.destination)
+
+    def remove(self, forward: Forward) -> None:
+        """Stops listening on `forward` and closes its connections"""
+        self._call_soon(self._remove_forward, forward)
+
+    def close(self) -> None:
+        """Closes all forwards and connections and stops the event loop"""
+        if self._thread is None:
+            return
+        self._closing = True
+        for forward in list(self.forwards):
+            # Release connections held by suspended forwards
+            forward._available.set()
+        self._wakeup()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._handshake_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _call_soon(self, callback: typing.Callable, *args) -> None:
+        self._callbacks.append(lambda: callback(*args))
+        self._wakeup()
+
+    def _wakeup(self) -> None:
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            # The loop is already due to wake up, or has shut down
+            pass
+
+    def _drain_wakeup(self, events) -> None:
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _watch(self, fileobj, events, callback=None) -> None:
+        try:
+            key = self._selector.get_key(fileobj)
+        except KeyError:
+            key = None
+        if not events:
+            if key is not None:
+                self._selector.unregister(fileobj)
+        elif key is None:
+            self._selector.register(fileobj, events, callback)
+        elif key.events != events:
+            self._selector.modify(fileobj, events, callback)
+
+    def _run(self) -> None:
+        try:
+            while not self._closing:
+                timeout = self.retry_interval if self._stalled else None
+                for key, events in self._selector.select(timeout):
+                    key.data(events)
+                while self._callbacks:
+                    self._callbacks.popleft()()
+                for connection in list(self._stalled):
+                    connection.flush()
+        finally:
+            for connection in list(self._connections):
+                connection.close()
+            for forward in list(self.forwards):
+                self._remove_forward(forward)
+            self._selector.close()
+            self._wakeup_r.close()
+            self._wakeup_w.close()
+
+    def _add_forward(self, forward: Forward) -> None:
+        self.forwards.append(forward)
+        self._watch(forward.listener, selectors.EVENT_READ, lambda events: self._accept(forward))
+
+    def _remove_forward(self, forward: Forward) -> None:
+        if forward not in self.forwards:
+            return
+        self.forwards.remove(forward)
+        forward._available.set()
+        self._watch(forward.listener, 0)
+        forward.listener.close()
+        for connection in list(self._connections):
+            if connection.forward is forward:
+                connection.close()
+
+    def _accept(self, forward: Forward) -> None:
+        while True:
+            try:
+                sock, _ = forward.listener.accept()
+            except OSError:
+                return
+            if forward.handshake is None:
+                self.adopt(sock, forward)
+            else:
+                # Negotiating blocks on the client, so it never runs on the event loop
+                # nor in the pool that opens the channels of other forwards
+                self._handshake_pool.submit(self._negotiate, sock, forward)
+
+    def _negotiate(self, sock, forward) -> None:
+        sock.setblocking(True)
+        destination = forward.handshake.negotiate(sock)
+        if destination is None or self._closing:
+            sock.close()
+            return
+        self.adopt(sock, forward, destination)
+
+    def _open_channel(self, sock, forward, destination) -> None:
+        channel = stripe = None
+        while not self._closing and forward._available.wait(self.hold_timeout):
+            stripe = forward.pick()
+            transport = stripe.transport
+            try:
+                if isinstance(destination, str):
+                    channel = open_streamlocal_channel(
+                        transport,
+                        destination,
+                        window_size=self.window_size,
+                        max_packet_size=self.max_packet_size,
+                        timeout=self.open_timeout,
+                    )
+                else:
+                    channel = transport.open_channel(
+                        'direct-tcpip',
+                        destination,
+                        sock.getpeername()[:2],
+                        window_size=self.window_size,
+                        max_packet_size=self.max_packet_size,
+                        timeout=self.open_timeout,
+                    )
+            except (*_CHANNEL_ERRORS, AttributeError):
+                forward.release(stripe, failed=True)
+                stripe = None
+                if transport is not forward.transport and not transport.is_active():
+                    # An additional transport died. The next pick skips it.
+                    continue
+                if forward.on_open_failure is not None and forward.on_open_failure(transport):
+                    continue
+            break
+        if forward.handshake is not None and not self._closing:
+            try:
+                forward.handshake.reply(sock, channel is not None)
+            except OSError:
+                # The client gave up waiting, drop the connection
+                if channel is not None:
+                    forward.release(stripe)
+                    with contextlib.suppress(*_CHANNEL_ERRORS):
+                        channel.close()
+                channel = stripe = None
+        if self._closing:
+            if channel is not None:
+                forward.release(stripe)
+                with contextlib.suppress(*_CHANNEL_ERRORS):
+                    channel.close()
+            sock.close()
+            return
+        self._call_soon(self._add_connection, sock, forward, channel, stripe)
+
+    def _add_connection(self, sock, forward, channel, stripe) -> None:
+        if channel is None or self._closing or forward not in self.forwards:
+            forward.stats.active -= 1
+            if channel is None:
+                forward.stats.failed += 1
+            else:
+                forward.release(stripe)
+                with contextlib.suppress(*_CHANNEL_ERRORS):
+                    channel.close()
+            sock.close()
+            return
+        channel.settimeout(0.0)
+        connection = _Connection(self, forward, sock, channel, stripe)
+        self._connections.add(connection)
+        connection.update()
@@ -1,14 +1,29 @@
 from __future__ import annotations
 
+import codecs
+import collections
+import contextlib
+import errno
 import getpass
+import json
 import re
 import socket
+import time
 import typing
 import urllib.parse
+from collections.abc import Callable
 
 from .console import console
 
 
+def jupyter_url(port: int, token: str | None = None, path: str | None = None) -> str:
+    """Returns the URL of Jupyter Lab forwarded to local `port`"""
+    url = f'http://localhost:{port}'
+    if token:
+        url = f'{url}/?token={token}'
+    return f'{url}/lab/tree/{path}' if path else url
+
+
 def open_browser(
     port: int | None = None,
     token: str | None = None,
@@ -39,10 +54,7 @@ def open_browser(
     if not url:
         if port is None:
             raise ValueError('Please specify port number to use.')
-        url = f'http://localhost:{port}'
-        if token:
-            url = f'{url}/?token={token}'
-        url = f'{url}/lab/tree/{path}' if path else url
+        url = jupyter_url(port, token=token, path=path)
 
     console.rule('[bold green]Opening Jupyter Lab interface in a browser', characters='*')
     console.print(f'Jupyter Lab URL: {url}')
@@ -50,15 +62,207 @@ def open_browser(
     webbrowser.open(url, new=2)
 
 
+def wait_for_server(
+    port: int,
+    *,
+    host: str = 'localhost',
+    path: str = '/api',
+    timeout: float = 30.0,
+    initial_delay: float = 0.05,
+    max_delay: float = 1.0,
+) -> bool:
+    """Waits until a Jupyter server answers HTTP requests on the given port.
+
+    A successful TCP connection is not enough when the port is the local end of an
+    SSH tunnel, so an HTTP request is sent to Jupyter's (unauthenticated) `/api`
+    endpoint. Failed attempts are retried with exponential backoff.
+
+    Parameters
+    ----------
+    port : int
+        Local port to probe
+    host : str, optional
+        Host to connect to, by default 'localhost'
+    path : str, optional
+        Path to request, by default '/api'
+    timeout : float, optional
+        Overall deadline in seconds, by default 30
+    initial_delay : float, optional
+        Delay in seconds after the first failed attempt, by default 0.05
+    max_delay : float, optional
+        Upper bound of the delay between attempts in seconds, by default 1.0
+
+    Returns
+    -------
+    bool
+        True if the server answered before the deadline, False otherwise
+    """
+    import http.client
+
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        connection = http.client.HTTPConnection(host, port, timeout=min(remaining, 5.0))
+        try:
+            connection.request('GET', path)
+            if connection.getresponse().status < 500:
+                return True
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            connection.close()
+        time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        delay = min(delay * 2, max_delay)
+
+
 def is_port_available(port) -> bool:
-    socket_for_port_check = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    status = socket_for_port_check.connect_ex(('localhost', int(port)))
-    return status != 0
+    """Returns whether nothing listens on local `port`.
+
+    Another process may take the port right after this returns. Use `bind_port` or
+    `reserve_port` to keep the port.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        return sock.connect_ex(('localhost', int(port))) != 0
+
+
+# Local ports scanned by ``--port auto``
+DEFAULT_PORT_RANGE = (8888, 8987)
+
+
+def bind_port(port: int, bind_address: str = 'localhost') -> socket.socket | None:
+    """Listens on local `port`, or returns None if it is in use
+
+    Binding is a single system call, and the returned socket holds the port until it
+    is closed or passed to the forwarding engine, so no other process can take it in
+    the meantime.
+
+    Parameters
+    ----------
+    port : int
+        Local port to bind, or 0 for any free port
+    bind_address : str, optional
+        Local address to listen on, by default localhost
+
+    Returns
+    -------
+    socket.socket or None
+        The listening socket
+    """
+    try:
+        return socket.create_server((bind_address, int(port)), backlog=128)
+    except OSError as exc:
+        if exc.errno in (errno.EADDRINUSE, errno.EACCES):
+            return None
+        raise
+
+
+def reserve_port(
+    start: int = DEFAULT_PORT_RANGE[0],
+    end: int = DEFAULT_PORT_RANGE[1],
+    *,
+    exclude: typing.Container[int] = (),
+    bind_address: str = 'localhost',
+    fallback: bool = True,
+) -> socket.socket:
+    """Listens on the first free local port between `start` and `end` (inclusive)
+
+    Parameters
+    ----------
+    start : int, optional
+        First port to try, by default 8888
+    end : int, optional
+        Last port to try, by default 8987
+    exclude : container of int, optional
+        Ports that must not be used
+    bind_address : str, optional
+        Local address to listen on, by default localhost
+    fallback : bool, optional
+        Whether to let the operating system pick a free port if the whole range is in
+        use, by default True
+
+    Returns
+    -------
+    socket.socket
+        The listening socket, see `bind_port`
+
+    Raises
+    ------
+    RuntimeError
+        If no port is available in the range and `fallback` is False
+    """
+    for port in range(int(start), int(end) + 1):
+        if port not in exclude and (sock := bind_port(port, bind_address)) is not None:
+            return sock
+    if fallback:
+        return bind_port(0, bind_address)
+    raise RuntimeError(f'No available local port in range {start}-{end}')
+
+
+def find_available_port(
+    start: int, exclude: typing.Container[int] = (), attempts: int = 100
+) -> int:
+    """Returns the first available local port at or above `start`
+
+    The port is released before returning. Prefer `reserve_port` to keep it.
+
+    Parameters
+    ----------
+    start : int
+        First port to try
+    exclude : container of int, optional
+        Ports that must not be returned, e.g. ones already handed out
+    attempts : int, optional
+        Maximum number of ports to try, by default 100
+
+    Raises
+    ------
+    RuntimeError
+        If no port is available in the scanned range
+    """
+    end = int(start) + attempts - 1
+    with reserve_port(start, end, exclude=exclude, fallback=False) as sock:
+        return sock.getsockname()[1]
+
+
+# `http+unix` URLs are printed by servers listening on a Unix socket (``--sock``)
+_URL_PATTERN = re.compile(
+    r'http(?:s|\+unix)?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+)
+
+
+def _match_server_url(text: str) -> dict[str, typing.Any] | None:
+    for match in _URL_PATTERN.finditer(text):
+        url = match.group().strip()
+        result = urllib.parse.urlparse(url)
+        if result.scheme == 'http+unix':
+            # The netloc is the percent-encoded socket path
+            params = urllib.parse.parse_qs(result.query)
+            return {
+                'hostname': None,
+                'port': None,
+                'token': params.get('token', [None])[0],
+                'url': url,
+                'sock': urllib.parse.unquote(result.netloc),
+            }
+        if result.hostname != '127.0.0.1' and result.port:
+            params = urllib.parse.parse_qs(result.query)
+            return {
+                'hostname': result.hostname,
+                'port': result.port,
+                'token': params.get('token', [None])[0],
+                'url': url,
+            }
+    return None
 
 
 def parse_stdout(stdout: str) -> dict[str, typing.Any | None]:
     """Parses stdout to determine remote_hostname, port, token, url
 
+    URLs are considered in the order in which they appear.
+
     Parameters
     ----------
     stdout : str
@@ -67,27 +271,341 @@ def parse_stdout(stdout: str) -> dict[str, typing.Any | None]:
     Returns
     -------
     dict
-        A dictionary containing hotname, port, token, and url
-    """
-
-    hostname, port, token, url = None, None, None, None
-    urls = set(
-        re.findall(
-            r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',
-            stdout,
-        )
-    )
-    for url in urls:
-        url = url.strip()
-        result = urllib.parse.urlparse(url)
-        if result.hostname != '127.0.0.1' and result.port:
-            hostname = result.hostname
-            port = result.port
+        A dictionary containing hotname, port, token, and url, and the socket path
+        (sock) if the server listens on a Unix socket
+    """
 
-            params = urllib.parse.parse_qs(result.query)
-            token = params.get('token', [None])[0]
-            break
-    return {'hostname': hostname, 'port': port, 'token': token, 'url': url}
+    return _match_server_url(stdout) or {'hostname': None, 'port': None, 'token': None, 'url': None}
+
+
+def parse_runtime_file(stdout: str) -> dict[str, typing.Any] | None:
+    """Parses the contents of a Jupyter server runtime file (``jpserver-<pid>.json``)
+
+    Parameters
+    ----------
+    stdout : str
+        Contents of the runtime file
+
+    Returns
+    -------
+    dict or None
+        A dictionary containing hostname, port, token, url, base_url, the pid of the
+        server and the path of its Unix socket (sock) if it listens on one, or None if
+        `stdout` does not hold a runtime file
+    """
+    start = stdout.find('{')
+    if start == -1:
+        return None
+    try:
+        info, _ = json.JSONDecoder().raw_decode(stdout[start:])
+    except ValueError:
+        return None
+    if not isinstance(info, dict) or not {'hostname', 'port', 'url'} <= info.keys():
+        return None
+    token = info.get('token') or None
+    url = info['url']
+    return {
+        'hostname': info['hostname'],
+        'port': int(info['port']),
+        'token': token,
+        'url': f'{url}?token={token}' if token else url,
+        'base_url': info.get('base_url', '/'),
+        'pid': info.get('pid'),
+        'sock': info.get('sock') or None,
+    }
+
+
+PROBE_PREFIX = 'JUPYTER_FORWARD_PROBE'
+
+
+def parse_probe_output(stdout: str) -> dict[str, str]:
+    """Parses the key=value facts printed by the remote probe script
+
+    Parameters
+    ----------
+    stdout : str
+        Output of the probe script. Lines that do not start with the probe prefix
+        (e.g. login banners) are ignored.
+
+    Returns
+    -------
+    dict
+        A dictionary mapping fact names to their values
+    """
+    facts = {}
+    for line in stdout.splitlines():
+        line = line.strip()
+        if not line.startswith(f'{PROBE_PREFIX} '):
+            continue
+        key, sep, value = line[len(PROBE_PREFIX) + 1 :].partition('=')
+        if sep:
+            facts[key] = value
+    return facts
+
+
+_ENV_LINE = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)=(.*)$')
+_VOLATILE_ENV_VARS = {'_', 'SHLVL', 'PWD', 'OLDPWD', 'PS1', 'PS2', 'SSH_TTY'}
+
+
+def parse_env_output(stdout: str) -> dict[str, str]:
+    """Parses the output of `env` into a dictionary of environment variables
+
+    Variables whose values span multiple lines, as well as per-process variables such
+    as ``SHLVL`` and ``PWD``, are dropped since they cannot be safely re-applied to
+    another shell.
+
+    Parameters
+    ----------
+    stdout : str
+        Output of the `env` command
+
+    Returns
+    -------
+    dict
+        A dictionary mapping variable names to their values
+    """
+    environment, multiline = {}, set()
+    name = None
+    for line in stdout.splitlines():
+        if match := _ENV_LINE.match(line):
+            name, value = match.groups()
+            environment[name] = value.rstrip('\r')
+        elif name is not None:
+            multiline.add(name)
+    return {
+        key: value
+        for key, value in environment.items()
+        if key not in multiline and key not in _VOLATILE_ENV_VARS
+    }
+
+
+def parse_session_registry(stdout: str) -> list[dict[str, typing.Any]]:
+    """Parses the concatenated entries of the remote session registry
+
+    Parameters
+    ----------
+    stdout : str
+        Contents of the registry files, one JSON object per line
+
+    Returns
+    -------
+    list of dict
+        Valid entries, most recently created first
+    """
+    required = {'session_id', 'created', 'hostname', 'port', 'token', 'url', 'log_file'}
+    entries = []
+    for line in stdout.splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, dict) and required <= entry.keys():
+            entries.append(entry)
+    return sorted(entries, key=lambda entry: entry['created'], reverse=True)
+
+
+# Appended to the log by the launch command once Jupyter Lab (or its activation) exits
+EXIT_MARKER = 'JUPYTER_FORWARD_EXITED'
+
+
+class JupyterLogParser:
+    """Incrementally parses Jupyter's log output as it is streamed from the remote host.
+
+    Chunks of the log are fed to the parser as they arrive. Only the lines following
+    the "is running at:" banner are searched for the server URL, so earlier output
+    (e.g. URLs printed by extensions) is never mistaken for the server address.
+    Parsing stops at `EXIT_MARKER`, which means the server exited before it was ready.
+    """
+
+    marker = 'is running at:'
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._partial = ''
+        self._seen_marker = False
+        self.result: dict[str, typing.Any | None] | None = None
+        self.exited = False
+
+    @property
+    def ready(self) -> bool:
+        return self.result is not None
+
+    def feed(self, chunk: bytes | str) -> bool:
+        """Feeds a chunk of log output to the parser.
+
+        Parameters
+        ----------
+        chunk : bytes or str
+            The next piece of the log file
+
+        Returns
+        -------
+        bool
+            True once the server URL has been found or the server has exited
+        """
+        if self.ready or self.exited:
+            return True
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        *lines, self._partial = (self._partial + chunk).split('\n')
+        for line in lines:
+            if line.strip() == EXIT_MARKER:
+                self.exited = True
+                break
+            if not self._seen_marker:
+                self._seen_marker = self.marker in line
+            # Only complete lines following the banner are searched, each exactly once
+            if self._seen_marker and (result := _match_server_url(line)):
+                self.result = result
+                break
+        return self.ready or self.exited
+
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+_LOG_LEVEL_PREFIX = re.compile(r'^\[([DIWEC]) ')
+
+
+class LogFollower:
+    """Writes streamed log output to the console while keeping a bounded history.
+
+    Only the last `max_lines` lines are retained (e.g. for error reporting), so memory
+    use stays flat no matter how long the session runs.
+
+    Parameters
+    ----------
+    max_lines : int, optional
+        Number of recent lines to keep, by default 100
+    level : str, optional
+        Minimum Jupyter log level (e.g. 'WARNING') of the lines written to the console.
+        Lines without a level prefix (e.g. tracebacks) inherit the level of the
+        preceding line. By default all lines are written.
+    write : callable, optional
+        Called with each line to display, by default writes to the console
+    max_line_length : int, optional
+        Lines longer than this are split, by default 65536 characters
+    """
+
+    def __init__(
+        self,
+        max_lines: int = 100,
+        level: str | None = None,
+        write: Callable[[str], typing.Any] | None = None,
+        max_line_length: int = 65536,
+    ):
+        if level is not None and level.upper() not in LOG_LEVELS:
+            raise ValueError(f'Unknown log level {level!r}. Choose from {", ".join(LOG_LEVELS)}')
+        self.lines: collections.deque[str] = collections.deque(maxlen=max_lines)
+        self.level = LOG_LEVELS[level.upper()] if level else 0
+        self.write = write or (lambda line: console.out(line, highlight=False))
+        self.max_line_length = max_line_length
+        self.bytes_received = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._partial = ''
+        self._current_level = LOG_LEVELS['INFO']
+        self._quiet = False
+
+    @staticmethod
+    def _line_level(line: str, default: int) -> int:
+        if match := _LOG_LEVEL_PREFIX.match(line):
+            return next(value for name, value in LOG_LEVELS.items() if name[0] == match.group(1))
+        return default
+
+    def _emit(self, line: str) -> None:
+        line = line.rstrip('\r')
+        self.lines.append(line)
+        self._current_level = self._line_level(line, self._current_level)
+        if self._current_level >= self.level and not self._quiet:
+            self.write(line)
+
+    @contextlib.contextmanager
+    def quiet(self) -> typing.Iterator[LogFollower]:
+        """Keeps the lines fed within the block without writing them"""
+        self._quiet = True
+        try:
+            yield self
+        finally:
+            self._quiet = False
+
+    def replay(self, count: int = 10) -> None:
+        """Writes the last `count` kept lines, e.g. after they were fed quietly"""
+        lines = list(self.lines)
+        level = LOG_LEVELS['INFO']
+        for index, line in enumerate(lines):
+            level = self._line_level(line, level)
+            if index >= len(lines) - count and level >= self.level:
+                self.write(line)
+
+    def feed(self, chunk: bytes | str) -> bool:
+        """Handles a chunk of log output. Always returns False to keep following."""
+        if isinstance(chunk, bytes):
+            self.bytes_received += len(chunk)
+            chunk = self._decoder.decode(chunk)
+        *lines, self._partial = (self._partial + chunk).split('\n')
+        for line in lines:
+            self._emit(line)
+        while len(self._partial) > self.max_line_length:
+            self._emit(self._partial[: self.max_line_length])
+            self._partial = self._partial[self.max_line_length :]
+        return False
+
+
+def stream_channel(
+    channel,
+    on_data: Callable[[bytes], bool],
+    *,
+    timeout: float | None = None,
+    poll_interval: float = 0.1,
+    max_poll_interval: float = 2.0,
+) -> bool:
+    """Feeds the output of a long-lived paramiko channel to `on_data`.
+
+    Reads block until data arrives, so output is handled as soon as it is available.
+    While the channel stays silent, the wake-up interval used to check the deadline
+    backs off exponentially from `poll_interval` to `max_poll_interval`.
+
+    Parameters
+    ----------
+    channel : paramiko.Channel
+        Channel whose stdout is consumed
+    on_data : callable
+        Called with each chunk of output. Returning True stops streaming.
+    timeout : float, optional
+        Overall deadline in seconds, by default None (wait forever)
+    poll_interval : float, optional
+        Initial wake-up interval in seconds when no output arrives, by default 0.1
+    max_poll_interval : float, optional
+        Upper bound of the wake-up interval in seconds, by default 2.0
+
+    Returns
+    -------
+    bool
+        True if `on_data` asked to stop, False if the channel was closed first
+
+    Raises
+    ------
+    TimeoutError
+        If the deadline expires before `on_data` asks to stop
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    interval = poll_interval
+    while True:
+        wait = interval
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'No matching output received within {timeout} seconds')
+            wait = min(wait, remaining)
+        channel.settimeout(wait)
+        try:
+            data = channel.recv(65536)
+        except TimeoutError:
+            interval = min(interval * 2, max_poll_interval)
+            continue
+        if not data:
+            return False
+        interval = poll_interval
+        if on_data(data):
+            return True
 
 
 def _authentication_handler(title, instructions, prompt_list):
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import dataclasses
+import shlex
+import threading
+import typing
+
+
+def categorize(command: str) -> str:
+    """Returns a short category for a shell command, e.g. ``mkdir`` for ``mkdir -p ~/logs``
+
+    Leading variable assignments and ``env``/``nohup`` wrappers are skipped.
+    """
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        words = command.split()
+    for word in words:
+        if word in ('env', 'nohup') or ('=' in word and not word.startswith('-')):
+            continue
+        return word.rsplit('/', 1)[-1]
+    return words[0] if words else 'unknown'
+
+
+@dataclasses.dataclass
+class CommandRecord:
+    """A single remote round trip.
+
+    Parameters
+    ----------
+    category : str
+        Short description of the command, e.g. ``which`` or ``probe``
+    kind : str
+        How the command was run: ``run`` (``session.run``), ``channel`` (a raw SSH
+        channel), ``put`` (file upload), ``tcpip`` (a connection to a remote port),
+        ``streamlocal`` (a connection to a remote Unix socket) or ``agent`` (a request
+        to the remote helper agent, which does not open a channel)
+    duration : float
+        Wall time in seconds
+    exit_status : int, optional
+        Exit status, None if the command was started asynchronously or streamed
+    bytes_sent : int
+        Bytes sent to the remote host (command line and stdin)
+    stdout_bytes : int
+        Size of the standard output
+    stderr_bytes : int
+        Size of the standard error
+    """
+
+    category: str
+    kind: str
+    duration: float
+    exit_status: int | None = None
+    bytes_sent: int = 0
+    stdout_bytes: int = 0
+    stderr_bytes: int = 0
+
+    def describe(self) -> str:
+        status = 'running' if self.exit_status is None else f'exit {self.exit_status}'
+        return (
+            f'{self.category} ({self.kind}): {self.duration:.3f} s, {status}, '
+            f'{self.bytes_sent} B sent, {self.stdout_bytes} B stdout, {self.stderr_bytes} B stderr'
+        )
+
+
+@dataclasses.dataclass
+class CommandMetrics:
+    """Accounting of the remote round trips made by a runner"""
+
+    records: list[CommandRecord] = dataclasses.field(default_factory=list)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def add(self, record: CommandRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    @property
+    def round_trips(self) -> int:
+        """Number of remote commands, each of which costs at least one round trip"""
+        return len(self.records)
+
+    @property
+    def failures(self) -> int:
+        return sum(1 for record in self.records if record.exit_status not in (None, 0))
+
+    def summary(self) -> dict[str, dict[str, typing.Any]]:
+        """Returns the number of calls, wall time and traffic per category"""
+        summary = {}
+        for record in self.records:
+            entry = summary.setdefault(
+                record.category,
+                {'calls': 0, 'duration': 0.0, 'bytes_sent': 0, 'bytes_received': 0, 'failures': 0},
+            )
+            entry['calls'] += 1
+            entry['duration'] += record.duration
+            entry['bytes_sent'] += record.bytes_sent
+            entry['bytes_received'] += record.stdout_bytes + record.stderr_bytes
+            entry['failures'] += record.exit_status not in (None, 0)
+        return summary
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        return {
+            'round_trips': self.round_trips,
+            'failures': self.failures,
+            'records': [dataclasses.asdict(record) for record in self.records],
+        }
+
+    def render(self):
+        """Returns a table summarizing the remote commands per category"""
+        from rich.filesize import decimal
+        from rich.table import Table
+
+        table = Table(title=f'Remote commands ({self.round_trips} round trips)')
+        table.add_column('Category')
+        table.add_column('Calls', justify='right')
+        table.add_column('Failed', justify='right')
+        table.add_column('Time (s)', justify='right')
+        table.add_column('Sent', justify='right')
+        table.add_column('Received', justify='right')
+        for category, entry in self.summary().items():
+            table.add_row(
+                category,
+                str(entry['calls']),
+                str(entry['failures']),
+                f'{entry["duration"]:.3f}',
+                decimal(entry['bytes_sent']),
+                decimal(entry['bytes_received']),
+            )
+        return table
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import concurrent.futures
+import dataclasses
+import socket
+import threading
+import time
+import typing
+
+from .console import console
+from .core import RemoteRunner
+from .helpers import DEFAULT_PORT_RANGE, _authentication_handler, reserve_port
+
+
+@dataclasses.dataclass
+class _Session:
+    host: str
+    port: int
+    listener: socket.socket | None = dataclasses.field(default=None, repr=False)
+    runner: RemoteRunner | None = None
+    future: concurrent.futures.Future | None = None
+    error: str | None = None
+
+    @property
+    def status(self) -> str:
+        if self.error:
+            return f'failed: {self.error}'
+        if self.runner is None:
+            return 'authenticating'
+        return self.runner.status
+
+    @property
+    def done(self) -> bool:
+        if self.error:
+            return True
+        if self.runner is not None and self.runner._ready.is_set():
+            return True
+        return self.future is not None and self.future.done()
+
+
+@dataclasses.dataclass
+class MultiRunner:
+    """Launches Jupyter Lab on several remote hosts concurrently.
+
+    Every host gets its own `RemoteRunner` and local port. Authentication, probing and
+    launching run in a thread pool, so the total wall time is close to that of the
+    slowest host. Interactive authentication prompts are serialized.
+
+    Parameters
+    ----------
+    hosts : list of str
+        Remote hosts to launch Jupyter Lab on
+    port : int or str, optional
+        First local port to use. Subsequent hosts get the next available ports. With
+        'auto', ports are taken from the ``port_range`` runner argument.
+    max_workers : int, optional
+        Maximum number of hosts handled at once, by default all of them
+    runner_kwargs : dict, optional
+        Extra keyword arguments passed to every `RemoteRunner`
+    """
+
+    hosts: list[str]
+    port: int | str = 8888
+    max_workers: int | None = None
+    runner_kwargs: dict[str, typing.Any] = dataclasses.field(default_factory=dict)
+
+    def __post_init__(self):
+        if len(set(self.hosts)) != len(self.hosts):
+            raise ValueError('Each host may only be specified once')
+        self._prompt_lock = threading.Lock()
+        self.sessions: list[_Session] = []
+        port_forwarding = self.runner_kwargs.get('port_forwarding', True)
+        if self.port == 'auto':
+            start, end = self.runner_kwargs.get('port_range', DEFAULT_PORT_RANGE)
+        else:
+            start, end = int(self.port), int(self.port) + 99
+        for host in self.hosts:
+            if not port_forwarding:
+                self.sessions.append(_Session(host=host, port=self.port))
+                continue
+            # Ports stay bound until each runner forwards them, so hosts never share one
+            listener = reserve_port(start, end)
+            port = listener.getsockname()[1]
+            self.sessions.append(_Session(host=host, port=port, listener=listener))
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers or len(self.hosts),
+            thread_name_prefix='jupyter-forward',
+        )
+
+    def _serialized(self, host: str, handler: typing.Callable) -> typing.Callable:
+        def wrapper(*args, **kwargs):
+            with self._prompt_lock:
+                console.print(f'[bold cyan]Authenticating to {host}')
+                return handler(*args, **kwargs)
+
+        return wrapper
+
+    def _connect(self, session: _Session) -> None:
+        kwargs = dict(self.runner_kwargs)
+        kwargs['auth_handler'] = self._serialized(
+            session.host, kwargs.get('auth_handler', _authentication_handler)
+        )
+        if 'fallback_auth_handler' in kwargs:
+            kwargs['fallback_auth_handler'] = self._serialized(
+                session.host, kwargs['fallback_auth_handler']
+            )
+        kwargs.update(show_progress=False, follow_logs=False)
+        try:
+            session.runner = RemoteRunner(
+                session.host, port=session.port, listener=session.listener, **kwargs
+            )
+        except (Exception, SystemExit) as exc:
+            if session.listener is not None:
+                session.listener.close()
+            session.error = str(exc) or 'could not connect'
+
+    def _run(self, session: _Session) -> None:
+        try:
+            session.runner.start()
+        except SystemExit:
+            pass
+        if not session.runner._ready.is_set() and session.runner.status.startswith('failed'):
+            session.error = session.runner.status.removeprefix('failed: ')
+        elif not session.runner._ready.is_set():
+            session.error = 'terminated'
+
+    def render(self):
+        """Returns a table summarizing the state of every session"""
+        from rich.table import Table
+
+        table = Table(title='Jupyter Forward sessions')
+        table.add_column('Host')
+        table.add_column('Local port', justify='right')
+        table.add_column('Status')
+        table.add_column('URL')
+        for session in self.sessions:
+            url = ''
+            if session.runner is not None and session.runner._ready.is_set():
+                result = session.runner.parsed_result
+                if session.runner.port_forwarding:
+                    url = f'http://localhost:{session.port}/?token={result["token"]}'
+                else:
+                    url = result['url']
+            status = session.status
+            forward = session.runner.forward if session.runner is not None else None
+            if forward is not None and len(forward.stripes) > 1:
+                # Open connections on each transport, e.g. "3/2/2/3"
+                load = '/'.join(str(stripe.stats.active) for stripe in forward.stripes)
+                status = f'{status} ({len(forward.stripes)} transports: {load})'
+            style = 'red' if session.error else 'green' if url else 'yellow'
+            table.add_row(session.host, str(session.port), f'[{style}]{status}', url or '-')
+        return table
+
+    def launch(self) -> list[_Session]:
+        """Connects to all hosts and launches Jupyter Lab on them.
+
+        Returns once every session is either ready or has failed.
+        """
+        from rich.live import Live
+
+        console.rule(f'[bold green]Connecting to {len(self.sessions)} hosts', characters='*')
+        # Authentication may prompt for passwords, which must not be drawn over by the
+        # live status table, so it happens before the table is shown.
+        concurrent.futures.wait(
+            [self._pool.submit(self._connect, session) for session in self.sessions]
+        )
+        for session in self.sessions:
+            if session.runner is not None:
+                session.future = self._pool.submit(self._run, session)
+        with Live(self.render(), console=console, refresh_per_second=4) as live:
+            while not all(session.done for session in self.sessions):
+                time.sleep(0.25)
+                live.update(self.render())
+            live.update(self.render())
+        return self.sessions
+
+    def stop(self) -> None:
+        """Stops all sessions and waits for their threads to finish"""
+        for session in self.sessions:
+            if session.runner is not None:
+                session.runner.stop()
+        self._pool.shutdown(wait=True)
+
+    def start(self) -> None:
+        """Launches all sessions and keeps them alive until interrupted (Ctrl-C)"""
+        try:
+            self.launch()
+            if not any(
+                session.runner is not None and session.runner._ready.is_set()
+                for session in self.sessions
+            ):
+                return
+            console.print('[bold cyan]Press Ctrl-C to stop all sessions')
+            while any(
+                session.future is not None and not session.future.done()
+                for session in self.sessions
+            ):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            console.print(self.render())
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import datetime
+import functools
+import json
+import os
+import pathlib
+import threading
+import time
+import typing
+
+PROFILE_FORMATS = ('json', 'chrome')
+
+
+@dataclasses.dataclass
+class Span:
+    """A timed phase of a launch.
+
+    Times are in seconds since the profiler was created. Remote commands and bytes are
+    attributed to the innermost span that is open when they happen.
+    """
+
+    name: str
+    start: float
+    end: float | None = None
+    depth: int = 0
+    thread_id: int = 0
+    thread_name: str = ''
+    commands: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else self.start) - self.start
+
+
+@dataclasses.dataclass
+class Profiler:
+    """Records how long each phase of a launch takes and how much remote work it does.
+
+    Parameters
+    ----------
+    name : str, optional
+        Label of the profiled process in exports, e.g. the remote host
+    """
+
+    name: str = 'jupyter-forward'
+
+    def __post_init__(self):
+        self.spans: list[Span] = []
+        self.started = datetime.datetime.now()
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> list[Span]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def now(self) -> float:
+        """Returns the number of seconds since the profiler was created"""
+        return time.perf_counter() - self._origin
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> typing.Iterator[Span]:
+        """Times the enclosed block as a phase called `name`"""
+        stack = self._stack()
+        thread = threading.current_thread()
+        span = Span(
+            name=name,
+            start=self.now(),
+            depth=len(stack),
+            thread_id=thread.ident,
+            thread_name=thread.name,
+        )
+        with self._lock:
+            self.spans.append(span)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span.end = self.now()
+
+    def count(self, commands: int = 1, bytes_sent: int = 0, bytes_received: int = 0) -> None:
+        """Attributes remote commands and transferred bytes to the current phase"""
+        if stack := self._stack():
+            span = stack[-1]
+            span.commands += commands
+            span.bytes_sent += bytes_sent
+            span.bytes_received += bytes_received
+
+    @property
+    def total(self) -> float:
+        """Seconds from the start of the first to the end of the last top-level phase"""
+        spans = [span for span in self.spans if span.depth == 0 and span.end is not None]
+        if not spans:
+            return 0.0
+        return max(span.end for span in spans) - min(span.start for span in spans)
+
+    def render(self):
+        """Returns a table summarizing the time and remote work of every phase"""
+        from rich.filesize import decimal
+        from rich.table import Table
+
+        table = Table(title=f'Launch profile of {self.name}')
+        table.add_column('Phase')
+        table.add_column('Time (s)', justify='right')
+        table.add_column('Share', justify='right')
+        table.add_column('Commands', justify='right')
+        table.add_column('Sent', justify='right')
+        table.add_column('Received', justify='right')
+        total = self.total
+        for span in self.spans:
+            if span.end is None:
+                continue
+            share = f'{span.duration / total:.0%}' if total else '-'
+            table.add_row(
+                f'{"  " * span.depth}{span.name}',
+                f'{span.duration:.3f}',
+                share,
+                str(span.commands),
+                decimal(span.bytes_sent),
+                decimal(span.bytes_received),
+            )
+        table.add_section()
+        table.add_row(
+            'Total',
+            f'{total:.3f}',
+            '',
+            str(sum(span.commands for span in self.spans)),
+            decimal(sum(span.bytes_sent for span in self.spans)),
+            decimal(sum(span.bytes_received for span in self.spans)),
+        )
+        return table
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        """Returns the recorded phases as a JSON-serializable dictionary"""
+        return {
+            'name': self.name,
+            'started': self.started.isoformat(timespec='milliseconds'),
+            'total': self.total,
+            'spans': [
+                {**dataclasses.asdict(span), 'duration': span.duration} for span in self.spans
+            ],
+        }
+
+    def to_chrome_trace(self) -> dict[str, typing.Any]:
+        """Returns the recorded phases in the Chrome trace event format.
+
+        The result can be loaded in chrome://tracing or https://ui.perfetto.dev.
+        """
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': self.name}}]
+        threads = {}
+        for span in self.spans:
+            threads.setdefault(span.thread_id, span.thread_name)
+            events.append(
+                {
+                    'name': span.name,
+                    'cat': 'phase',
+                    'ph': 'X',
+                    'ts': span.start * 1e6,
+                    'dur': span.duration * 1e6,
+                    'pid': pid,
+                    'tid': span.thread_id,
+                    'args': {
+                        'commands': span.commands,
+                        'bytes_sent': span.bytes_sent,
+                        'bytes_received': span.bytes_received,
+                    },
+                }
+            )
+        for tid, thread_name in threads.items():
+            events.append(
+                {
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': pid,
+                    'tid': tid,
+                    'args': {'name': thread_name},
+                }
+            )
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path: str | os.PathLike, format: str = 'json') -> None:
+        """Writes the recorded phases to `path` as plain JSON or as a Chrome trace"""
+        if format not in PROFILE_FORMATS:
+            raise ValueError(f'`format` must be one of {PROFILE_FORMATS}, got {format!r}')
+        data = self.to_chrome_trace() if format == 'chrome' else self.to_dict()
+        pathlib.Path(path).write_text(json.dumps(data, indent=2))
+
+
+def phase(name: str) -> typing.Callable:
+    """Decorates a method so that each call is recorded as a phase by ``self.profiler``"""
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.span(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,520 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import dataclasses
+import hashlib
+import http.client
+import http.server
+import json
+import os
+import pathlib
+import re
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import typing
+import urllib.parse
+
+from .cache import default_cache_dir
+
+# Paths below the server's base_url that serve static assets. Only the assets whose URL
+# carries a content hash are cached (see `has_content_hash`): JupyterLab and extensions can
+# be upgraded without changing the server version, and the URL of an unhashed asset, such
+# as a theme stylesheet, stays the same when its content changes.
+CACHEABLE_PREFIXES = ('static/', 'lab/extensions/', 'lab/api/themes/')
+
+# A content hash in the file name, e.g. ``1036.0d1f109c3d842497fd51.js``
+_HASHED_NAME = re.compile(r'[.-][0-9a-f]{8,}\.[0-9a-z]+$')
+
+# Headers that only apply to a single connection and must not be relayed (RFC 9110)
+_HOP_BY_HOP_HEADERS = frozenset(
+    {
+        'connection',
+        'keep-alive',
+        'proxy-authenticate',
+        'proxy-authorization',
+        'proxy-connection',
+        'te',
+        'trailer',
+        'transfer-encoding',
+        'upgrade',
+    }
+)
+
+# Response headers kept with a cached asset
+_STORED_HEADERS = frozenset(
+    {'content-type', 'content-encoding', 'cache-control', 'etag', 'last-modified', 'vary'}
+)
+
+# Requests that can safely be sent again when a kept-alive upstream connection went away
+_IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+_BUFFER_SIZE = 2**16
+
+
+def has_content_hash(path: str) -> bool:
+    """Returns True if the URL changes with the content of the asset it points to.
+
+    Webpack bundles have a hash in their file name, and static files served by the
+    Jupyter server carry a ``v`` query argument computed from their content.
+    """
+    path, _, query = path.partition('?')
+    if any(name == 'v' and value for name, value in urllib.parse.parse_qsl(query)):
+        return True
+    return _HASHED_NAME.search(path.rsplit('/', 1)[-1]) is not None
+
+
+def _end_to_end(headers: typing.Iterable[tuple[str, str]]) -> list[tuple[str, str]]:
+    """Drops hop-by-hop headers, including those named in the Connection header"""
+    headers = list(headers)
+    listed = {
+        token.strip().lower()
+        for name, value in headers
+        if name.lower() == 'connection'
+        for token in value.split(',')
+    }
+    return [
+        (name, value)
+        for name, value in headers
+        if name.lower() not in _HOP_BY_HOP_HEADERS and name.lower() not in listed
+    ]
+
+
+@dataclasses.dataclass
+class CachedResponse:
+    """A response stored by `AssetCache`"""
+
+    status: int
+    headers: list[tuple[str, str]]
+    body: bytes
+
+
+@dataclasses.dataclass
+class AssetCache:
+    """Size-bounded cache of HTTP responses on local disk.
+
+    Every response is stored in its own file named after its key. The least recently
+    used responses are evicted once the files take more than `max_size` bytes. Since
+    files are replaced atomically, several jupyter-forward processes can share the
+    directory, each bounding the entries it knows about.
+
+    Parameters
+    ----------
+    directory : pathlib.Path, optional
+        Directory holding the responses, by default ``~/.cache/jupyter-forward/assets``
+    max_size : int, optional
+        Upper bound of the total size of the cache in bytes, by default 256 MiB
+    max_entry_size : int, optional
+        Responses with larger bodies are not cached, by default 32 MiB
+    """
+
+    directory: pathlib.Path | None = None
+    max_size: int = 256 * 2**20
+    max_entry_size: int = 32 * 2**20
+
+    def __post_init__(self):
+        if self.directory is None:
+            self.directory = default_cache_dir() / 'assets'
+        self.directory = pathlib.Path(self.directory)
+        self.size = 0
+        self._lock = threading.Lock()
+        # Keys in order of use, least recently used first, mapped to their file size
+        self._entries: collections.OrderedDict[str, int] = collections.OrderedDict()
+        with contextlib.suppress(OSError):
+            files = [(path, path.stat()) for path in self.directory.iterdir() if path.is_file()]
+            for path, stat in sorted(files, key=lambda item: item[1].st_mtime):
+                if not path.name.startswith('.'):
+                    self._entries[path.name] = stat.st_size
+                    self.size += stat.st_size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """Returns the cache key of a response identified by `parts`"""
+        return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> CachedResponse | None:
+        """Returns the response stored under `key`, or None"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self.directory / key
+        try:
+            with path.open('rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+            # The modification time records the last use for the next process
+            os.utime(path)
+        except (OSError, ValueError):
+            self._discard(key)
+            return None
+        return CachedResponse(meta['status'], [tuple(item) for item in meta['headers']], body)
+
+    def put(self, key: str, response: CachedResponse) -> bool:
+        """Stores `response` under `key`. Returns False if it is too large to be cached."""
+        if len(response.body) > self.max_entry_size:
+            return False
+        meta = json.dumps({'status': response.status, 'headers': response.headers})
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.asset-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(f'{meta}\n'.encode())
+                f.write(response.body)
+                size = f.tell()
+            os.replace(tmp_path, self.directory / key)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self.size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            while self.size > self.max_size and len(self._entries) > 1:
+                evicted, evicted_size = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                with contextlib.suppress(OSError):
+                    (self.directory / evicted).unlink()
+        return True
+
+    def _discard(self, key):
+        with self._lock:
+            self.size -= self._entries.pop(key, 0)
+        with contextlib.suppress(OSError):
+            (self.directory / key).unlink()
+
+
+@dataclasses.dataclass
+class ProxyStats:
+    """Counters of a caching proxy.
+
+    Parameters
+    ----------
+    requests : int
+        Number of requests received, including websocket upgrades
+    hits : int
+        Number of requests answered from the cache
+    misses : int
+        Number of cacheable requests that had to be fetched through the tunnel
+    bytes_from_cache : int
+        Body bytes answered from the cache
+    """
+
+    requests: int = 0
+    hits: int = 0
+    misses: int = 0
+    bytes_from_cache: int = 0
+
+    def describe(self) -> str:
+        return (
+            f'{self.requests} requests, {self.hits} cache hits, {self.misses} cache misses, '
+            f'{self.bytes_from_cache / 2**20:.1f} MiB served from the cache'
+        )
+
+
+@dataclasses.dataclass
+class CachingProxy:
+    """Local HTTP proxy in front of a forwarded Jupyter Lab port.
+
+    Static assets below `CACHEABLE_PREFIXES` whose URL carries a content hash are
+    answered from `cache` once they were fetched, so a new browser tab does not pull
+    megabytes of JavaScript through the SSH tunnel again. Cache keys also include the
+    Jupyter server version, which is read from the ``api`` endpoint. Every other
+    request, including websockets, is relayed as is.
+
+    Parameters
+    ----------
+    upstream_port : int
+        Local port forwarded to Jupyter Lab
+    port : int, optional
+        Local port to listen on, by default any free port
+    base_url : str, optional
+        Base URL of the Jupyter server, by default '/'
+    cache : AssetCache, optional
+        Where responses are stored, by default in the user's cache directory
+    bind_address : str, optional
+        Local address to listen on, by default localhost
+    timeout : float, optional
+        Seconds to wait for the upstream server, by default 300
+    listener : socket.socket, optional
+        Already bound listening socket to use instead of `port` and `bind_address`
+    """
+
+    upstream_port: int
+    port: int = 0
+    base_url: str = '/'
+    cache: AssetCache = dataclasses.field(default_factory=AssetCache)
+    bind_address: str = 'localhost'
+    timeout: float = 300.0
+    listener: socket.socket | None = dataclasses.field(default=None, repr=False)
+
+    def __post_init__(self):
+        self.stats = ProxyStats()
+        self._version = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def local_port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        """Starts listening and serving in a background thread"""
+        if self.listener is None:
+            self._server = _ProxyServer((self.bind_address, self.port), _ProxyHandler)
+        else:
+            self._server = _ProxyServer(
+                self.listener.getsockname()[:2], _ProxyHandler, bind_and_activate=False
+            )
+            self._server.socket.close()
+            self.listener.setblocking(True)
+            self._server.socket = self.listener
+        self._server.proxy = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='jupyter-forward-proxy', daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stops listening. Connections in progress are abandoned."""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def connect(self) -> http.client.HTTPConnection:
+        """Returns a new connection to the upstream port"""
+        return http.client.HTTPConnection('localhost', self.upstream_port, timeout=self.timeout)
+
+    def server_version(self) -> str | None:
+        """Returns the version of the Jupyter server, None if it cannot be determined"""
+        with self._lock:
+            if self._version is None:
+                connection = self.connect()
+                try:
+                    connection.request('GET', f'{self.base_url.rstrip("/")}/api')
+                    response = connection.getresponse()
+                    if response.status == 200:
+                        self._version = json.loads(response.read()).get('version')
+                except (OSError, ValueError, http.client.HTTPException):
+                    pass
+                finally:
+                    connection.close()
+            return self._version
+
+    def cache_key(self, method: str, path: str, headers: typing.Mapping[str, str]) -> str | None:
+        """Returns the cache key of a request, or None if its response is not cached"""
+        if method != 'GET' or 'Range' in headers:
+            return None
+        relative = path.removeprefix(self.base_url.rstrip('/') + '/')
+        if (
+            relative == path
+            or not relative.startswith(CACHEABLE_PREFIXES)
+            or not has_content_hash(relative)
+        ):
+            return None
+        version = self.server_version()
+        if version is None:
+            return None
+        encoding = 'gzip' if 'gzip' in headers.get('Accept-Encoding', '') else 'identity'
+        return AssetCache.key(version, encoding, path)
+
+    def count(self, **increments: int) -> None:
+        with self._lock:
+            for name, increment in increments.items():
+                setattr(self.stats, name, getattr(self.stats, name) + increment)
+
+
+class _ProxyServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    proxy: CachingProxy
+
+    def handle_error(self, request, client_address):
+        # Browsers drop connections all the time, e.g. when a tab is closed
+        if not isinstance(sys.exc_info()[1], OSError):
+            super().handle_error(request, client_address)
+
+
+class _ProxyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: _ProxyServer
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Kept alive across the requests of this client connection
+        self.upstream = None
+
+    def finish(self):
+        super().finish()
+        if self.upstream is not None:
+            self.upstream.close()
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_request(self):
+        proxy = self.server.proxy
+        proxy.count(requests=1)
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            return self._tunnel()
+        key = proxy.cache_key(self.command, self.path, self.headers)
+        if key is not None and (cached := proxy.cache.get(key)) is not None:
+            proxy.count(hits=1, bytes_from_cache=len(cached.body))
+            return self._send_cached(cached)
+        try:
+            body = self._read_body()
+            response = self._forward(body)
+        except (OSError, http.client.HTTPException):
+            self._close_upstream()
+            return self.send_error(502, 'Jupyter Lab is not reachable through the tunnel')
+        if key is not None:
+            proxy.count(misses=1)
+            length = int(response.getheader('Content-Length') or proxy.cache.max_entry_size + 1)
+            if self._is_cacheable(response) and length <= proxy.cache.max_entry_size:
+                headers = response.getheaders()
+                cached = CachedResponse(
+                    response.status,
+                    [(name, value) for name, value in headers if name.lower() in _STORED_HEADERS],
+                    response.read(),
+                )
+                proxy.cache.put(key, cached)
+                return self._send_cached(cached)
+        self._relay(response)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = handle_request
+
+    def _is_cacheable(self, response):
+        cache_control = (response.getheader('Cache-Control') or '').lower()
+        return (
+            response.status == 200
+            and response.getheader('Set-Cookie') is None
+            and 'no-store' not in cache_control
+            and 'private' not in cache_control
+        )
+
+    def _read_body(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            chunks = []
+            while size := int(self.rfile.readline().split(b';')[0], 16):
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            # Skip the trailer section
+            while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else None
+
+    def _forward(self, body):
+        headers = _end_to_end(self.headers.items())
+        if body is not None and not any(name.lower() == 'content-length' for name, _ in headers):
+            headers.append(('Content-Length', str(len(body))))
+        reused = self.upstream is not None
+        for attempt in range(2):
+            if self.upstream is None:
+                self.upstream = self.server.proxy.connect()
+            try:
+                self.upstream.putrequest(
+                    self.command, self.path, skip_host=True, skip_accept_encoding=True
+                )
+                for name, value in headers:
+                    self.upstream.putheader(name, value)
+                self.upstream.endheaders(body)
+                return self.upstream.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed the kept-alive connection before seeing the request
+                self._close_upstream()
+                if attempt or not reused or self.command not in _IDEMPOTENT_METHODS:
+                    raise
+
+    def _close_upstream(self):
+        if self.upstream is not None:
+            self.upstream.close()
+            self.upstream = None
+
+    def _has_body(self, status):
+        return self.command != 'HEAD' and status >= 200 and status not in (204, 304)
+
+    def _send_cached(self, cached):
+        self.send_response(cached.status)
+        for name, value in cached.headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(cached.body)))
+        self.end_headers()
+        if self._has_body(cached.status):
+            self.wfile.write(cached.body)
+
+    def _relay(self, response):
+        self.send_response_only(response.status, response.reason)
+        for name, value in _end_to_end(response.getheaders()):
+            self.send_header(name, value)
+        has_body = self._has_body(response.status)
+        chunked = has_body and response.getheader('Content-Length') is None
+        if chunked and self.request_version == 'HTTP/1.0':
+            # HTTP/1.0 clients read the body until the connection closes
+            chunked = False
+            self.close_connection = True
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        if not has_body:
+            response.read()
+            return
+        # Stream the body, so that large downloads and event streams are not buffered
+        while data := response.read1(_BUFFER_SIZE):
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data) if chunked else data)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def _tunnel(self):
+        """Relays a websocket connection byte for byte until either side closes it"""
+        self.close_connection = True
+        try:
+            upstream = socket.create_connection(('localhost', self.server.proxy.upstream_port))
+        except OSError:
+            return self.send_error(502, 'Jupyter Lab is not reachable through the tunnel')
+        with upstream:
+            upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            head = [self.requestline, *(f'{name}: {value}' for name, value in self.headers.items())]
+            upstream.sendall('\r\n'.join([*head, '', '']).encode('latin-1'))
+            _splice(self.connection, upstream)
+
+
+def _splice(first: socket.socket, second: socket.socket) -> None:
+    """Copies data between two connected sockets until both directions are closed"""
+    peers = {first: second, second: first}
+    with selectors.DefaultSelector() as selector:
+        for sock in peers:
+            selector.register(sock, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                sock = key.fileobj
+                try:
+                    data = sock.recv(_BUFFER_SIZE)
+                    if data:
+                        peers[sock].sendall(data)
+                        continue
+                    # Propagate the half-close and stop reading from this side
+                    selector.unregister(sock)
+                    peers[sock].shutdown(socket.SHUT_WR)
+                except OSError:
+                    return
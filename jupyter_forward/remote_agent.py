@@ -0,0 +1,134 @@
+"""Helper that jupyter-forward runs on the remote host for the length of a session.
+
+It reads one JSON request per line on its standard input and writes one JSON response
+per line on its standard output, so each remote operation costs a single round trip
+over one SSH channel instead of a new channel and shell.
+
+This file is uploaded to the remote host and runs with whatever Python it provides, so
+it only uses the standard library and supports Python 3.6 and later.
+"""
+
+import base64
+import json
+import os
+import pwd
+import shutil
+import stat as stat_module
+import subprocess
+import sys
+import time
+
+VERSION = 1
+READ_SIZE = 65536
+
+
+def _path(path):
+    return os.path.expanduser(os.path.expandvars(path))
+
+
+def run(command, input=None, combine=False, timeout=None):
+    """Runs a command line like an SSH exec request, with the user's login shell"""
+    shell = pwd.getpwuid(os.getuid()).pw_shell or '/bin/sh'
+    process = subprocess.Popen(
+        [shell, '-c', command],
+        stdin=subprocess.DEVNULL if input is None else subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT if combine else subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = process.communicate(
+            None if input is None else input.encode(), timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        process.kill()
+        stdout, stderr = process.communicate()
+    return {
+        'exited': process.returncode,
+        'stdout': stdout.decode('utf-8', 'replace'),
+        'stderr': (stderr or b'').decode('utf-8', 'replace'),
+    }
+
+
+def stat(path):
+    path = _path(path)
+    try:
+        info = os.stat(path)
+    except OSError:
+        return {'exists': False, 'is_dir': False, 'writable': False}
+    return {
+        'exists': True,
+        'is_dir': stat_module.S_ISDIR(info.st_mode),
+        'writable': os.access(path, os.W_OK),
+        'size': info.st_size,
+        'mtime': info.st_mtime,
+        'mode': stat_module.S_IMODE(info.st_mode),
+    }
+
+
+def read(path, offset=0, size=READ_SIZE, wait=0.0, interval=0.1):
+    """Reads from `offset`, waiting up to `wait` seconds for the file to grow"""
+    path = _path(path)
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(size)
+            exists = True
+        except FileNotFoundError:
+            # Like `tail -F`, a file that does not exist yet is waited for
+            data, exists = b'', False
+        if data or time.monotonic() >= deadline:
+            return {'exists': exists, 'data': base64.b64encode(data).decode('ascii')}
+        time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+
+
+def write(path, data, mode=None):
+    """Replaces the file atomically, so a concurrent reader never sees it half written"""
+    path = _path(path)
+    temporary = f'{path}.{os.getpid()}'
+    content = base64.b64decode(data)
+    with open(temporary, 'wb') as f:
+        f.write(content)
+    if mode is not None:
+        os.chmod(temporary, mode)
+    os.replace(temporary, path)
+    return {'size': len(content)}
+
+
+def which(name):
+    return {'path': shutil.which(name)}
+
+
+def env():
+    return {'env': dict(os.environ)}
+
+
+HANDLERS = {'run': run, 'stat': stat, 'read': read, 'write': write, 'which': which, 'env': env}
+
+
+def _send(response):
+    sys.stdout.write(json.dumps(response) + '\n')
+    sys.stdout.flush()
+
+
+def main():
+    stdin = sys.stdin.buffer
+    _send({'agent': VERSION, 'pid': os.getpid(), 'python': sys.version.split()[0]})
+    while True:
+        line = stdin.readline()
+        if not line:
+            return
+        request_id = None
+        try:
+            request = json.loads(line.decode('utf-8'))
+            request_id = request.pop('id', None)
+            response = HANDLERS[request.pop('op')](**request)
+            response.update(id=request_id, ok=True)
+        except Exception as exc:
+            response = {'id': request_id, 'ok': False, 'error': f'{type(exc).__name__}: {exc}'}
+        _send(response)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import dataclasses
+import re
+import threading
+import time
+import typing
+from collections.abc import Callable
+
+from .metrics import categorize
+
+# Submission command of each supported batch scheduler
+SCHEDULERS = {'qsub': 'pbs', 'sbatch': 'slurm'}
+
+_JOB_ID_PATTERNS = {
+    # e.g. "1234567.desched1" or "123[].server" for job arrays
+    'pbs': re.compile(r'^(\d+(?:\[\d*\])?(?:\.[\w.-]+)?)$'),
+    # "Submitted batch job 1234567", or "1234567;cluster" with --parsable
+    'slurm': re.compile(r'^(?:Submitted batch job )?(\d+)(?:;\S+)?$'),
+}
+
+_STATUS_COMMANDS = {
+    'pbs': 'qstat -f {job_id}',
+    'slurm': "squeue -h -j {job_id} -o '%T|%r|%S'",
+}
+
+_CANCEL_COMMANDS = {'pbs': 'qdel {job_id}', 'slurm': 'scancel {job_id}'}
+
+_PBS_STATES = {
+    'Q': 'queued',
+    'H': 'queued',
+    'W': 'queued',
+    'T': 'queued',
+    'S': 'queued',
+    'U': 'queued',
+    'R': 'running',
+    'B': 'running',
+    'E': 'finished',
+    'F': 'finished',
+    'X': 'finished',
+    'C': 'finished',
+}
+
+_SLURM_STATES = {
+    'PENDING': 'queued',
+    'CONFIGURING': 'queued',
+    'REQUEUED': 'queued',
+    'REQUEUE_HOLD': 'queued',
+    'RESV_DEL_HOLD': 'queued',
+    'SUSPENDED': 'queued',
+    'RUNNING': 'running',
+    'COMPLETING': 'finished',
+}
+
+
+def detect_scheduler(launch_command: str | None) -> str | None:
+    """Returns 'pbs' or 'slurm' if `launch_command` submits a batch job with qsub or sbatch"""
+    if not launch_command:
+        return None
+    return SCHEDULERS.get(categorize(launch_command))
+
+
+def parse_job_id(scheduler: str, output: str) -> str | None:
+    """Returns the ID of the job submitted by ``qsub`` or ``sbatch`` from its output.
+
+    Lines printed by the login shell around the submission are ignored.
+    """
+    pattern = _JOB_ID_PATTERNS[scheduler]
+    job_id = None
+    for line in output.splitlines():
+        if match := pattern.match(line.strip()):
+            job_id = match.group(1)
+    return job_id
+
+
+@dataclasses.dataclass
+class JobStatus:
+    """State of a batch job.
+
+    Parameters
+    ----------
+    state : str
+        One of 'queued', 'running', 'finished' or 'unknown' (the scheduler could not be
+        queried)
+    code : str, optional
+        State as reported by the scheduler, e.g. 'PENDING' or 'Q'
+    reason : str, optional
+        Why the job is waiting, e.g. 'Priority'
+    start_time : str, optional
+        Start time estimated by the scheduler
+    """
+
+    state: str
+    code: str | None = None
+    reason: str | None = None
+    start_time: str | None = None
+
+    def describe(self) -> str:
+        description = self.code or self.state
+        if self.reason:
+            description = f'{description} ({self.reason})'
+        if self.start_time:
+            description = f'{description}, estimated start {self.start_time}'
+        return description
+
+
+def parse_job_status(scheduler: str, exit_status: int, output: str) -> JobStatus:
+    """Parses the output of ``qstat -f <job>`` or ``squeue -h -j <job> -o '%T|%r|%S'``"""
+    if scheduler == 'pbs':
+        return _parse_qstat(exit_status, output)
+    return _parse_squeue(exit_status, output)
+
+
+def _parse_qstat(exit_status, output):
+    if exit_status:
+        # PBS Pro says "Job has finished", Torque "Unknown Job Id"
+        if 'has finished' in output or 'unknown job id' in output.lower():
+            return JobStatus('finished')
+        return JobStatus('unknown')
+    attributes = {}
+    for line in output.splitlines():
+        name, sep, value = line.partition(' = ')
+        if sep:
+            attributes[name.strip()] = value.strip()
+    code = attributes.get('job_state')
+    if code is None:
+        return JobStatus('unknown')
+    return JobStatus(
+        state=_PBS_STATES.get(code, 'unknown'),
+        code=code,
+        reason=attributes.get('comment'),
+        start_time=attributes.get('estimated.start_time'),
+    )
+
+
+def _parse_squeue(exit_status, output):
+    if exit_status:
+        if 'invalid job id' in output.lower():
+            return JobStatus('finished')
+        return JobStatus('unknown')
+    lines = [line.strip() for line in output.splitlines() if '|' in line]
+    if not lines:
+        # The job has left the queue
+        return JobStatus('finished')
+    code, reason, start_time = (lines[-1].split('|') + ['', ''])[:3]
+    return JobStatus(
+        state=_SLURM_STATES.get(code, 'finished'),
+        code=code,
+        reason=None if reason in ('', 'None') else reason,
+        start_time=None if start_time in ('', 'N/A') else start_time,
+    )
+
+
+@dataclasses.dataclass
+class JobWatcher:
+    """Polls the batch scheduler until a submitted job starts running.
+
+    The scheduler is queried every `poll_interval` seconds at first. While the state of
+    the job does not change, the interval grows by `backoff` up to `max_poll_interval`,
+    so a job that waits in the queue for hours costs a few hundred queries at most.
+
+    Parameters
+    ----------
+    scheduler : str
+        'pbs' or 'slurm'
+    job_id : str
+        ID of the submitted job
+    run : callable
+        Runs a command on the remote host and returns its exit status and output
+    poll_interval : float, optional
+        Initial interval between queries in seconds, by default 2
+    max_poll_interval : float, optional
+        Upper bound of the interval in seconds, by default 60
+    backoff : float, optional
+        Factor by which the interval grows while the state is unchanged, by default 1.5
+    timeout : float, optional
+        Seconds to wait for the job to start, by default forever
+    max_errors : int, optional
+        Number of consecutive failed queries after which waiting is given up, by default 5
+    """
+
+    scheduler: str
+    job_id: str
+    run: Callable[[str], tuple[int, str]]
+    poll_interval: float = 2.0
+    max_poll_interval: float = 60.0
+    backoff: float = 1.5
+    timeout: float | None = None
+    max_errors: int = 5
+    stop: threading.Event = dataclasses.field(default_factory=threading.Event)
+
+    def __post_init__(self):
+        if self.scheduler not in _STATUS_COMMANDS:
+            raise ValueError(
+                f'`scheduler` must be one of {tuple(_STATUS_COMMANDS)}, got {self.scheduler!r}'
+            )
+        self.polls = 0
+        self.cancelled = False
+        self.state = None
+
+    def status(self) -> JobStatus:
+        """Queries the scheduler once"""
+        self.polls += 1
+        exit_status, output = self.run(_STATUS_COMMANDS[self.scheduler].format(job_id=self.job_id))
+        status = parse_job_status(self.scheduler, exit_status, output)
+        self.state = status.state
+        return status
+
+    def wait_until_running(
+        self, on_change: Callable[[JobStatus], typing.Any] | None = None
+    ) -> JobStatus:
+        """Blocks until the job runs, has finished or the scheduler cannot be queried.
+
+        Parameters
+        ----------
+        on_change : callable, optional
+            Called with the new status whenever the state of the job changes
+
+        Returns
+        -------
+        JobStatus
+            The last status, whose state is 'running', 'finished' or 'unknown'
+
+        Raises
+        ------
+        TimeoutError
+            If the job did not start within `timeout` seconds
+        RuntimeError
+            If `stop` was set while waiting
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        interval = self.poll_interval
+        previous = None
+        errors = 0
+        while True:
+            status = self.status()
+            errors = errors + 1 if status.state == 'unknown' else 0
+            key = (status.state, status.code, status.reason)
+            if key != previous:
+                previous = key
+                interval = self.poll_interval
+                if on_change is not None:
+                    on_change(status)
+            else:
+                interval = min(interval * self.backoff, self.max_poll_interval)
+            if status.state in ('running', 'finished') or errors >= self.max_errors:
+                return status
+            delay = interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f'Job {self.job_id} did not start within {self.timeout} seconds'
+                    )
+                delay = min(delay, remaining)
+            if self.stop.wait(delay):
+                raise RuntimeError(f'Stopped waiting for job {self.job_id} to start')
+
+    def cancel(self) -> bool:
+        """Cancels the job with ``qdel`` or ``scancel``. Returns True on success."""
+        exit_status, _ = self.run(_CANCEL_COMMANDS[self.scheduler].format(job_id=self.job_id))
+        self.cancelled = exit_status == 0
+        return self.cancelled
@@ -0,0 +1,182 @@
+"""Forwarding of additional remote services, e.g. Dask dashboards or TensorBoard"""
+
+from __future__ import annotations
+
+import dataclasses
+import ipaddress
+import textwrap
+
+import paramiko
+
+from .forwarding import Forward
+from .helpers import PROBE_PREFIX
+
+
+def parse_forward_spec(spec: str | int) -> tuple[int, int]:
+    """Parses a ``remote_port[:local_port]`` forward specification
+
+    Parameters
+    ----------
+    spec : str or int
+        Remote port, optionally followed by the local port to listen on,
+        e.g. ``8787`` or ``6006:16006``
+
+    Returns
+    -------
+    tuple of (int, int)
+        The remote port and the local port, which defaults to the remote port
+    """
+    remote, sep, local = str(spec).partition(':')
+    try:
+        ports = int(remote), int(local) if sep else int(remote)
+    except ValueError:
+        raise ValueError(f'Invalid forward {spec!r}, expected remote_port[:local_port]') from None
+    if not all(0 < port < 65536 for port in ports):
+        raise ValueError(f'Invalid forward {spec!r}, ports must be between 1 and 65535')
+    return ports
+
+
+def port_scan_script(pid: int, runtime_dir: str) -> str:
+    """Returns a POSIX shell script listing the TCP ports descendants of `pid` listen on.
+
+    Only ``/proc``, ``ps`` and ``awk`` are needed. The ports of the kernel connection
+    files in `runtime_dir` (the ZeroMQ channels of each kernel) are listed as well, so
+    that they can be told apart from services started by the kernels.
+    """
+    return textwrap.dedent(
+        f"""\
+        pids=$(ps -e -o pid= -o ppid= | awk -v root={int(pid)} '
+            {{ parent[$1] = $2 }}
+            END {{
+                found[root] = 1
+                do {{
+                    changed = 0
+                    for (p in parent) if (!(p in found) && (parent[p] in found)) {{ found[p] = 1; changed = 1 }}
+                }} while (changed)
+                for (p in found) if (p != root) print p
+            }}')
+        inodes=$(for p in $pids; do ls -l /proc/$p/fd 2>/dev/null; done | sed -n 's/.*socket:\\[\\([0-9]*\\)\\].*/\\1/p')
+        if [ -n "$inodes" ]; then
+            awk -v inodes="$inodes" '
+                BEGIN {{ n = split(inodes, list); for (i = 1; i <= n; i++) wanted[list[i]] = 1 }}
+                $4 == "0A" && ($10 in wanted) {{ print "{PROBE_PREFIX} listen=" $2 }}
+            ' /proc/net/tcp /proc/net/tcp6 2>/dev/null
+        fi
+        cat {runtime_dir}/kernel-*.json 2>/dev/null | grep -o '"[a-z]*_port": *[0-9]*' | sed 's/.*[^0-9]/{PROBE_PREFIX} kernel=/'
+        exit 0
+        """
+    )
+
+
+def _decode_address(value: str) -> str:
+    # /proc/net/tcp prints addresses as hexadecimal 32-bit words in host byte order
+    raw = bytes.fromhex(value)
+    raw = b''.join(raw[i : i + 4][::-1] for i in range(0, len(raw), 4))
+    address = ipaddress.ip_address(raw)
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return str(address)
+
+
+def parse_port_scan(stdout: str) -> list[tuple[str, int]]:
+    """Parses the output of `port_scan_script`
+
+    Parameters
+    ----------
+    stdout : str
+        Output of the port scan script. Other lines (e.g. login banners) are ignored.
+
+    Returns
+    -------
+    list of tuple of (str, int)
+        Sorted addresses to connect to and ports of the listening sockets, excluding
+        kernel channels. Sockets listening on all interfaces are reachable on
+        ``localhost``.
+    """
+    listening = set()
+    kernel_ports = set()
+    for line in stdout.splitlines():
+        line = line.strip()
+        if not line.startswith(f'{PROBE_PREFIX} '):
+            continue
+        key, _, value = line[len(PROBE_PREFIX) + 1 :].partition('=')
+        try:
+            if key == 'kernel':
+                kernel_ports.add(int(value))
+            elif key == 'listen':
+                address, _, port = value.partition(':')
+                host = _decode_address(address)
+                if ipaddress.ip_address(host).is_unspecified:
+                    host = 'localhost'
+                listening.add((host, int(port, 16)))
+        except ValueError:
+            continue
+    return sorted((host, port) for host, port in listening if port not in kernel_ports)
+
+
+def is_http_service(
+    transport: paramiko.Transport, host: str, port: int, timeout: float = 5.0
+) -> bool:
+    """Returns whether an HTTP server answers on `host:port` as seen from the SSH server.
+
+    Kernels and the processes they start listen on many ports that are not meant
+    for a browser, e.g. the workers of a Dask cluster.
+    """
+    try:
+        channel = transport.open_channel(
+            'direct-tcpip', (host, port), ('127.0.0.1', 0), timeout=timeout
+        )
+    except (paramiko.SSHException, OSError, EOFError):
+        return False
+    try:
+        channel.settimeout(timeout)
+        channel.sendall(f'HEAD / HTTP/1.0\r\nHost: {host}:{port}\r\n\r\n'.encode())
+        return channel.recv(5) == b'HTTP/'
+    except (paramiko.SSHException, OSError, EOFError):
+        return False
+    finally:
+        channel.close()
+
+
+@dataclasses.dataclass
+class Service:
+    """A remote service forwarded to a local port next to Jupyter Lab"""
+
+    name: str
+    remote_host: str
+    remote_port: int | None
+    forward: Forward = dataclasses.field(repr=False)
+    detected: bool = False
+
+    @property
+    def url(self) -> str:
+        return f'http://localhost:{self.forward.local_port}'
+
+
+def render_services(services: list[Service]):
+    """Returns a table of the forwarded services and the traffic they carried"""
+    from rich.filesize import decimal
+    from rich.table import Table
+
+    table = Table(title='Forwarded services')
+    table.add_column('Service')
+    table.add_column('Local', justify='right')
+    table.add_column('Remote')
+    table.add_column('Connections', justify='right')
+    table.add_column('Active', justify='right')
+    table.add_column('Sent', justify='right')
+    table.add_column('Received', justify='right')
+    for service in services:
+        stats = service.forward.stats
+        table.add_row(
+            service.name,
+            str(service.forward.local_port),
+            service.remote_host
+            if service.remote_port is None
+            else f'{service.remote_host}:{service.remote_port}',
+            str(stats.connections),
+            str(stats.active),
+            decimal(stats.bytes_sent),
+            decimal(stats.bytes_received),
+        )
+    return table
@@ -0,0 +1,124 @@
+"""A SOCKS5 front end for the forwarding engine, similar to ``ssh -D``"""
+
+from __future__ import annotations
+
+import dataclasses
+import fnmatch
+import ipaddress
+import socket
+import struct
+
+SOCKS_VERSION = 5
+
+# Reply codes of RFC 1928
+SUCCEEDED = 0
+GENERAL_FAILURE = 1
+NOT_ALLOWED = 2
+HOST_UNREACHABLE = 4
+COMMAND_NOT_SUPPORTED = 7
+ADDRESS_TYPE_NOT_SUPPORTED = 8
+
+_NO_AUTHENTICATION = 0
+_NO_ACCEPTABLE_METHODS = 0xFF
+_CONNECT = 1
+_IPV4, _DOMAIN, _IPV6 = 1, 3, 4
+
+
+class SocksError(Exception):
+    """Raised when a client sends a request that cannot be served"""
+
+    def __init__(self, message: str, reply: int = GENERAL_FAILURE):
+        super().__init__(message)
+        self.reply = reply
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise SocksError('Client closed the connection during the handshake')
+        data += chunk
+    return bytes(data)
+
+
+def _reply(code: int) -> bytes:
+    # The bound address is meaningless for a tunnel, clients ignore it
+    return struct.pack('!BBBB4sH', SOCKS_VERSION, code, 0, _IPV4, bytes(4), 0)
+
+
+@dataclasses.dataclass
+class Socks5Handshake:
+    """Negotiates SOCKS5 CONNECT requests on behalf of a dynamic forward.
+
+    Only the CONNECT command without authentication is supported. That is what browsers
+    use, and the listener is bound to the local machine. Hostnames are not resolved
+    locally, so names only known to the remote network (e.g. compute nodes) work if the
+    browser sends them to the proxy ("proxy DNS" in the browser settings).
+
+    Parameters
+    ----------
+    allow : tuple of str, optional
+        Shell-style patterns of the hosts that may be reached, e.g. ``'*.cluster'`` or
+        ``'10.1.*'``, by default any host
+    timeout : float, optional
+        Seconds a client has to complete the handshake, by default 10
+    """
+
+    allow: tuple[str, ...] = ()
+    timeout: float = 10.0
+
+    def is_allowed(self, host: str) -> bool:
+        host = host.lower()
+        return not self.allow or any(
+            fnmatch.fnmatchcase(host, pattern.lower()) for pattern in self.allow
+        )
+
+    def negotiate(self, sock: socket.socket) -> tuple[str, int] | None:
+        """Reads the client's request and returns the address it wants to connect to.
+
+        Requests that cannot be served are answered with an error and None is returned.
+        The reply to a served request is sent by `reply` once the channel is open.
+        """
+        sock.settimeout(self.timeout)
+        try:
+            version, count = _recv_exactly(sock, 2)
+            if version != SOCKS_VERSION:
+                return None
+            if _NO_AUTHENTICATION not in _recv_exactly(sock, count):
+                sock.sendall(bytes([SOCKS_VERSION, _NO_ACCEPTABLE_METHODS]))
+                return None
+            sock.sendall(bytes([SOCKS_VERSION, _NO_AUTHENTICATION]))
+            try:
+                destination = self._read_request(sock)
+            except SocksError as exc:
+                sock.sendall(_reply(exc.reply))
+                return None
+            if not self.is_allowed(destination[0]):
+                sock.sendall(_reply(NOT_ALLOWED))
+                return None
+            return destination
+        except (SocksError, OSError, ValueError):
+            return None
+
+    def _read_request(self, sock: socket.socket) -> tuple[str, int]:
+        version, command, _, address_type = _recv_exactly(sock, 4)
+        if version != SOCKS_VERSION:
+            raise SocksError(f'Unsupported SOCKS version {version}')
+        if address_type == _IPV4:
+            host = str(ipaddress.IPv4Address(_recv_exactly(sock, 4)))
+        elif address_type == _IPV6:
+            host = str(ipaddress.IPv6Address(_recv_exactly(sock, 16)))
+        elif address_type == _DOMAIN:
+            (length,) = _recv_exactly(sock, 1)
+            host = _recv_exactly(sock, length).decode('idna')
+        else:
+            raise SocksError(f'Unsupported address type {address_type}', ADDRESS_TYPE_NOT_SUPPORTED)
+        (port,) = struct.unpack('!H', _recv_exactly(sock, 2))
+        if command != _CONNECT:
+            raise SocksError(f'Unsupported command {command}', COMMAND_NOT_SUPPORTED)
+        return host, port
+
+    def reply(self, sock: socket.socket, opened: bool) -> None:
+        """Tells the client whether the channel to its destination could be opened"""
+        sock.sendall(_reply(SUCCEEDED if opened else HOST_UNREACHABLE))
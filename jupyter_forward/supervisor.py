@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import socket
+import threading
+import time
+import typing
+from collections.abc import Callable
+
+import paramiko
+
+from .console import console
+from .exceptions import ReauthenticationRequiredError
+from .forwarding import Forward
+
+
+@dataclasses.dataclass
+class TunnelSupervisor:
+    """Keeps an SSH transport alive and replaces it when the connection drops.
+
+    A watchdog thread sends a keepalive request every `keepalive_interval` seconds.
+    If the server does not answer within `keepalive_timeout` seconds (e.g. after the
+    laptop slept or the VPN reconnected), the transport is considered dead and
+    `reconnect` is called until it returns a new one. Meanwhile the supervised forwards
+    keep their local port bound and hold new connections, so browsers only see a
+    stall. Reconnecting is given up at once if `reconnect` raises
+    `ReauthenticationRequiredError`, since retrying cannot succeed without the user.
+
+    Parameters
+    ----------
+    transport : paramiko.Transport
+        The authenticated transport to watch
+    reconnect : callable
+        Opens and authenticates a new connection and returns its transport
+    keepalive_interval : float, optional
+        Seconds between keepalive requests, by default 5
+    keepalive_timeout : float, optional
+        Seconds to wait for the answer to a keepalive request, by default 10
+    reconnect_timeout : float, optional
+        Seconds to keep trying to reconnect before giving up, by default 300
+    retry_interval : float, optional
+        Initial delay between reconnection attempts in seconds, doubled after every
+        failed attempt up to `max_retry_interval`, by default 1
+    max_retry_interval : float, optional
+        Upper bound of the delay between reconnection attempts, by default 30
+    on_failure : callable, optional
+        Called with the reason when reconnecting was given up
+    """
+
+    transport: paramiko.Transport = dataclasses.field(repr=False)
+    reconnect: Callable[[], paramiko.Transport] = dataclasses.field(repr=False)
+    keepalive_interval: float = 5.0
+    keepalive_timeout: float = 10.0
+    reconnect_timeout: float = 300.0
+    retry_interval: float = 1.0
+    max_retry_interval: float = 30.0
+    on_failure: Callable[[str], typing.Any] | None = dataclasses.field(default=None, repr=False)
+
+    def __post_init__(self):
+        self.forwards: list[Forward] = []
+        self.reconnects = 0
+        self.failed = False
+        self.error: str | None = None
+        self._connected = threading.Event()
+        self._connected.set()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set() and not self.failed
+
+    def start(self) -> None:
+        """Starts the watchdog thread"""
+        self._tune(self.transport)
+        self._thread = threading.Thread(
+            target=self._run, name='jupyter-forward-supervisor', daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stops the watchdog thread and releases everything waiting for a transport"""
+        self._closed.set()
+        self._wake.set()
+        self._connected.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            # A reconnection attempt in progress is abandoned rather than awaited
+            self._thread.join(self.keepalive_timeout)
+
+    def supervise(self, forward: Forward) -> None:
+        """Moves `forward` to the new transport after every reconnection"""
+        forward.on_open_failure = self.check
+        self.forwards.append(forward)
+
+    def check(self, transport: paramiko.Transport) -> bool:
+        """Checks `transport` after a failure and starts reconnecting if it is dead.
+
+        Returns True if the caller should retry with the next transport.
+        """
+        if self.is_alive(transport):
+            return False
+        self._lost(transport)
+        return not (self.failed or self._closed.is_set())
+
+    def is_alive(self, transport: paramiko.Transport | None = None) -> bool:
+        """Returns True if the server answers a keepalive request over `transport`"""
+        transport = transport or self.transport
+        if not transport.is_active():
+            return False
+        answered = threading.Event()
+
+        def ping():
+            with contextlib.suppress(Exception):
+                transport.global_request('keepalive@openssh.com', wait=True)
+            answered.set()
+
+        # paramiko tracks a single pending global request per transport
+        with self._probe_lock:
+            threading.Thread(target=ping, name='jupyter-forward-keepalive', daemon=True).start()
+            return answered.wait(self.keepalive_timeout) and transport.is_active()
+
+    def wait_for_transport(self) -> paramiko.Transport | None:
+        """Returns a live transport, waiting for a reconnection if the current one is dead.
+
+        Returns None if reconnecting was given up or the supervisor was closed.
+        """
+        with self._lock:
+            transport = self.transport if self._connected.is_set() else None
+        if transport is not None:
+            if self.is_alive(transport):
+                return transport
+            self._lost(transport)
+        self._connected.wait()
+        if self.failed or self._closed.is_set():
+            return None
+        return self.transport
+
+    def _tune(self, transport):
+        # Lets the kernel notice a peer that vanished while the tunnel is idle
+        with contextlib.suppress(AttributeError, OSError):
+            transport.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    def _lost(self, transport):
+        """Marks `transport` as dead and holds new connections of all forwards"""
+        with self._lock:
+            if transport is not self.transport or not self._connected.is_set():
+                return
+            self._connected.clear()
+            for forward in self.forwards:
+                forward.suspend()
+        console.print(
+            '[bold yellow]:warning: Lost the connection to the remote host. Reconnecting...'
+        )
+        self._wake.set()
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.keepalive_interval)
+            self._wake.clear()
+            if self._closed.is_set() or self.failed:
+                return
+            if not self._connected.is_set() or not self.is_alive():
+                self._reconnect()
+
+    def _reconnect(self):
+        self._lost(self.transport)
+        deadline = time.monotonic() + self.reconnect_timeout
+        delay = self.retry_interval
+        error = f'Could not reconnect to the remote host within {self.reconnect_timeout} seconds'
+        while not self._closed.is_set():
+            try:
+                transport = self.reconnect()
+            except ReauthenticationRequiredError as exc:
+                error = str(exc)
+                break
+            except Exception as exc:
+                console.print(f'[bold yellow]:warning: Reconnection failed: {exc}')
+            else:
+                self._tune(transport)
+                with self._lock:
+                    self.transport = transport
+                    for forward in self.forwards:
+                        forward.resume(transport)
+                    self.reconnects += 1
+                    self._connected.set()
+                console.print('[bold cyan]:white_check_mark: Reconnected to the remote host')
+                return
+            if time.monotonic() + delay > deadline or self._closed.wait(delay):
+                break
+            delay = min(delay * 2, self.max_retry_interval)
+        if self._closed.is_set():
+            return
+        self.error = error
+        self.failed = True
+        self._connected.set()
+        console.print(f'[bold red]:x: {error}')
+        if self.on_failure is not None:
+            self.on_failure(error)
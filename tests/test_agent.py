@@ -0,0 +1,186 @@
+import base64
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import jupyter_forward.agent
+from jupyter_forward.agent import (
+    AgentError,
+    AgentNotInstalledError,
+    RemoteAgent,
+    agent_path,
+    agent_source,
+)
+
+AGENT = pathlib.Path(jupyter_forward.agent.__file__).with_name('remote_agent.py')
+
+
+class LocalChannel:
+    """Runs a command locally with its stdin and stdout on a socket, like a paramiko channel"""
+
+    def __init__(self):
+        self.closed = False
+        self.process = None
+        self.sock, self._remote = socket.socketpair()
+
+    def exec_command(self, command):
+        self.process = subprocess.Popen(
+            command, shell=True, stdin=self._remote, stdout=self._remote, stderr=subprocess.PIPE
+        )
+        self._remote.close()
+
+    def makefile(self, mode):
+        return self.sock.makefile(mode)
+
+    def makefile_stderr(self, mode):
+        return self.process.stderr
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def shutdown_write(self):
+        self.sock.shutdown(socket.SHUT_WR)
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        self.process.wait(timeout=10)
+        self.process.stderr.close()
+
+
+class LocalTransport:
+    def open_session(self):
+        return LocalChannel()
+
+
+@pytest.fixture
+def agent():
+    agent = RemoteAgent.start(LocalTransport(), f'{sys.executable} {AGENT}', timeout=10)
+    try:
+        yield agent
+    finally:
+        agent.close()
+
+
+def test_agent_start(agent):
+    assert agent.alive
+    assert agent.info['python'] == sys.version.split()[0]
+
+
+def test_agent_start_skips_banner():
+    agent = RemoteAgent.start(LocalTransport(), f'echo Welcome; {sys.executable} {AGENT}')
+    try:
+        assert agent.info['agent'] == 1
+    finally:
+        agent.close()
+
+
+@pytest.mark.parametrize(
+    'command, error',
+    [
+        (f'{sys.executable} /does/not/exist.py', AgentNotInstalledError),
+        ('echo "python3: command not found" >&2; exit 127', AgentError),
+    ],
+)
+def test_agent_start_error(command, error):
+    with pytest.raises(error):
+        RemoteAgent.start(LocalTransport(), command, timeout=10)
+
+
+def test_agent_path():
+    assert agent_path().startswith('~/.jupyter_forward/agent-')
+    assert 'def main' in agent_source()
+
+
+@pytest.mark.parametrize(
+    'params, expected',
+    [
+        ({'command': 'echo hello; echo oops >&2; exit 3'}, ('hello\n', 'oops\n', 3)),
+        ({'command': 'echo hello; echo oops >&2', 'combine': True}, ('hello\noops\n', '', 0)),
+        ({'command': 'cat; echo done', 'input': 'piped\n'}, ('piped\ndone\n', '', 0)),
+    ],
+)
+def test_agent_run(agent, params, expected):
+    reply = agent.call('run', **params)
+    assert (reply.values['stdout'], reply.values['stderr'], reply.values['exited']) == expected
+    assert reply.bytes_sent > 0 and reply.bytes_received > 0
+
+
+def test_agent_files(agent, tmp_path):
+    path = tmp_path / 'file.txt'
+    data = base64.b64encode(b'hello world').decode()
+    assert agent.call('write', path=str(path), data=data, mode=0o700).values['size'] == 11
+    assert path.read_bytes() == b'hello world'
+    stat = agent.call('stat', path=str(path)).values
+    assert stat['exists'] and not stat['is_dir'] and stat['size'] == 11 and stat['mode'] == 0o700
+    assert agent.call('stat', path=str(tmp_path / 'missing')).values == {
+        'exists': False,
+        'is_dir': False,
+        'writable': False,
+    }
+    reply = agent.call('read', path=str(path), offset=6)
+    assert base64.b64decode(reply.values['data']) == b'world'
+    assert os.listdir(tmp_path) == ['file.txt']
+
+
+def test_agent_read_waits_for_data(agent, tmp_path):
+    path = tmp_path / 'log.txt'
+
+    def write_later():
+        time.sleep(0.3)
+        path.write_text('ready\n')
+
+    thread = threading.Thread(target=write_later)
+    thread.start()
+    started = time.monotonic()
+    reply = agent.call('read', timeout=5, path=str(path), wait=5, interval=0.05)
+    thread.join()
+    assert base64.b64decode(reply.values['data']) == b'ready\n'
+    assert 0.2 < time.monotonic() - started < 4
+    # Without new data, the read returns empty once the wait is over
+    reply = agent.call('read', path=str(path), offset=6, wait=0.1)
+    assert reply.values == {'exists': True, 'data': ''}
+
+
+def test_agent_which_env(agent):
+    assert agent.call('which', name='sh').values['path'].endswith('/sh')
+    assert agent.call('which', name='not-a-command-anywhere').values['path'] is None
+    assert agent.call('env').values['env']['PATH'] == os.environ['PATH']
+
+
+def test_agent_request_error(agent, tmp_path):
+    with pytest.raises(AgentError, match='FileNotFoundError'):
+        agent.call('write', path=str(tmp_path / 'missing' / 'file'), data='')
+    with pytest.raises(AgentError, match='KeyError'):
+        agent.call('unknown')
+    # A failed request leaves the agent usable
+    assert agent.alive
+    assert agent.call('run', command='true').values['exited'] == 0
+
+
+def test_agent_exited(agent):
+    # The command kills the agent before it replies
+    with pytest.raises(AgentError, match='exited'):
+        agent.call('run', command='kill -9 $PPID')
+    assert not agent.alive
+
+
+def test_agent_timeout_sent(agent):
+    agent.timeout = 0.5
+    with pytest.raises(AgentError) as excinfo:
+        agent.call('run', command='sleep 2')
+    # The command may be running, so it must not be sent again elsewhere
+    assert excinfo.value.sent
+    assert not agent.alive
+    with pytest.raises(AgentError) as excinfo:
+        agent.call('run', command='true')
+    assert not excinfo.value.sent
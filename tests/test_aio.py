@@ -0,0 +1,67 @@
+import asyncio
+import os
+import socket
+import time
+
+import pytest
+
+from jupyter_forward import AsyncRemoteRunner
+from jupyter_forward.exceptions import JupyterForwardError, PortUnavailableError
+
+from .test_core import dummy_auth_handler, dummy_fallback_auth_handler, requires_ssh
+
+AUTH_HANDLERS = {
+    'auth_handler': dummy_auth_handler,
+    'fallback_auth_handler': dummy_fallback_auth_handler,
+}
+
+
+def test_connect_port_unavailable():
+    async def connect(port):
+        async with AsyncRemoteRunner('eniac01', port=port):
+            pass
+
+    with socket.create_server(('localhost', 0)) as busy:
+        with pytest.raises(PortUnavailableError, match='already in use'):
+            asyncio.run(connect(busy.getsockname()[1]))
+
+
+def test_launch_before_connect():
+    with pytest.raises(JupyterForwardError, match='connect'):
+        asyncio.run(AsyncRemoteRunner('eniac01').launch())
+
+
+def test_connect_cancelled():
+    # A server that never sends its SSH banner keeps the connection attempt blocked
+    with socket.create_server(('localhost', 0)) as server:
+        port = server.getsockname()[1]
+        session = AsyncRemoteRunner(f'user@localhost:{port}', port='auto', **AUTH_HANDLERS)
+
+        async def connect():
+            await asyncio.wait_for(session.connect(), timeout=0.5)
+
+        start = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(connect())
+        assert time.monotonic() - start < 5
+        assert session.runner is None
+        assert session._cancelled.is_set()
+
+
+@requires_ssh
+def test_connect_sessions():
+    host = f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}'
+
+    async def connect():
+        sessions = [AsyncRemoteRunner(host, port='auto', **AUTH_HANDLERS) for _ in range(3)]
+        await asyncio.gather(*(session.connect() for session in sessions))
+        try:
+            assert [session.status for session in sessions] == ['connected'] * 3
+            assert len({session.runner.port for session in sessions}) == 3
+        finally:
+            await asyncio.gather(*(session.close() for session in sessions))
+        return sessions
+
+    sessions = asyncio.run(connect())
+    assert [session.status for session in sessions] == ['stopped'] * 3
+    assert all(session.runner.listener is None for session in sessions)
@@ -0,0 +1,54 @@
+import json
+import time
+
+import pytest
+
+from jupyter_forward.cache import HostFactsCache, default_cache_dir
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return HostFactsCache(path=tmp_path / 'hosts.json', ttl=60)
+
+
+def test_default_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    assert default_cache_dir() == tmp_path / 'jupyter-forward'
+    assert HostFactsCache().path == tmp_path / 'jupyter-forward' / 'hosts.json'
+
+
+def test_get_missing(cache):
+    assert cache.get('user@host') is None
+
+
+def test_set_and_get(cache):
+    facts = {'shell': '/bin/bash', 'hostname': 'eniac01.example.com'}
+    cache.set('user@host', facts, {'base': 'conda activate'})
+    entry = cache.get('user@host')
+    assert entry['facts'] == facts
+    assert entry['activate_cmds'] == {'base': 'conda activate'}
+    assert cache.get('other@host') is None
+
+
+def test_expired(cache):
+    cache.set('user@host', {'shell': '/bin/bash'}, {})
+    data = json.loads(cache.path.read_text())
+    data['user@host']['timestamp'] = time.time() - 120
+    cache.path.write_text(json.dumps(data))
+    assert cache.get('user@host') is None
+
+
+def test_invalidate(cache):
+    cache.set('user@host', {'shell': '/bin/bash'}, {})
+    cache.set('user@other', {'shell': '/bin/zsh'}, {})
+    cache.invalidate('user@host')
+    cache.invalidate('user@missing')
+    assert cache.get('user@host') is None
+    assert cache.get('user@other')['facts'] == {'shell': '/bin/zsh'}
+
+
+def test_corrupt_file(cache):
+    cache.path.write_text('{not json')
+    assert cache.get('user@host') is None
+    cache.set('user@host', {'shell': '/bin/bash'}, {})
+    assert cache.get('user@host')['facts'] == {'shell': '/bin/bash'}
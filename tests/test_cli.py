@@ -1,3 +1,7 @@
+import subprocess
+import sys
+
+import pytest
 import typer.testing
 
 from jupyter_forward.cli import app
@@ -14,3 +18,28 @@ def test_version():
     result = runner.invoke(app, ['--version'])
     assert result.exit_code == 0
     assert 'Jupyter Forward CLI Version'.lower() in result.stdout.lower()
+
+
+@pytest.mark.parametrize('option', ['--help', '--version'])
+def test_fast_path_does_not_import_ssh_stack(option):
+    # The SSH stack is slow to import, especially from network file systems, and is not
+    # needed until a session is created
+    code = (
+        'import sys, typer.testing\n'
+        'from jupyter_forward.cli import app\n'
+        f'result = typer.testing.CliRunner().invoke(app, [{option!r}])\n'
+        'assert result.exit_code == 0, result.output\n'
+        "print(' '.join(sorted({name.split('.')[0] for name in sys.modules})))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True
+    ).stdout
+    loaded = set(output.split())
+    assert not loaded & {'fabric', 'paramiko', 'invoke', 'cryptography'}
+
+
+def test_remote_runner_is_importable_from_package():
+    import jupyter_forward
+    import jupyter_forward.core
+
+    assert jupyter_forward.RemoteRunner is jupyter_forward.core.RemoteRunner
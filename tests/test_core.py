@@ -1,11 +1,18 @@
 import datetime
+import http.server
 import json
 import os
+import socket
+import threading
+import time
 from contextlib import contextmanager
 
+import paramiko
 import pytest
 
 import jupyter_forward
+import jupyter_forward.core
+from jupyter_forward.scheduler import JobWatcher
 
 from .misc import sample_log_file_contents
 
@@ -38,6 +45,7 @@ def runner(request):
     remote = jupyter_forward.RemoteRunner(
         f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}',
         shell=request.param,
+        port='auto',
         auth_handler=dummy_auth_handler,
         fallback_auth_handler=dummy_fallback_auth_handler,
     )
@@ -94,6 +102,26 @@ def test_runner_init_port_unavailable():
         )
 
 
+@requires_ssh
+def test_runner_init_port_auto():
+    with socket.create_server(('localhost', 0)) as busy:
+        start = busy.getsockname()[1]
+        remote = jupyter_forward.RemoteRunner(
+            f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}',
+            port='auto',
+            port_range=(start, start + 20),
+            auth_handler=dummy_auth_handler,
+            fallback_auth_handler=dummy_fallback_auth_handler,
+        )
+    try:
+        assert start < remote.port <= start + 20
+        # The port is held until it is forwarded
+        assert remote.listener.getsockname()[1] == remote.port
+    finally:
+        remote.close()
+    assert remote.listener is None
+
+
 @requires_ssh
 def test_runner_authentication_error():
     with pytest.raises(SystemExit):
@@ -189,6 +217,18 @@ def test_parse_log_file(runner):
     }
 
 
+@requires_ssh
+@pytest.mark.parametrize('runner', SHELLS, indirect=True)
+def test_parse_log_file_exited(runner):
+    runner._set_log_directory()
+    runner._set_log_file()
+    lines = [*sample_log_file_contents[:4], jupyter_forward.helpers.EXIT_MARKER]
+    runner.put_file(runner.log_file, ''.join(f'{line}\n' for line in lines))
+    with pytest.raises(jupyter_forward.exceptions.LaunchError, match='exited') as excinfo:
+        runner._parse_log_file(timeout=30)
+    assert excinfo.value.log_tail[-4:] == sample_log_file_contents[:4]
+
+
 @requires_ssh
 @pytest.mark.parametrize('runner', SHELLS, indirect=True)
 @pytest.mark.parametrize('environment', ['jupyter-forward-dev', None])
@@ -219,3 +259,423 @@ def test_generate_redirect_cmd(runner):
         assert cmd.endswith(runner.log_file)
     else:
         assert cmd.endswith(f'{runner.log_file} 2>&1')
+
+
+@requires_ssh
+@pytest.mark.parametrize('runner', SHELLS, indirect=True)
+def test_probe(runner):
+    runner._probe()
+    if 'csh' in runner.shell:
+        assert not runner._probed
+        return
+    assert runner._probed
+    assert runner._facts['hostname']
+    runner._set_log_directory()
+    runner._set_log_file()
+    assert runner.log_file.startswith(f'{runner.log_dir}/log_')
+    assert not runner.run_command(f'test -f {runner.log_file}', exit=False).failed
+
+
+@requires_ssh
+@pytest.mark.parametrize('shell', SHELLS)
+def test_round_trips(shell):
+    if shell and 'csh' in shell:
+        pytest.skip('The single round trip probe does not support csh')
+    remote = jupyter_forward.RemoteRunner(
+        f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}',
+        shell=shell,
+        port='auto',
+        cache=False,
+        auth_handler=dummy_auth_handler,
+        fallback_auth_handler=dummy_fallback_auth_handler,
+    )
+    try:
+        remote._probe()
+        remote._set_log_directory()
+        remote._conda_activate_cmd()
+        remote._set_log_file()
+        remote._get_hostname()
+        # Locating the shell and the probe must be the only round trips before the launch
+        assert remote.metrics.round_trips <= 2, remote.metrics.summary()
+        assert remote.metrics.failures == 0
+    finally:
+        remote.close()
+
+
+@requires_ssh
+def test_cached_facts_session(monkeypatch, tmp_path):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    host = f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}'
+    kwargs = {
+        'port': 'auto',
+        'auth_handler': dummy_auth_handler,
+        'fallback_auth_handler': dummy_fallback_auth_handler,
+    }
+    remote = jupyter_forward.RemoteRunner(host, **kwargs)
+    try:
+        remote._probe()
+        remote._store_facts()
+        hostname = remote._facts['hostname']
+    finally:
+        remote.close()
+    # The node and its log directory are looked up again by every session
+    entry = remote._cache.get(remote._cache_key())
+    assert 'hostname' not in entry['facts'] and 'log_dir' not in entry['facts']
+
+    remote = jupyter_forward.RemoteRunner(host, **kwargs)
+    try:
+        assert remote._use_cached_facts()
+        assert remote._facts['hostname'] == hostname
+        assert remote._facts['log_file'].endswith(f'/log_{remote.session_id}.txt')
+        assert not remote.run_command(f'test -f {remote._facts["log_file"]}', exit=False).failed
+    finally:
+        remote.close()
+
+
+@requires_ssh
+def test_cached_facts_requested_shell(monkeypatch, tmp_path):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    host = f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}'
+    kwargs = {
+        'port': 'auto',
+        'auth_handler': dummy_auth_handler,
+        'fallback_auth_handler': dummy_fallback_auth_handler,
+    }
+    remote = jupyter_forward.RemoteRunner(host, shell='sh', **kwargs)
+    try:
+        remote._probe()
+        remote._store_facts()
+        requested_shell = remote.shell
+    finally:
+        remote.close()
+
+    # A later session without --shell uses $SHELL rather than the earlier override
+    remote = jupyter_forward.RemoteRunner(host, **kwargs)
+    try:
+        login_shell = remote.run_command('echo $SHELL', exit=False, login=False).stdout.strip()
+        assert remote.shell == login_shell != requested_shell
+        assert not remote._use_cached_facts()
+    finally:
+        remote.close()
+
+
+@requires_ssh
+@pytest.mark.parametrize('state', ['queued', 'finished'])
+def test_stop_cancels_job(state):
+    remote = jupyter_forward.RemoteRunner(
+        f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}',
+        port='auto',
+        cache=False,
+        auth_handler=dummy_auth_handler,
+        fallback_auth_handler=dummy_fallback_auth_handler,
+    )
+    commands = []
+
+    def run(command):
+        commands.append(command)
+        return 0, ''
+
+    remote.job = JobWatcher('pbs', '1234.desched1', run=run)
+    remote.job.state = state
+    remote.stop()
+    if state == 'finished':
+        assert not commands
+    else:
+        assert commands == ['qdel 1234.desched1']
+        assert remote.job.cancelled
+    # Cancelling again from the thread running the session does nothing
+    remote._cancel_job()
+    assert len(commands) <= 1
+
+
+@requires_ssh
+@pytest.mark.parametrize('shell', SHELLS)
+def test_capture_env(shell):
+    remote = jupyter_forward.RemoteRunner(
+        f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}',
+        shell=shell,
+        port='auto',
+        capture_env=True,
+        auth_handler=dummy_auth_handler,
+        fallback_auth_handler=dummy_fallback_auth_handler,
+    )
+    try:
+        assert 'PATH' in remote._environment
+        assert remote._wrap_command('echo $HOME').startswith('env ')
+        assert not remote._wrap_command('echo $HOME', login=True).startswith('env ')
+        out = remote.run_command('printenv PATH', hide=True)
+        assert out.stdout.strip() == remote._environment['PATH']
+    finally:
+        remote.close()
+
+
+@pytest.mark.parametrize(
+    'kwargs, message',
+    [
+        (
+            {'reconnect': True, 'forwarding_backend': 'fabric'},
+            '`reconnect` requires the `engine` forwarding backend',
+        ),
+        (
+            {'cache_assets': True, 'port_forwarding': False},
+            '`cache_assets` requires port forwarding with the `engine` forwarding backend',
+        ),
+        (
+            {'transports': 2, 'forwarding_backend': 'fabric'},
+            '`transports` requires port forwarding with the `engine` forwarding backend',
+        ),
+    ],
+)
+def test_runner_init_backend_options_error(kwargs, message):
+    with pytest.raises(ValueError) as excinfo:
+        jupyter_forward.RemoteRunner('eniac01', **kwargs)
+    assert str(excinfo.value) == message
+
+
+def test_new_session_id():
+    start = datetime.datetime.now()
+    ids = {jupyter_forward.core.new_session_id() for _ in range(1000)}
+    end = datetime.datetime.now()
+    assert len(ids) == 1000
+    # The hour may change while the IDs are generated
+    hours = (start.strftime('%Y-%m-%dT%H'), end.strftime('%Y-%m-%dT%H'))
+    assert all(session_id.startswith(hours) for session_id in ids)
+    assert all(f'-{os.getpid()}-' in session_id for session_id in ids)
+
+
+@requires_ssh
+def test_reconnect_session(tmp_path):
+    # Reconnecting only uses keys and the agent
+    identity = tmp_path / 'id_rsa'
+    paramiko.RSAKey.generate(2048).write_private_key_file(str(identity))
+    remote = jupyter_forward.RemoteRunner(
+        f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}',
+        port='auto',
+        identity=str(identity),
+        auth_handler=dummy_auth_handler,
+        fallback_auth_handler=dummy_fallback_auth_handler,
+        cache=False,
+        reconnect=True,
+    )
+    try:
+        old = remote.session.client.get_transport()
+        with remote._supervise():
+            # Simulate a dropped connection
+            old.sock.shutdown(socket.SHUT_RDWR)
+            transport = remote.supervisor.wait_for_transport()
+            assert transport is not None
+            assert transport is not old
+            assert remote.session.client.get_transport() is transport
+            assert remote.supervisor.reconnects == 1
+        assert remote.run_command('echo alive').stdout.strip().endswith('alive')
+    finally:
+        remote.close()
+
+
+@requires_ssh
+def test_reconnect_requires_reauthentication():
+    prompts = []
+
+    def auth_handler(title, instructions, prompt_list):
+        prompts.append(prompt_list)
+        return dummy_auth_handler(title, instructions, prompt_list)
+
+    remote = jupyter_forward.RemoteRunner(
+        f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}',
+        port='auto',
+        auth_handler=auth_handler,
+        fallback_auth_handler=dummy_fallback_auth_handler,
+        cache=False,
+        reconnect=True,
+    )
+    try:
+        old = remote.session.client.get_transport()
+        prompts.clear()
+        with remote._supervise():
+            old.sock.shutdown(socket.SHUT_RDWR)
+            assert remote.supervisor.wait_for_transport() is None
+        # Without keys, the session ends instead of prompting from the supervisor thread
+        assert remote._stop.wait(5)
+        assert not prompts
+        assert remote.status.startswith('failed: Re-authentication required')
+    finally:
+        remote.close()
+
+
+@requires_ssh
+@pytest.mark.parametrize('shell', SHELLS)
+def test_agent(shell):
+    remote = jupyter_forward.RemoteRunner(
+        f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}',
+        shell=shell,
+        port='auto',
+        auth_handler=dummy_auth_handler,
+        fallback_auth_handler=dummy_fallback_auth_handler,
+        cache=False,
+        agent=True,
+    )
+    try:
+        assert remote._agent is not None
+        records = len(remote.metrics.records)
+        assert (
+            remote.run_command('echo $HOME')
+            .stdout.strip()
+            .endswith(remote.run_command('printenv HOME').stdout.strip())
+        )
+        assert remote.run_command('echod $HOME', exit=False).failed
+        assert remote._command_exists('sh')
+        assert not remote._command_exists('not-a-command-anywhere')
+        remote._set_log_directory()
+        remote._set_log_file()
+        remote.put_file(remote.log_file, ''.join(f'{line}\n' for line in sample_log_file_contents))
+        assert remote._parse_log_file()['port'] == 59628
+        assert {record.kind for record in remote.metrics.records[records:]} == {'agent'}
+
+        # Without the agent, commands fall back to a channel each
+        remote._agent.close()
+        assert remote.run_command('echo alive').stdout.strip().endswith('alive')
+        assert remote._agent is None
+        assert remote.metrics.records[-1].kind == 'run'
+    finally:
+        remote.close()
+
+
+@requires_ssh
+def test_agent_run_timeout_not_repeated():
+    remote = jupyter_forward.RemoteRunner(
+        f'{os.environ["JUPYTER_FORWARD_SSH_TEST_USER"]}@{os.environ["JUPYTER_FORWARD_SSH_TEST_HOSTNAME"]}',
+        port='auto',
+        auth_handler=dummy_auth_handler,
+        fallback_auth_handler=dummy_fallback_auth_handler,
+        cache=False,
+        agent=True,
+    )
+    try:
+        path = remote.run_command('mktemp', echo=False).stdout.strip()
+        remote._agent.timeout = 0.5
+        with pytest.raises(jupyter_forward.exceptions.RemoteCommandError, match='may have run'):
+            remote.run_command(f'echo ran >> {path}; sleep 2', exit=False)
+        assert remote._agent is None
+        time.sleep(3)
+        assert remote.run_command(f'cat {path}').stdout.split() == ['ran']
+    finally:
+        remote.close()
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        {'launch_command': 'qsub -q regular'},
+        {'port_forwarding': False},
+        {'forwarding_backend': 'fabric'},
+    ],
+)
+def test_runner_init_unix_socket_error(kwargs):
+    with pytest.raises(ValueError, match='unix_socket'):
+        jupyter_forward.RemoteRunner('eniac01', unix_socket=True, **kwargs)
+
+
+class _APIHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'{"version": "2.0.0"}')
+
+    def log_message(self, *args):
+        pass
+
+
+class _UnixHTTPServer(http.server.ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        self.socket.bind(self.server_address)
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, ('localhost', 0)
+
+
+@requires_ssh
+@pytest.mark.parametrize('runner', [None], indirect=True)
+def test_server_is_alive_on_unix_socket(runner, tmp_path):
+    path = str(tmp_path / 'jupyter.sock')
+    assert not runner._server_is_alive(None, None, sock=path, timeout=2)
+    server = _UnixHTTPServer(path, _APIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        assert runner._server_is_alive(None, None, sock=path)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@requires_ssh
+@pytest.mark.parametrize('runner', [None], indirect=True)
+def test_reattach_matches_transport(runner, tmp_path, monkeypatch):
+    path = str(tmp_path / 'jupyter.sock')
+    entry = {
+        'session_id': 'previous',
+        'created': '2024-01-01T00:00:00',
+        'log_file': str(tmp_path / 'log_previous.txt'),
+        'conda_env': runner.conda_env,
+        'notebook_dir': runner.notebook_dir,
+        'hostname': 'localhost',
+        'port': None,
+        'token': 'secret',
+        'url': 'http://localhost/?token=secret',
+        'sock': path,
+    }
+    (tmp_path / 'session_previous.json').write_text(f'{json.dumps(entry)}\n')
+    # Restore the attributes _reattach sets on the shared runner
+    for name in ('log_dir', 'log_file', 'parsed_result'):
+        monkeypatch.setattr(runner, name, str(tmp_path), raising=False)
+    server = _UnixHTTPServer(path, _APIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        monkeypatch.setattr(runner, 'unix_socket', False)
+        assert not runner._reattach()
+        # The server was not checked, so its entry is kept
+        assert (tmp_path / 'session_previous.json').exists()
+        monkeypatch.setattr(runner, 'unix_socket', True)
+        assert runner._reattach()
+        assert runner.parsed_result['sock'] == path
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize(
+    'kwargs, match',
+    [
+        ({'forwards': ('dask',)}, 'Invalid forward'),
+        ({'forwards': ('8787',), 'port_forwarding': False}, 'forwards'),
+        ({'detect_ports': True, 'forwarding_backend': 'fabric'}, 'detect_ports'),
+        ({'detect_ports': True, 'launch_command': 'qsub -q regular'}, 'detect_ports'),
+        ({'socks_port': 1080, 'forwarding_backend': 'fabric'}, 'socks_port'),
+        ({'socks_allow': ('node*',)}, 'socks_port'),
+        ({'port': 'any'}, 'port'),
+        ({'port': 'auto', 'port_range': (9000, 8000)}, 'port_range'),
+    ],
+)
+def test_runner_init_forwards_error(kwargs, match):
+    with pytest.raises(ValueError, match=match):
+        jupyter_forward.RemoteRunner('eniac01', **kwargs)
+
+
+@requires_ssh
+@pytest.mark.parametrize('runner', [None], indirect=True)
+def test_is_http_service(runner):
+    from jupyter_forward.services import is_http_service
+
+    transport = runner.session.client.get_transport()
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _APIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        assert is_http_service(transport, '127.0.0.1', server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+    with socket.create_server(('127.0.0.1', 0)) as sock:
+        # Accepts connections but never answers, like a Dask worker
+        assert not is_http_service(transport, '127.0.0.1', sock.getsockname()[1], timeout=1)
@@ -0,0 +1,213 @@
+import concurrent.futures
+import socket
+import threading
+import time
+
+import paramiko
+import pytest
+
+from jupyter_forward.forwarding import ForwardingEngine
+
+
+class FakeChannel:
+    """Mimics the parts of a paramiko channel used by the engine over a TCP socket"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def recv(self, size):
+        try:
+            return self.sock.recv(size)
+        except BlockingIOError:
+            raise TimeoutError from None
+
+    def send(self, data):
+        # Like a channel with a small window, only accept part of the data
+        try:
+            return self.sock.send(data[:4096])
+        except BlockingIOError:
+            raise TimeoutError from None
+
+    def shutdown_write(self):
+        self.sock.shutdown(socket.SHUT_WR)
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+
+
+class FakeTransport:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.opened = []
+
+    def is_active(self):
+        return not self.fail
+
+    def open_channel(self, kind, dest_addr, src_addr, window_size, max_packet_size, timeout):
+        assert kind == 'direct-tcpip'
+        self.opened.append(dest_addr)
+        if self.fail:
+            raise paramiko.SSHException('administratively prohibited')
+        return FakeChannel(socket.create_connection(dest_addr))
+
+
+@pytest.fixture
+def echo_server():
+    """A TCP server that echoes everything and closes once the client stops sending"""
+    server = socket.create_server(('localhost', 0))
+
+    def handle(conn):
+        with conn:
+            while data := conn.recv(65536):
+                conn.sendall(data)
+
+    def serve():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+
+
+def _exchange(port, payload):
+    with socket.create_connection(('localhost', port), timeout=10) as sock:
+        sender = threading.Thread(target=lambda: (sock.sendall(payload), sock.shutdown(1)))
+        sender.start()
+        received = bytearray()
+        while data := sock.recv(65536):
+            received += data
+        sender.join()
+    return bytes(received)
+
+
+@pytest.mark.parametrize('size', [0, 1, 10 * 2**20])
+def test_forward_roundtrip(echo_server, size):
+    payload = bytes(range(256)) * (size // 256) + b'x' * (size % 256)
+    with ForwardingEngine(buffer_size=2**16) as engine:
+        forward = engine.forward(FakeTransport(), 'localhost', echo_server)
+        # Sending everything before reading back relies on back-pressure and half-close
+        assert _exchange(forward.local_port, payload) == payload
+        deadline = time.monotonic() + 5
+        while forward.stats.active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert forward.stats.connections == 1
+        assert forward.stats.active == 0
+        assert forward.stats.bytes_sent == forward.stats.bytes_received == size
+
+
+def test_forward_concurrent_connections(echo_server):
+    with ForwardingEngine() as engine:
+        forward = engine.forward(FakeTransport(), 'localhost', echo_server)
+        payloads = [bytes([i]) * (i * 1000) for i in range(32)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(lambda p: _exchange(forward.local_port, p), payloads))
+        assert results == payloads
+        assert forward.stats.connections == 32
+
+
+def test_forward_channel_open_failure(echo_server):
+    with ForwardingEngine() as engine:
+        forward = engine.forward(FakeTransport(fail=True), 'localhost', echo_server)
+        with socket.create_connection(('localhost', forward.local_port), timeout=5) as sock:
+            assert sock.recv(1) == b''
+        assert forward.stats.failed == 1
+
+
+def test_forward_swap_transport(echo_server):
+    first, second = FakeTransport(), FakeTransport()
+    with ForwardingEngine() as engine:
+        forward = engine.forward(first, 'localhost', echo_server)
+        assert _exchange(forward.local_port, b'hello') == b'hello'
+        forward.transport = second
+        assert _exchange(forward.local_port, b'world') == b'world'
+    assert len(first.opened) == len(second.opened) == 1
+
+
+def test_forward_existing_listener(echo_server):
+    listener = socket.create_server(('localhost', 0))
+    port = listener.getsockname()[1]
+    with ForwardingEngine() as engine:
+        forward = engine.forward(FakeTransport(), 'localhost', echo_server, listener=listener)
+        assert forward.local_port == port
+        assert _exchange(port, b'hello') == b'hello'
+    assert listener.fileno() == -1
+
+
+def test_forward_close(echo_server):
+    with ForwardingEngine() as engine:
+        forward = engine.forward(FakeTransport(), 'localhost', echo_server)
+        port = forward.local_port
+        forward.close()
+        deadline = time.monotonic() + 5
+        while forward.listener.fileno() != -1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with pytest.raises(ConnectionRefusedError):
+            socket.create_connection(('localhost', port), timeout=5)
+
+
+def _wait_for_idle(forward, timeout=5):
+    deadline = time.monotonic() + timeout
+    while forward.stats.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_forward_stripes_round_robin(echo_server):
+    transports = [FakeTransport() for _ in range(3)]
+    with ForwardingEngine() as engine:
+        forward = engine.forward(transports[0], 'localhost', echo_server, policy='round-robin')
+        for transport in transports[1:]:
+            forward.add_transport(transport)
+        for i in range(6):
+            assert _exchange(forward.local_port, b'x' * (i + 1)) == b'x' * (i + 1)
+        _wait_for_idle(forward)
+    assert [len(transport.opened) for transport in transports] == [2, 2, 2]
+    assert [stripe.stats.connections for stripe in forward.stripes] == [2, 2, 2]
+    assert sum(stripe.stats.bytes_received for stripe in forward.stripes) == 21
+    assert all(stripe.stats.active == 0 for stripe in forward.stripes)
+
+
+def test_forward_stripes_least_loaded(echo_server):
+    first, second = FakeTransport(), FakeTransport()
+    with ForwardingEngine() as engine:
+        forward = engine.forward(first, 'localhost', echo_server)
+        forward.add_transport(second)
+        # A long-lived connection keeps the first transport busy
+        with socket.create_connection(('localhost', forward.local_port), timeout=5) as sock:
+            sock.sendall(b'ping')
+            assert sock.recv(4) == b'ping'
+            for _ in range(3):
+                assert _exchange(forward.local_port, b'hello') == b'hello'
+        _wait_for_idle(forward)
+    assert len(first.opened) == 1
+    assert len(second.opened) == 3
+
+
+def test_forward_stripes_skip_dead_transport(echo_server):
+    primary, dead = FakeTransport(), FakeTransport()
+    with ForwardingEngine() as engine:
+        forward = engine.forward(primary, 'localhost', echo_server, policy='round-robin')
+        forward.add_transport(dead)
+        dead.fail = True
+        for _ in range(2):
+            assert _exchange(forward.local_port, b'hello') == b'hello'
+    assert len(primary.opened) == 2
+    assert len(forward.stripes) == 1
+    assert forward.stats.failed == 0
+
+
+def test_forward_unknown_policy(echo_server):
+    with ForwardingEngine() as engine, pytest.raises(ValueError):
+        engine.forward(FakeTransport(), 'localhost', echo_server, policy='random')
@@ -1,4 +1,8 @@
+import http.server
+import json
 import socket
+import threading
+import time
 from unittest import mock
 
 import pytest
@@ -29,6 +33,19 @@ from .misc import sample_log_file_contents, sample_log_file_contents_with_contam
                 'url': 'http://eniac01:59628/?token=Loremipsumdolorsitamet',
             },
         ),
+        (
+            [
+                '[I 2024-01-01 10:00:00.000 ServerApp] Jupyter Server 2.12.0 is running at:',
+                '[I 2024-01-01 10:00:00.000 ServerApp] http+unix://%2Ftmp%2FUser%2F.jupyter_forward%2Fjupyter_a.sock/lab?token=Loremipsumdolorsitamet',
+            ],
+            {
+                'hostname': None,
+                'port': None,
+                'token': 'Loremipsumdolorsitamet',
+                'url': 'http+unix://%2Ftmp%2FUser%2F.jupyter_forward%2Fjupyter_a.sock/lab?token=Loremipsumdolorsitamet',
+                'sock': '/tmp/User/.jupyter_forward/jupyter_a.sock',
+            },
+        ),
         ('', {'hostname': None, 'port': None, 'token': None, 'url': None}),
     ],
 )
@@ -68,3 +85,316 @@ def test_open_browser(port, token, url, expected):
     with mock.patch('webbrowser.open') as mockwebopen:
         jupyter_forward.helpers.open_browser(port, token, url)
         mockwebopen.assert_called_once_with(expected, new=2)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 4096])
+@pytest.mark.parametrize(
+    'contents', [sample_log_file_contents, sample_log_file_contents_with_contamination]
+)
+def test_jupyter_log_parser(contents, chunk_size):
+    data = ''.join(f'{line}\n' for line in contents).encode()
+    parser = jupyter_forward.helpers.JupyterLogParser()
+    chunks = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+    done = [parser.feed(chunk) for chunk in chunks]
+    assert done[-1]
+    assert parser.result == {
+        'hostname': 'eniac01',
+        'port': 59628,
+        'token': 'Loremipsumdolorsitamet',
+        'url': 'http://eniac01:59628/?token=Loremipsumdolorsitamet',
+    }
+
+
+def test_jupyter_log_parser_not_ready():
+    parser = jupyter_forward.helpers.JupyterLogParser()
+    assert not parser.feed('\n'.join(sample_log_file_contents[:4]) + '\n')
+    assert parser.result is None
+
+
+def test_jupyter_log_parser_exited():
+    parser = jupyter_forward.helpers.JupyterLogParser()
+    assert not parser.feed('\n'.join(sample_log_file_contents[:4]) + '\n')
+    assert parser.feed(f'{jupyter_forward.helpers.EXIT_MARKER}\r\n')
+    assert parser.exited
+    assert not parser.ready
+    assert parser.feed('\n'.join(sample_log_file_contents) + '\n')
+    assert parser.result is None
+
+
+class FakeChannel:
+    """Stands in for a paramiko channel: `None` entries simulate a recv timeout."""
+
+    def __init__(self, chunks, sleep=False):
+        self.chunks = list(chunks)
+        self.sleep = sleep
+        self.timeouts = []
+
+    def settimeout(self, timeout):
+        self.timeouts.append(timeout)
+
+    def recv(self, nbytes):
+        chunk = self.chunks.pop(0) if self.chunks else b''
+        if chunk is None:
+            if self.sleep:
+                time.sleep(self.timeouts[-1])
+            raise TimeoutError
+        return chunk
+
+
+def test_stream_channel_backoff():
+    channel = FakeChannel([None, None, None, b'hello', None, b'world'])
+    received = []
+    done = jupyter_forward.helpers.stream_channel(
+        channel, lambda data: received.append(data) or data == b'world', poll_interval=0.5
+    )
+    assert done
+    assert received == [b'hello', b'world']
+    assert channel.timeouts == [0.5, 1.0, 2.0, 2.0, 0.5, 1.0]
+
+
+def test_stream_channel_closed():
+    channel = FakeChannel([b'hello'])
+    assert not jupyter_forward.helpers.stream_channel(channel, lambda data: False)
+
+
+def test_stream_channel_timeout():
+    channel = FakeChannel([None] * 1000, sleep=True)
+    with pytest.raises(TimeoutError):
+        jupyter_forward.helpers.stream_channel(
+            channel, lambda data: False, timeout=0.05, poll_interval=0.01
+        )
+
+
+def test_parse_probe_output():
+    stdout = '\n'.join(
+        [
+            'Welcome to the login node!',
+            'JUPYTER_FORWARD_PROBE hostname=eniac01.example.com',
+            'JUPYTER_FORWARD_PROBE activate_cmd=conda activate',
+            'JUPYTER_FORWARD_PROBE log_dir=/tmp/x=y/.jupyter_forward',
+            'JUPYTER_FORWARD_PROBE malformed',
+        ]
+    )
+    assert jupyter_forward.helpers.parse_probe_output(stdout) == {
+        'hostname': 'eniac01.example.com',
+        'activate_cmd': 'conda activate',
+        'log_dir': '/tmp/x=y/.jupyter_forward',
+    }
+
+
+def test_parse_env_output():
+    stdout = '\n'.join(
+        [
+            'PATH=/opt/conda/bin:/usr/bin',
+            'CONDA_PREFIX=/opt/conda',
+            'LOADEDMODULES=ncarenv/1.2:intel/19.1.1',
+            'MULTILINE=first',
+            'second line',
+            'SHLVL=2',
+            'EMPTY=',
+            'EQUALS=a=b\r',
+        ]
+    )
+    assert jupyter_forward.helpers.parse_env_output(stdout) == {
+        'PATH': '/opt/conda/bin:/usr/bin',
+        'CONDA_PREFIX': '/opt/conda',
+        'LOADEDMODULES': 'ncarenv/1.2:intel/19.1.1',
+        'EMPTY': '',
+        'EQUALS': 'a=b',
+    }
+
+
+class _APIHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'{"version": "2.0.0"}')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def _serve(port, delay=0):
+    time.sleep(delay)
+    server = http.server.ThreadingHTTPServer(('localhost', port), _APIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.mark.parametrize('delay', [0, 0.3])
+def test_wait_for_server(free_port, delay):
+    servers = []
+    thread = threading.Thread(target=lambda: servers.append(_serve(free_port, delay)))
+    thread.start()
+    try:
+        assert jupyter_forward.helpers.wait_for_server(free_port, timeout=10)
+    finally:
+        thread.join()
+        servers[0].shutdown()
+        servers[0].server_close()
+
+
+def test_wait_for_server_timeout(free_port):
+    start = time.monotonic()
+    assert not jupyter_forward.helpers.wait_for_server(free_port, timeout=0.3)
+    assert time.monotonic() - start < 2
+
+
+def test_log_follower_bounded():
+    written = []
+    follower = jupyter_forward.helpers.LogFollower(max_lines=3, write=written.append)
+    data = ''.join(f'[I 15:46:27.{i:03d} ServerApp] line {i}\r\n' for i in range(1000)).encode()
+    for i in range(0, len(data), 333):
+        assert not follower.feed(data[i : i + 333])
+    assert len(written) == 1000
+    assert list(follower.lines) == [
+        f'[I 15:46:27.{i:03d} ServerApp] line {i}' for i in (997, 998, 999)
+    ]
+    assert follower.bytes_received == len(data)
+
+
+def test_log_follower_level():
+    written = []
+    follower = jupyter_forward.helpers.LogFollower(level='warning', write=written.append)
+    follower.feed(
+        '[I 15:46:27.590 ServerApp] info\n'
+        '[W 15:46:27.591 ServerApp] warning\n'
+        'Traceback (most recent call last):\n'
+        '[D 15:46:27.592 ServerApp] debug\n'
+        '[E 15:46:27.593 ServerApp] error\n'
+        'partial'
+    )
+    assert written == [
+        '[W 15:46:27.591 ServerApp] warning',
+        'Traceback (most recent call last):',
+        '[E 15:46:27.593 ServerApp] error',
+    ]
+    assert len(follower.lines) == 5
+
+
+def test_log_follower_quiet_and_replay():
+    written = []
+    follower = jupyter_forward.helpers.LogFollower(level='warning', write=written.append)
+    with follower.quiet():
+        follower.feed(
+            '[W 15:46:27.590 ServerApp] warning\n'
+            'Traceback (most recent call last):\n'
+            '[I 15:46:27.591 ServerApp] info\n'
+            '[E 15:46:27.592 ServerApp] error\n'
+        )
+    assert written == []
+    follower.replay(3)
+    assert written == [
+        'Traceback (most recent call last):',
+        '[E 15:46:27.592 ServerApp] error',
+    ]
+
+
+def test_log_follower_long_line():
+    written = []
+    follower = jupyter_forward.helpers.LogFollower(write=written.append, max_line_length=10)
+    follower.feed('x' * 25)
+    assert written == ['x' * 10, 'x' * 10]
+
+
+def test_log_follower_unknown_level():
+    with pytest.raises(ValueError):
+        jupyter_forward.helpers.LogFollower(level='LOUD')
+
+
+def test_parse_session_registry():
+    entry = {
+        'session_id': 'a',
+        'created': '2024-01-01T10:00:00',
+        'hostname': 'eniac01',
+        'port': 59628,
+        'token': 'Loremipsumdolorsitamet',
+        'url': 'http://eniac01:59628/?token=Loremipsumdolorsitamet',
+        'log_file': '/tmp/.jupyter_forward/log_a.txt',
+    }
+    newer = dict(entry, session_id='b', created='2024-01-02T10:00:00')
+    stdout = '\n'.join(
+        [
+            json.dumps(entry),
+            'cat: /tmp/.jupyter_forward/session_*.json: No such file or directory',
+            json.dumps({'session_id': 'incomplete'}),
+            json.dumps(newer),
+        ]
+    )
+    entries = jupyter_forward.helpers.parse_session_registry(stdout)
+    assert [entry['session_id'] for entry in entries] == ['b', 'a']
+
+
+@pytest.mark.parametrize('token', ['Loremipsumdolorsitamet', ''])
+def test_parse_runtime_file(token):
+    info = {
+        'base_url': '/user/me/',
+        'hostname': 'eniac01.example.com',
+        'pid': 4242,
+        'port': 8890,
+        'secure': False,
+        'token': token,
+        'url': 'http://eniac01.example.com:8890/user/me/',
+    }
+    stdout = f'Welcome to the login node!\n{json.dumps(info)}'
+    result = jupyter_forward.helpers.parse_runtime_file(stdout)
+    assert result['hostname'] == 'eniac01.example.com'
+    assert result['port'] == 8890
+    assert result['base_url'] == '/user/me/'
+    assert result['pid'] == 4242
+    assert result['sock'] is None
+    if token:
+        assert result['token'] == token
+        assert result['url'] == f'http://eniac01.example.com:8890/user/me/?token={token}'
+    else:
+        assert result['token'] is None
+        assert result['url'] == 'http://eniac01.example.com:8890/user/me/'
+
+
+def test_parse_runtime_file_unix_socket():
+    info = {
+        'base_url': '/',
+        'hostname': 'localhost',
+        'pid': 4242,
+        'port': 8888,
+        'sock': '/tmp/.jupyter_forward/jupyter_a.sock',
+        'token': 'Loremipsumdolorsitamet',
+        'url': 'http+unix://%2Ftmp%2F.jupyter_forward%2Fjupyter_a.sock/',
+    }
+    result = jupyter_forward.helpers.parse_runtime_file(json.dumps(info))
+    assert result['sock'] == '/tmp/.jupyter_forward/jupyter_a.sock'
+
+
+@pytest.mark.parametrize('stdout', ['', 'cat: No such file or directory', '{"port": 8888}', '{'])
+def test_parse_runtime_file_invalid(stdout):
+    assert jupyter_forward.helpers.parse_runtime_file(stdout) is None
+
+
+def test_bind_port():
+    with jupyter_forward.helpers.bind_port(0) as sock:
+        port = sock.getsockname()[1]
+        assert jupyter_forward.helpers.bind_port(port) is None
+        assert not jupyter_forward.helpers.is_port_available(port)
+    listener = jupyter_forward.helpers.bind_port(port)
+    assert listener is not None
+    listener.close()
+
+
+def test_reserve_port():
+    with jupyter_forward.helpers.bind_port(0) as busy:
+        start = busy.getsockname()[1]
+        with jupyter_forward.helpers.reserve_port(start, start + 20) as sock:
+            assert start < sock.getsockname()[1] <= start + 20
+        with pytest.raises(RuntimeError, match='No available local port'):
+            jupyter_forward.helpers.reserve_port(start, start, fallback=False)
+        # Without a free port in the range, the operating system picks one
+        with jupyter_forward.helpers.reserve_port(start, start) as sock:
+            assert sock.getsockname()[1] != start
+        assert jupyter_forward.helpers.find_available_port(start) > start
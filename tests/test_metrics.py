@@ -0,0 +1,46 @@
+import pytest
+
+from jupyter_forward.metrics import CommandMetrics, CommandRecord, categorize
+
+
+@pytest.mark.parametrize(
+    'command, expected',
+    [
+        ('which jupyter', 'which'),
+        ('/usr/bin/mkdir -p ~/logs', 'mkdir'),
+        ('env JUPYTER_RUNTIME_DIR=/tmp/x jupyter lab --no-browser', 'jupyter'),
+        ('nohup env A=1 jupyter lab', 'jupyter'),
+        ('env', 'env'),
+        ('echo "unbalanced', 'echo'),
+        ('', 'unknown'),
+    ],
+)
+def test_categorize(command, expected):
+    assert categorize(command) == expected
+
+
+def test_command_metrics():
+    metrics = CommandMetrics()
+    metrics.add(CommandRecord('which', 'run', 0.5, exit_status=0, bytes_sent=13, stdout_bytes=20))
+    metrics.add(CommandRecord('which', 'run', 0.25, exit_status=1, bytes_sent=13, stderr_bytes=7))
+    metrics.add(CommandRecord('launch', 'run', 0.1, bytes_sent=100))
+    assert metrics.round_trips == 3
+    assert metrics.failures == 1
+    summary = metrics.summary()
+    assert summary['which'] == {
+        'calls': 2,
+        'duration': 0.75,
+        'bytes_sent': 26,
+        'bytes_received': 27,
+        'failures': 1,
+    }
+    assert summary['launch']['failures'] == 0
+    assert metrics.to_dict()['records'][2]['exit_status'] is None
+    assert metrics.render().row_count == 2
+
+
+def test_command_record_describe():
+    record = CommandRecord('probe', 'channel', 0.1234, exit_status=0, stdout_bytes=42)
+    assert (
+        record.describe() == 'probe (channel): 0.123 s, exit 0, 0 B sent, 42 B stdout, 0 B stderr'
+    )
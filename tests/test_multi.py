@@ -0,0 +1,101 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from jupyter_forward.multi import MultiRunner
+
+
+class FakeRunner:
+    delays = {'slow': 0.6, 'fast': 0.1, 'broken': 0.1}
+
+    def __init__(self, host, port, **kwargs):
+        if host == 'unreachable':
+            raise SystemExit(1)
+        self.host = host
+        self.port = port
+        self.kwargs = kwargs
+        self.port_forwarding = kwargs.get('port_forwarding', True)
+        self.status = 'connected'
+        self.forward = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self):
+        time.sleep(self.delays.get(self.host, 0.1))
+        if self.host == 'broken':
+            self.status = 'failed: jupyter not found'
+            return
+        self.parsed_result = {'token': 'abc', 'url': f'http://{self.host}:1234/?token=abc'}
+        self.status = 'ready'
+        self._ready.set()
+        self._stop.wait()
+        self.status = 'stopped'
+
+    def stop(self):
+        self._stop.set()
+
+
+@pytest.fixture
+def fake_runner():
+    taken = []
+
+    def reserve_port(start, end):
+        port = max([start - 1, *taken]) + 1
+        taken.append(port)
+        return mock.Mock(**{'getsockname.return_value': ('127.0.0.1', port)})
+
+    with (
+        mock.patch('jupyter_forward.multi.RemoteRunner', FakeRunner),
+        mock.patch('jupyter_forward.multi.reserve_port', reserve_port),
+    ):
+        yield
+
+
+def test_multi_runner_concurrent(fake_runner):
+    multi = MultiRunner(['slow', 'fast', 'broken', 'unreachable'], port=9000)
+    assert [session.port for session in multi.sessions] == [9000, 9001, 9002, 9003]
+    start = time.monotonic()
+    sessions = multi.launch()
+    elapsed = time.monotonic() - start
+    try:
+        assert elapsed < 1.2
+        status = {session.host: session.status for session in sessions}
+        assert status['slow'] == status['fast'] == 'ready'
+        assert status['broken'] == 'failed: jupyter not found'
+        assert status['unreachable'].startswith('failed')
+        assert sessions[0].runner.kwargs['show_progress'] is False
+        assert sessions[0].runner.kwargs['follow_logs'] is False
+    finally:
+        multi.stop()
+    assert sessions[0].runner.status == 'stopped'
+
+
+def test_multi_runner_render(fake_runner):
+    multi = MultiRunner(['fast'], port=9000)
+    multi.launch()
+    try:
+        table = multi.render()
+        assert table.row_count == 1
+    finally:
+        multi.stop()
+
+
+def test_multi_runner_duplicate_hosts(fake_runner):
+    with pytest.raises(ValueError):
+        MultiRunner(['fast', 'fast'])
+
+
+def test_multi_runner_reserves_ports():
+    multi = MultiRunner(['a', 'b', 'c'], port='auto', runner_kwargs={'port_range': (20000, 20100)})
+    try:
+        ports = [session.port for session in multi.sessions]
+        assert len(set(ports)) == 3
+        for session in multi.sessions:
+            # Each port is held by its listener until the runner forwards it
+            assert session.listener.getsockname()[1] == session.port
+    finally:
+        for session in multi.sessions:
+            session.listener.close()
+        multi._pool.shutdown()
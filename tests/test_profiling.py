@@ -0,0 +1,98 @@
+import json
+import threading
+
+import pytest
+
+from jupyter_forward.profiling import Profiler, phase
+
+
+def test_spans_nest_and_count_innermost():
+    profiler = Profiler(name='eniac01')
+    with profiler.span('start Jupyter Lab'):
+        profiler.count(bytes_sent=10, bytes_received=100)
+        with profiler.span('conda activation'):
+            profiler.count()
+            profiler.count(bytes_received=5)
+    # Outside of any phase nothing is recorded
+    profiler.count()
+
+    outer, inner = profiler.spans
+    assert (outer.name, outer.depth, outer.commands) == ('start Jupyter Lab', 0, 1)
+    assert (outer.bytes_sent, outer.bytes_received) == (10, 100)
+    assert (inner.name, inner.depth, inner.commands, inner.bytes_received) == (
+        'conda activation',
+        1,
+        2,
+        5,
+    )
+    assert outer.start <= inner.start <= inner.end <= outer.end
+    assert profiler.total == pytest.approx(outer.duration)
+
+
+def test_spans_per_thread():
+    profiler = Profiler()
+
+    def work():
+        with profiler.span('worker'):
+            profiler.count()
+
+    with profiler.span('main'):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+
+    spans = {span.name: span for span in profiler.spans}
+    assert spans['worker'].depth == 0
+    assert spans['worker'].commands == 1
+    assert spans['main'].commands == 0
+    assert spans['worker'].thread_id != spans['main'].thread_id
+
+
+def test_phase_decorator():
+    class Runner:
+        def __init__(self):
+            self.profiler = Profiler()
+
+        @phase('probe')
+        def probe(self, value):
+            self.profiler.count()
+            return value
+
+    runner = Runner()
+    assert runner.probe(42) == 42
+    assert [(span.name, span.commands) for span in runner.profiler.spans] == [('probe', 1)]
+
+
+@pytest.mark.parametrize('format', ['json', 'chrome'])
+def test_export(tmp_path, format):
+    profiler = Profiler(name='eniac01')
+    with profiler.span('authenticate'):
+        profiler.count(bytes_received=3)
+    path = tmp_path / 'profile.json'
+    profiler.export(path, format=format)
+    data = json.loads(path.read_text())
+    if format == 'json':
+        assert data['name'] == 'eniac01'
+        assert data['spans'][0]['name'] == 'authenticate'
+        assert data['spans'][0]['bytes_received'] == 3
+    else:
+        (event,) = [event for event in data['traceEvents'] if event['ph'] == 'X']
+        assert event['name'] == 'authenticate'
+        assert event['dur'] >= 0
+        assert event['args']['commands'] == 1
+
+
+def test_export_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        Profiler().export(tmp_path / 'profile.txt', format='yaml')
+
+
+def test_render():
+    profiler = Profiler(name='eniac01')
+    with profiler.span('authenticate'):
+        pass
+    with profiler.span('probe'):
+        profiler.count(bytes_sent=2048)
+    table = profiler.render()
+    # One row per phase plus the total
+    assert table.row_count == 3
@@ -0,0 +1,241 @@
+import base64
+import hashlib
+import http.client
+import http.server
+import json
+import socket
+import threading
+
+import pytest
+
+from jupyter_forward.proxy import AssetCache, CachedResponse, CachingProxy, has_content_hash
+
+
+class _JupyterHandler(http.server.BaseHTTPRequestHandler):
+    """Answers like a Jupyter server and records every request it receives"""
+
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def _send(self, body, content_type='application/json', headers=()):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path))
+        if self.path.endswith('/api'):
+            self._send(json.dumps({'version': '2.0.0'}).encode())
+        elif self.path.startswith('/static/'):
+            self._send(f'asset {self.path}'.encode(), 'text/javascript')
+        elif self.path.startswith('/lab/api/themes/'):
+            self._send(b'body {}', 'text/css', [('Set-Cookie', '_xsrf=1')])
+        elif self.path == '/api/events':
+            # No Content-Length, so that the proxy has to relay the body in chunks
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in (b'first', b'second'):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        elif self.path == '/api/kernels/1/channels':
+            self._echo_websocket()
+        else:
+            self._send(b'{"content": null}')
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.requests.append(('PUT', self.path))
+        self._send(body)
+
+    def _echo_websocket(self):
+        key = self.headers['Sec-WebSocket-Key']
+        accept = base64.b64encode(
+            hashlib.sha1(f'{key}258EAFA5-E914-47DA-95CA-C5AB0DC85B11'.encode()).digest()
+        )
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept.decode())
+        self.end_headers()
+        while data := self.connection.recv(4096):
+            self.connection.sendall(data)
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def jupyter_server():
+    _JupyterHandler.requests = []
+    server = http.server.ThreadingHTTPServer(('localhost', 0), _JupyterHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def proxy(jupyter_server, tmp_path):
+    with CachingProxy(
+        jupyter_server.server_address[1], cache=AssetCache(tmp_path / 'assets')
+    ) as proxy:
+        yield proxy
+
+
+def _get(port, path, method='GET', body=None):
+    connection = http.client.HTTPConnection('localhost', port, timeout=10)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def test_asset_cache_lru(tmp_path):
+    cache = AssetCache(tmp_path, max_size=2500)
+    for key in 'abc':
+        assert cache.put(key, CachedResponse(200, [('Content-Type', 'text/css')], b'x' * 1000))
+    # The oldest entry is evicted once the files exceed max_size
+    assert 'a' not in cache
+    assert cache.get('b').body == b'x' * 1000
+    cache.put('d', CachedResponse(200, [], b'y' * 1000))
+    # `b` was used more recently than `c`
+    assert 'b' in cache
+    assert 'c' not in cache
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['b', 'd']
+    assert cache.size <= 2500
+    assert not cache.put('e', CachedResponse(200, [], b'z' * (cache.max_entry_size + 1)))
+
+
+def test_asset_cache_persistent(tmp_path):
+    AssetCache(tmp_path).put('a', CachedResponse(200, [('ETag', '"1"')], b'body'))
+    cache = AssetCache(tmp_path)
+    assert len(cache) == 1
+    assert cache.get('a') == CachedResponse(200, [('ETag', '"1"')], b'body')
+
+
+def test_asset_cache_corrupted_entry(tmp_path):
+    cache = AssetCache(tmp_path)
+    cache.put('a', CachedResponse(200, [], b'body'))
+    (tmp_path / 'a').write_bytes(b'not json\n')
+    assert cache.get('a') is None
+    assert 'a' not in cache
+    assert cache.size == 0
+
+
+def test_proxy_caches_static_assets(proxy, jupyter_server):
+    for _ in range(3):
+        status, headers, body = _get(proxy.local_port, '/static/lab/main.js?v=abc')
+        assert status == 200
+        assert body == b'asset /static/lab/main.js?v=abc'
+        assert headers['Content-Type'] == 'text/javascript'
+    assert _JupyterHandler.requests == [('GET', '/api'), ('GET', '/static/lab/main.js?v=abc')]
+    assert (proxy.stats.hits, proxy.stats.misses) == (2, 1)
+    assert proxy.stats.bytes_from_cache == 2 * len(body)
+
+
+def test_proxy_cache_key_includes_server_version(proxy):
+    key = proxy.cache_key('GET', '/static/lab/main.js?v=abc', {})
+    proxy._version = '2.1.0'
+    assert proxy.cache_key('GET', '/static/lab/main.js?v=abc', {}) != key
+    assert proxy.cache_key('GET', '/api/contents', {}) is None
+    assert proxy.cache_key('POST', '/static/lab/main.js?v=abc', {}) is None
+    assert proxy.cache_key('GET', '/static/lab/main.js?v=abc', {'Range': 'bytes=0-10'}) is None
+
+
+@pytest.mark.parametrize(
+    'path, expected',
+    [
+        ('static/lab/main.js?v=0d1f109c3d842497fd51', True),
+        ('static/lab/1036.0d1f109c3d842497fd51.js', True),
+        ('lab/extensions/ext/static/remoteEntry.a7b5d8f1e2c3.js', True),
+        ('static/lab/main.js', False),
+        ('static/lab/main.js?v=', False),
+        ('lab/api/themes/@jupyterlab/theme-light-extension/index.css', False),
+        ('static/lab/vendors-node_modules_lumino.js', False),
+    ],
+)
+def test_has_content_hash(path, expected):
+    assert has_content_hash(path) is expected
+
+
+def test_proxy_does_not_cache_unhashed_assets(proxy):
+    # An upgraded JupyterLab or extension changes them without changing the server version
+    for _ in range(2):
+        assert _get(proxy.local_port, '/static/lab/theme.css')[0] == 200
+    assert proxy.cache_key('GET', '/lab/api/themes/light/index.css', {}) is None
+    assert _JupyterHandler.requests.count(('GET', '/static/lab/theme.css')) == 2
+    assert (proxy.stats.hits, proxy.stats.misses) == (0, 0)
+
+
+def test_proxy_base_url(jupyter_server, tmp_path):
+    with CachingProxy(
+        jupyter_server.server_address[1], base_url='/user/me/', cache=AssetCache(tmp_path)
+    ) as proxy:
+        assert proxy.cache_key('GET', '/static/lab/main.js?v=abc', {}) is None
+        assert proxy.cache_key('GET', '/user/me/static/lab/main.js?v=abc', {}) is not None
+    assert ('GET', '/user/me/api') in _JupyterHandler.requests
+
+
+def test_proxy_passes_api_requests_through(proxy):
+    for _ in range(2):
+        status, _, body = _get(proxy.local_port, '/api/contents/x.ipynb', 'PUT', b'{"a": 1}')
+        assert (status, body) == (200, b'{"a": 1}')
+    assert _JupyterHandler.requests.count(('PUT', '/api/contents/x.ipynb')) == 2
+    for _ in range(2):
+        assert _get(proxy.local_port, '/lab/api/themes/light.css?v=abc')[2] == b'body {}'
+    # Responses that set cookies are never cached
+    assert proxy.stats.hits == 0
+    assert proxy.stats.misses == 2
+
+
+def test_proxy_relays_chunked_responses(proxy):
+    status, headers, body = _get(proxy.local_port, '/api/events')
+    assert status == 200
+    assert body == b'firstsecond'
+    assert headers['Transfer-Encoding'] == 'chunked'
+
+
+def test_proxy_relays_websockets(proxy):
+    with socket.create_connection(('localhost', proxy.local_port), timeout=10) as sock:
+        sock.sendall(
+            b'GET /api/kernels/1/channels HTTP/1.1\r\n'
+            b'Host: localhost\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+            b'Sec-WebSocket-Version: 13\r\n\r\n'
+        )
+        response = b''
+        while b'\r\n\r\n' not in response:
+            response += sock.recv(4096)
+        assert response.startswith(b'HTTP/1.1 101')
+        assert b's3pPLMBiTxaQ9kYGzzhZRbK+xOo=' in response
+        sock.sendall(b'frame')
+        assert sock.recv(4096) == b'frame'
+
+
+def test_proxy_upstream_unreachable(tmp_path):
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+    with CachingProxy(port, cache=AssetCache(tmp_path)) as proxy:
+        assert _get(proxy.local_port, '/static/lab/main.js')[0] == 502
+
+
+def test_proxy_listener(jupyter_server, tmp_path):
+    listener = socket.create_server(('localhost', 0))
+    port = listener.getsockname()[1]
+    with CachingProxy(
+        jupyter_server.server_address[1], cache=AssetCache(tmp_path), listener=listener
+    ) as proxy:
+        assert proxy.local_port == port
+        assert _get(port, '/static/lab/main.js')[2] == b'asset /static/lab/main.js'
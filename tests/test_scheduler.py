@@ -0,0 +1,198 @@
+import os
+import subprocess
+import threading
+
+import pytest
+
+from jupyter_forward.scheduler import (
+    JobStatus,
+    JobWatcher,
+    detect_scheduler,
+    parse_job_id,
+    parse_job_status,
+)
+
+# Each call prints the first line of `states` and drops it, except for the last one
+FAKE_STATUS = """\
+state=$(head -n 1 "{states}")
+if [ "$(wc -l < "{states}")" -gt 1 ]; then
+    tail -n +2 "{states}" > "{states}.tmp" && mv "{states}.tmp" "{states}"
+fi
+echo "$state"
+"""
+
+
+@pytest.fixture
+def fake_scheduler(tmp_path):
+    """Installs fake qsub, qstat, qdel, sbatch, squeue and scancel commands on a PATH"""
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    states = tmp_path / 'states'
+    scripts = {
+        'qsub': 'echo 1234.desched1',
+        'sbatch': 'echo Submitted batch job 5678',
+        'qstat': FAKE_STATUS.format(states=states),
+        'squeue': FAKE_STATUS.format(states=states),
+        'qdel': f'echo "$1" > {tmp_path / "cancelled"}',
+        'scancel': f'echo "$1" > {tmp_path / "cancelled"}',
+    }
+    for name, body in scripts.items():
+        path = bin_dir / name
+        path.write_text(f'#!/bin/sh\n{body}\n')
+        path.chmod(0o755)
+    env = {**os.environ, 'PATH': f'{bin_dir}:{os.environ["PATH"]}'}
+    calls = []
+
+    def run(command):
+        calls.append(command)
+        result = subprocess.run(command, shell=True, capture_output=True, text=True, env=env)
+        return result.returncode, result.stdout + result.stderr
+
+    def set_states(*lines):
+        states.write_text(''.join(f'{line}\n' for line in lines))
+
+    run.calls = calls
+    run.set_states = set_states
+    run.cancelled = tmp_path / 'cancelled'
+    return run
+
+
+@pytest.mark.parametrize(
+    'launch_command, expected',
+    [
+        ('qsub -q regular -l select=1:ncpus=36', 'pbs'),
+        ('/opt/pbs/bin/qsub -A AABD1115', 'pbs'),
+        ('sbatch --partition=debug', 'slurm'),
+        ('salloc -A AABD1115 -t 00:05:00 srun', None),
+        (None, None),
+    ],
+)
+def test_detect_scheduler(launch_command, expected):
+    assert detect_scheduler(launch_command) == expected
+
+
+@pytest.mark.parametrize(
+    'scheduler, output, expected',
+    [
+        ('pbs', '1234567.desched1\n', '1234567.desched1'),
+        ('pbs', 'Welcome to Casper!\r\n123[].server\r\n', '123[].server'),
+        ('slurm', 'Submitted batch job 98765\n', '98765'),
+        ('slurm', '98765;perlmutter\n', '98765'),
+        ('slurm', 'sbatch: error: Batch job submission failed\n', None),
+    ],
+)
+def test_parse_job_id(scheduler, output, expected):
+    assert parse_job_id(scheduler, output) == expected
+
+
+@pytest.mark.parametrize(
+    'scheduler, exit_status, output, expected',
+    [
+        (
+            'pbs',
+            0,
+            'Job Id: 1.server\n    job_state = Q\n    comment = Not Running: Insufficient amount of resource\n',
+            JobStatus('queued', 'Q', 'Not Running: Insufficient amount of resource'),
+        ),
+        ('pbs', 0, 'Job Id: 1.server\n    job_state = R\n', JobStatus('running', 'R')),
+        (
+            'pbs',
+            35,
+            'qstat: 1.server Job has finished, use -x or -H to obtain historical job information',
+            JobStatus('finished'),
+        ),
+        ('pbs', 153, 'qstat: Unknown Job Id 1.server', JobStatus('finished')),
+        ('pbs', 127, 'qstat: command not found', JobStatus('unknown')),
+        (
+            'slurm',
+            0,
+            'PENDING|Priority|2026-10-18T12:00:00\n',
+            JobStatus('queued', 'PENDING', 'Priority', '2026-10-18T12:00:00'),
+        ),
+        (
+            'slurm',
+            0,
+            'RUNNING|None|2026-10-18T12:00:00\n',
+            JobStatus('running', 'RUNNING', None, '2026-10-18T12:00:00'),
+        ),
+        ('slurm', 0, 'CANCELLED|None|N/A\n', JobStatus('finished', 'CANCELLED')),
+        ('slurm', 0, '', JobStatus('finished')),
+        (
+            'slurm',
+            1,
+            'slurm_load_jobs error: Invalid job id specified',
+            JobStatus('finished'),
+        ),
+        ('slurm', 1, 'slurm_load_jobs error: Socket timed out', JobStatus('unknown')),
+    ],
+)
+def test_parse_job_status(scheduler, exit_status, output, expected):
+    assert parse_job_status(scheduler, exit_status, output) == expected
+
+
+@pytest.mark.parametrize(
+    'scheduler, submit, queued, running',
+    [
+        ('pbs', 'qsub job.sh', '    job_state = Q', '    job_state = R'),
+        ('slurm', 'sbatch job.sh', 'PENDING|Priority|N/A', 'RUNNING|None|N/A'),
+    ],
+)
+def test_wait_until_running(fake_scheduler, scheduler, submit, queued, running):
+    _, output = fake_scheduler(submit)
+    job_id = parse_job_id(scheduler, output)
+    fake_scheduler.set_states(queued, queued, queued, running)
+    changes = []
+    watcher = JobWatcher(
+        scheduler, job_id, run=fake_scheduler, poll_interval=0.01, max_poll_interval=0.05
+    )
+    status = watcher.wait_until_running(on_change=changes.append)
+    assert status.state == watcher.state == 'running'
+    assert [change.state for change in changes] == ['queued', 'running']
+    assert watcher.polls == 4
+    assert all(job_id in command for command in fake_scheduler.calls[1:])
+
+
+def test_wait_until_running_backoff(fake_scheduler):
+    fake_scheduler.set_states('PENDING|Priority|N/A')
+    sleeps = []
+
+    class Stop(threading.Event):
+        def wait(self, timeout=None):
+            sleeps.append(timeout)
+            return len(sleeps) >= 6
+
+    watcher = JobWatcher(
+        'slurm', '1', run=fake_scheduler, poll_interval=1, max_poll_interval=3, stop=Stop()
+    )
+    with pytest.raises(RuntimeError, match='Stopped waiting'):
+        watcher.wait_until_running()
+    assert sleeps == [1, 1.5, 2.25, 3, 3, 3]
+
+
+def test_wait_until_running_timeout_and_cancel(fake_scheduler):
+    fake_scheduler.set_states('    job_state = Q')
+    watcher = JobWatcher(
+        'pbs', '1234.desched1', run=fake_scheduler, poll_interval=0.01, timeout=0.1
+    )
+    with pytest.raises(TimeoutError):
+        watcher.wait_until_running()
+    assert watcher.cancel()
+    assert watcher.cancelled
+    assert fake_scheduler.cancelled.read_text().strip() == '1234.desched1'
+
+
+def test_wait_until_running_gives_up_on_errors():
+    watcher = JobWatcher(
+        'slurm',
+        '1',
+        run=lambda command: (1, 'slurm_load_jobs error: Socket timed out'),
+        poll_interval=0.001,
+        max_errors=3,
+    )
+    assert watcher.wait_until_running().state == 'unknown'
+    assert watcher.polls == 3
+
+
+def test_job_watcher_unknown_scheduler():
+    with pytest.raises(ValueError):
+        JobWatcher('lsf', '1', run=lambda command: (0, ''))
@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from jupyter_forward.helpers import PROBE_PREFIX
+from jupyter_forward.services import parse_forward_spec, parse_port_scan, port_scan_script
+
+
+@pytest.mark.parametrize(
+    'spec, expected',
+    [('8787', (8787, 8787)), ('6006:16006', (6006, 16006)), (8787, (8787, 8787))],
+)
+def test_parse_forward_spec(spec, expected):
+    assert parse_forward_spec(spec) == expected
+
+
+@pytest.mark.parametrize('spec', ['', 'dask', '8787:', '8787:abc', '0', '70000', '1:2:3'])
+def test_parse_forward_spec_error(spec):
+    with pytest.raises(ValueError, match='Invalid forward'):
+        parse_forward_spec(spec)
+
+
+def test_parse_port_scan():
+    stdout = '\n'.join(
+        [
+            'Welcome to eniac!',
+            f'{PROBE_PREFIX} listen=0100007F:2253',
+            f'{PROBE_PREFIX} listen=00000000:1F90',
+            f'{PROBE_PREFIX} listen=0000000000000000FFFF00000100007F:178E',
+            f'{PROBE_PREFIX} listen=00000000000000000000000000000000:22B8',
+            f'{PROBE_PREFIX} listen=0100007F:D431',
+            f'{PROBE_PREFIX} kernel=54321',
+            f'{PROBE_PREFIX} listen=garbage',
+        ]
+    )
+    assert parse_port_scan(stdout) == [
+        ('127.0.0.1', 6030),
+        ('127.0.0.1', 8787),
+        ('localhost', 8080),
+        ('localhost', 8888),
+    ]
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/net/tcp'), reason='requires /proc')
+def test_port_scan_script(tmp_path):
+    # A "server" whose child, like a kernel, listens on two ports, one of them a kernel channel
+    child = (
+        'import socket, time\n'
+        'service = socket.create_server(("127.0.0.1", 0))\n'
+        'channel = socket.create_server(("127.0.0.1", 0))\n'
+        'print(service.getsockname()[1], channel.getsockname()[1], flush=True)\n'
+        'time.sleep(60)\n'
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            '-c',
+            f'import subprocess, sys; subprocess.run([sys.executable, "-c", {child!r}])',
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        service_port, channel_port = map(int, server.stdout.readline().split())
+        (tmp_path / 'kernel-1.json').write_text(json.dumps({'shell_port': channel_port}))
+        for _ in range(50):
+            result = subprocess.run(
+                ['sh', '-s'],
+                input=port_scan_script(server.pid, str(tmp_path)),
+                capture_output=True,
+                text=True,
+            )
+            if ports := parse_port_scan(result.stdout):
+                break
+            time.sleep(0.1)
+        assert ports == [('127.0.0.1', service_port)]
+    finally:
+        server.kill()
+        subprocess.run(['pkill', '-P', str(server.pid)], check=False)
+        server.wait()
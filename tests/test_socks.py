@@ -0,0 +1,115 @@
+import socket
+import struct
+import time
+
+import pytest
+
+from jupyter_forward.forwarding import ForwardingEngine
+from jupyter_forward.socks import (
+    ADDRESS_TYPE_NOT_SUPPORTED,
+    COMMAND_NOT_SUPPORTED,
+    HOST_UNREACHABLE,
+    NOT_ALLOWED,
+    SUCCEEDED,
+    Socks5Handshake,
+)
+
+from .test_forwarding import FakeTransport, _exchange, echo_server  # noqa: F401
+
+
+def _connect(port, host, destination_port, command=1, methods=b'\x00'):
+    """Sends a SOCKS5 request for `host` and returns the socket and the reply code"""
+    sock = socket.create_connection(('localhost', port), timeout=10)
+    sock.sendall(bytes([5, len(methods)]) + methods)
+    method = sock.recv(2)
+    if method != b'\x05\x00':
+        return sock, method
+    if isinstance(host, bytes):
+        address = host
+    else:
+        address = bytes([3, len(host)]) + host.encode()
+    sock.sendall(bytes([5, command, 0]) + address + struct.pack('!H', destination_port))
+    reply = b''
+    while len(reply) < 10:
+        data = sock.recv(10 - len(reply))
+        if not data:
+            break
+        reply += data
+    return sock, reply[1] if len(reply) == 10 else None
+
+
+def test_socks_connect(echo_server):  # noqa: F811
+    transport = FakeTransport()
+    with ForwardingEngine() as engine:
+        forward = engine.dynamic_forward(transport, Socks5Handshake())
+        for host in ('localhost', b'\x01\x7f\x00\x00\x01'):
+            sock, reply = _connect(forward.local_port, host, echo_server)
+            with sock:
+                assert reply == SUCCEEDED
+                sock.sendall(b'hello')
+                assert sock.recv(5) == b'hello'
+        assert transport.opened == [('localhost', echo_server), ('127.0.0.1', echo_server)]
+        deadline = time.monotonic() + 5
+        while forward.stats.active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert forward.stats.connections == 2
+        assert forward.stats.bytes_sent == forward.stats.bytes_received == 10
+
+
+def test_socks_allowlist(echo_server):  # noqa: F811
+    transport = FakeTransport()
+    with ForwardingEngine() as engine:
+        forward = engine.dynamic_forward(transport, Socks5Handshake(allow=('LOCAL*',)))
+        sock, reply = _connect(forward.local_port, 'localhost', echo_server)
+        sock.close()
+        assert reply == SUCCEEDED
+        sock, reply = _connect(forward.local_port, 'node01.cluster', 8787)
+        sock.close()
+        assert reply == NOT_ALLOWED
+    assert transport.opened == [('localhost', echo_server)]
+
+
+@pytest.mark.parametrize(
+    'kwargs, expected',
+    [
+        ({'command': 2}, COMMAND_NOT_SUPPORTED),
+        ({'host': b'\x09'}, ADDRESS_TYPE_NOT_SUPPORTED),
+        ({'methods': b'\x02'}, b'\x05\xff'),
+    ],
+)
+def test_socks_unsupported_requests(kwargs, expected):
+    transport = FakeTransport()
+    with ForwardingEngine() as engine:
+        forward = engine.dynamic_forward(transport, Socks5Handshake())
+        kwargs = {'host': 'localhost', **kwargs}
+        sock, reply = _connect(forward.local_port, destination_port=8787, **kwargs)
+        sock.close()
+    assert reply == expected
+    assert transport.opened == []
+
+
+def test_socks_channel_failure():
+    transport = FakeTransport(fail=True)
+    with ForwardingEngine() as engine:
+        forward = engine.dynamic_forward(transport, Socks5Handshake())
+        sock, reply = _connect(forward.local_port, 'node01', 8787)
+        with sock:
+            assert reply == HOST_UNREACHABLE
+            assert sock.recv(1) == b''
+        assert forward.stats.failed == 1
+
+
+def test_socks_idle_clients_do_not_block_forwards(echo_server):  # noqa: F811
+    transport = FakeTransport()
+    with ForwardingEngine(max_workers=1, max_handshakes=2) as engine:
+        socks = engine.dynamic_forward(transport, Socks5Handshake())
+        forward = engine.forward(transport, 'localhost', echo_server)
+        # Clients that never send their greeting keep the handshake threads busy
+        idle = [socket.create_connection(('localhost', socks.local_port)) for _ in range(3)]
+        try:
+            start = time.monotonic()
+            assert _exchange(forward.local_port, b'hello') == b'hello'
+            assert time.monotonic() - start < 5
+        finally:
+            for sock in idle:
+                sock.close()
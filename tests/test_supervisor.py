@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+
+from jupyter_forward.exceptions import ReauthenticationRequiredError
+from jupyter_forward.forwarding import ForwardingEngine
+from jupyter_forward.supervisor import TunnelSupervisor
+
+from .test_forwarding import FakeTransport, _exchange, echo_server  # noqa: F401
+
+
+class SupervisedTransport(FakeTransport):
+    """A fake transport whose liveness and keepalive answers can be controlled"""
+
+    def __init__(self):
+        super().__init__()
+        self.alive = True
+        self.hung = threading.Event()
+        self.keepalives = 0
+
+    def is_active(self):
+        return self.alive
+
+    def global_request(self, kind, wait=True):
+        self.keepalives += 1
+        while self.hung.is_set() and self.alive:
+            time.sleep(0.01)
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not met in time'
+        time.sleep(0.01)
+
+
+def _supervisor(transport, reconnect, **kwargs):
+    kwargs = {
+        'keepalive_interval': 0.05,
+        'keepalive_timeout': 0.2,
+        'retry_interval': 0.01,
+        **kwargs,
+    }
+    return TunnelSupervisor(transport, reconnect=reconnect, **kwargs)
+
+
+@pytest.mark.parametrize('failure', ['closed', 'hung'])
+def test_reconnect_moves_forward(echo_server, failure):  # noqa: F811
+    old, new = SupervisedTransport(), SupervisedTransport()
+    with ForwardingEngine() as engine, _supervisor(old, lambda: new) as supervisor:
+        forward = engine.forward(old, 'localhost', echo_server)
+        supervisor.supervise(forward)
+        local_port = forward.local_port
+        assert _exchange(local_port, b'before') == b'before'
+        _wait_until(lambda: old.keepalives)
+        if failure == 'closed':
+            old.alive = False
+        else:
+            old.hung.set()
+        _wait_until(lambda: forward.transport is new)
+        assert supervisor.reconnects == 1
+        assert supervisor.wait_for_transport() is new
+        # The local port stays the same and connections use the new transport
+        assert forward.local_port == local_port
+        assert _exchange(local_port, b'after') == b'after'
+        assert len(old.opened) == 1
+        assert len(new.opened) == 1
+        old.alive = False
+
+
+def test_connections_are_held_while_reconnecting(echo_server):  # noqa: F811
+    old, new = SupervisedTransport(), SupervisedTransport()
+    release = threading.Event()
+
+    def reconnect():
+        release.wait(5)
+        return new
+
+    with ForwardingEngine() as engine, _supervisor(old, reconnect) as supervisor:
+        forward = engine.forward(old, 'localhost', echo_server)
+        supervisor.supervise(forward)
+        old.alive = False
+        _wait_until(lambda: forward.suspended)
+        results = []
+        client = threading.Thread(
+            target=lambda: results.append(_exchange(forward.local_port, b'held'))
+        )
+        client.start()
+        time.sleep(0.1)
+        assert not results
+        release.set()
+        client.join(5)
+        assert results == [b'held']
+        assert not old.opened
+        assert forward.stats.failed == 0
+
+
+def test_reconnect_gives_up():
+    transport = SupervisedTransport()
+    failed = threading.Event()
+    attempts = []
+
+    def reconnect():
+        attempts.append(time.monotonic())
+        raise ConnectionError('network is unreachable')
+
+    with _supervisor(
+        transport, reconnect, reconnect_timeout=0.2, on_failure=lambda error: failed.set()
+    ) as supervisor:
+        transport.alive = False
+        assert supervisor.wait_for_transport() is None
+        assert failed.wait(5)
+        assert supervisor.failed
+        assert not supervisor.connected
+        assert len(attempts) > 1
+
+
+def test_reconnect_requires_reauthentication():
+    transport = SupervisedTransport()
+    failed = threading.Event()
+    attempts = []
+
+    def reconnect():
+        attempts.append(time.monotonic())
+        raise ReauthenticationRequiredError('Re-authentication required')
+
+    with _supervisor(transport, reconnect, on_failure=lambda error: failed.set()) as supervisor:
+        transport.alive = False
+        assert supervisor.wait_for_transport() is None
+        assert failed.wait(5)
+        # Retrying cannot succeed without the user
+        assert len(attempts) == 1
+        assert supervisor.error == 'Re-authentication required'
+
+
+def test_wait_for_transport_when_alive():
+    transport = SupervisedTransport()
+    with _supervisor(transport, lambda: pytest.fail('should not reconnect')) as supervisor:
+        assert supervisor.wait_for_transport() is transport
+        assert supervisor.is_alive()
+    assert supervisor.reconnects == 0